@@ -0,0 +1,82 @@
+# analytics/abc.py
+"""
+Clasificación ABC (Pareto) calculada con funciones ventana.
+
+La BD agrupa por id (cliente, producto, proveedor), calcula el acumulado
+SUM(revenue) OVER (ORDER BY revenue DESC, id) y el total SUM(revenue) OVER (),
+y las filas se leen en streaming (iterator) ya ordenadas: en Python solo se
+compara el acumulado con los cortes de la regla, fila a fila.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, RowRange, Window
+from rest_framework.exceptions import ValidationError
+
+from .aggregation import _GrandTotal
+
+CLASSES = ("a", "b", "c")
+_DEC = DecimalField(max_digits=24, decimal_places=6)
+
+
+def parse_rule(rule: str):
+    """
+    "80-15-5" -> (80, 15, 5). Los tres tramos deben sumar 100.
+    """
+    try:
+        a, b, c = (int(x) for x in (rule or "").split("-"))
+    except ValueError:
+        raise ValidationError({"rule": "Formato inválido. Usa A-B-C, p.ej. 80-15-5."})
+    if min(a, b, c) < 0 or a + b + c != 100:
+        raise ValidationError({"rule": "Los tres tramos deben ser positivos y sumar 100."})
+    return a, b, c
+
+
+def iter_abc(grouped_qs, key_field: str, rule: str = "80-15-5", chunk_size: int = 2000):
+    """
+    grouped_qs: queryset ya agrupado con values(key_field, ...).annotate(revenue=Sum(...)).
+
+    Genera dicts con las columnas de values() + revenue, cumulative,
+    cumulative_share y abc_class ("a" | "b" | "c"), en orden de revenue DESC.
+    """
+    a, b, _ = parse_rule(rule)
+    order = [F("revenue").desc(), F(key_field).asc()]
+    rows = grouped_qs.annotate(
+        cumulative=Window(
+            _GrandTotal(F("revenue"), function="SUM", output_field=_DEC),
+            order_by=order,
+            frame=RowRange(start=None, end=0),
+        ),
+        grand_total=Window(_GrandTotal(F("revenue"), function="SUM", output_field=_DEC)),
+    ).order_by(*order)
+
+    a_cut = Decimal(a) / 100
+    b_cut = Decimal(a + b) / 100
+    for row in rows.iterator(chunk_size=chunk_size):
+        total = row.pop("grand_total") or Decimal("0")
+        share = (row["cumulative"] / total) if total else Decimal("0")
+        row["cumulative_share"] = share.quantize(Decimal("0.000001"))
+        if share <= a_cut:
+            row["abc_class"] = "a"
+        elif share <= b_cut:
+            row["abc_class"] = "b"
+        else:
+            row["abc_class"] = "c"
+        yield row
+
+
+def summarize_abc(rows, item, rule: str):
+    """
+    Agrupa la salida de iter_abc en el formato clásico del endpoint:
+    {"rule", "a": [...], "b": [...], "c": [...], "total", "summary"}.
+    `item(row)` construye el dict público de cada fila.
+    """
+    out = {cls: [] for cls in CLASSES}
+    summary = {cls: {"count": 0, "revenue": Decimal("0")} for cls in CLASSES}
+    total = Decimal("0")
+    for row in rows:
+        cls = row["abc_class"]
+        out[cls].append(item(row))
+        summary[cls]["count"] += 1
+        summary[cls]["revenue"] += row["revenue"]
+        total += row["revenue"]
+    return {"rule": rule, **out, "total": total, "summary": summary}
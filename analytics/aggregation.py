@@ -0,0 +1,128 @@
+# analytics/aggregation.py
+"""
+Motor genérico de agregación por periodos.
+
+Cualquier métrica (base facturada, IVA, importe de gasto, recuentos...) se
+declara como un aggregate de Django y se calcula en UNA sola consulta por
+tabla de origen: GROUP BY del periodo truncado + totales generales calculados
+en la propia BD con una ventana (SUM(...) OVER ()), sin sumar Decimals en Python.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, F, Func, IntegerField, Window
+from django.db.models.functions import (
+    TruncDay,
+    TruncMonth,
+    TruncQuarter,
+    TruncWeek,
+    TruncYear,
+)
+
+PERIOD_TRUNCS = {
+    "day": TruncDay,
+    "week": TruncWeek,
+    "month": TruncMonth,
+    "quarter": TruncQuarter,
+    "year": TruncYear,
+}
+
+# Cómo se "re-agrega" cada aggregate para obtener el total general
+# a partir de las filas ya agrupadas (COUNT por periodo -> SUM de recuentos).
+_GRAND_TOTAL_FUNCTIONS = {
+    "SUM": "SUM",
+    "COUNT": "SUM",
+    "MAX": "MAX",
+    "MIN": "MIN",
+}
+
+
+class _GrandTotal(Func):
+    """
+    SUM/MAX/MIN(<aggregate>) OVER () sobre una anotación ya agregada.
+    Django no permite Sum(Sum(...)); como Func simple sí entra en Window.
+    """
+    window_compatible = True
+
+
+def normalize_group_by(group_by, default: str = "month", allowed=None) -> str:
+    allowed = allowed or PERIOD_TRUNCS.keys()
+    group_by = (group_by or default).lower()
+    if group_by not in allowed:
+        group_by = default
+    return group_by
+
+
+def period_label(value, group_by: str) -> str:
+    """
+    Etiqueta estable del periodo a partir del inicio truncado:
+    day=YYYY-MM-DD, week=YYYY-Www (ISO), month=YYYY-MM, quarter=YYYY-Qn, year=YYYY.
+    """
+    if hasattr(value, "date"):
+        value = value.date()
+    if group_by == "day":
+        return value.isoformat()
+    if group_by == "week":
+        iso_year, iso_week, _ = value.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}"
+    if group_by == "quarter":
+        return f"{value.year}-Q{(value.month - 1) // 3 + 1}"
+    if group_by == "year":
+        return str(value.year)
+    return f"{value.year}-{value.month:02d}"
+
+
+def _zero_for(aggregate):
+    # Sum("xxx_count", output_field=IntegerField()) también es un recuento
+    explicit = aggregate.__dict__.get("output_field")
+    if isinstance(aggregate, Count) or isinstance(explicit, IntegerField):
+        return 0
+    return Decimal("0.00")
+
+
+def aggregate_by_period(qs, date_field: str, metrics: dict, group_by: str = "month"):
+    """
+    Agrupa `qs` por periodo de `date_field` y calcula todas las `metrics`
+    ({"nombre_salida": Sum(...)/Count(...)}) en un único round trip.
+
+    Devuelve:
+    {
+      "group_by": "month",
+      "items": [{"period": "2025-01", "period_start": date, <métricas>}, ...],
+      "totals": {<métricas>},
+    }
+    """
+    group_by = normalize_group_by(group_by)
+    trunc = PERIOD_TRUNCS[group_by]
+
+    zeros = {name: _zero_for(agg) for name, agg in metrics.items()}
+    grand = {
+        f"_total_{name}": Window(
+            _GrandTotal(F(name), function=_GRAND_TOTAL_FUNCTIONS.get(agg.function, "SUM"))
+        )
+        for name, agg in metrics.items()
+    }
+
+    rows = (
+        qs.annotate(_period=trunc(date_field))
+        .values("_period")
+        .annotate(**metrics)
+        .annotate(**grand)
+        .order_by("_period")
+    )
+
+    items = []
+    totals = dict(zeros)
+    for row in rows:
+        start = row["_period"]
+        if start is None:
+            continue
+        if hasattr(start, "date"):
+            start = start.date()
+        item = {"period": period_label(start, group_by), "period_start": start}
+        for name in metrics:
+            item[name] = row[name] if row[name] is not None else zeros[name]
+            total = row[f"_total_{name}"]
+            totals[name] = total if total is not None else zeros[name]
+        items.append(item)
+
+    return {"group_by": group_by, "items": items, "totals": totals}
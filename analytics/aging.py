@@ -0,0 +1,121 @@
+# analytics/aging.py
+"""
+Motor de aging (antigüedad de deuda) calculado en la BD.
+
+- Pendiente = total - pagos con fecha <= as_of (subquery, sin multiplicar filas).
+- Los tramos se definen con "edges" en días de retraso: (30, 60, 90) ->
+  0-30 / 31-60 / 61-90 / >90. Cada tramo se traduce a un rango de due_date
+  respecto a as_of, así todo sale en un único SELECT con SUM(... FILTER/CASE).
+- Desglose opcional por cliente/proveedor con el mismo SELECT + GROUP BY.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from rest_framework.exceptions import ValidationError
+
+DEFAULT_EDGES = (30, 60, 90)
+MAX_EDGES = 12
+
+_DEC = DecimalField(max_digits=24, decimal_places=6)
+_ZERO = Value(Decimal("0.00"), output_field=_DEC)
+
+
+def parse_edges(raw):
+    """
+    "30,60,90" | [30, 60, 90] | None -> tupla creciente de enteros positivos.
+    """
+    if raw in (None, "", []):
+        return DEFAULT_EDGES
+    if isinstance(raw, str):
+        raw = [x for x in raw.split(",") if x.strip()]
+    try:
+        edges = tuple(int(x) for x in raw)
+    except (TypeError, ValueError):
+        raise ValidationError({"edges": "Debe ser una lista de días separada por comas (ej. 30,60,90)."})
+    if not edges or len(edges) > MAX_EDGES or any(e <= 0 for e in edges) or list(edges) != sorted(set(edges)):
+        raise ValidationError({"edges": f"Entre 1 y {MAX_EDGES} días positivos, en orden creciente y sin repetir."})
+    return edges
+
+
+def bucket_labels(edges):
+    labels = []
+    lower = 0
+    for edge in edges:
+        labels.append(f"{lower}-{edge}")
+        lower = edge + 1
+    labels.append(f">{edges[-1]}")
+    return labels
+
+
+def _bucket_filters(as_of, edges):
+    """
+    Retraso = as_of - due_date (las no vencidas cuentan como 0 días).
+    retraso <= N  <=>  due_date >= as_of - N
+    """
+    filters = []
+    previous = None
+    for edge in edges:
+        q = Q(due_date__gte=as_of - timedelta(days=edge))
+        if previous is not None:
+            q &= Q(due_date__lt=as_of - timedelta(days=previous))
+        filters.append(q)
+        previous = edge
+    filters.append(Q(due_date__lt=as_of - timedelta(days=edges[-1])))
+    return filters
+
+
+def compute_aging(qs, payment_model, *, as_of, issue_date_field, party_field, edges=DEFAULT_EDGES,
+                  breakdown=False, party_name=None):
+    """
+    qs: facturas contabilizadas de la org (Invoice / SupplierInvoice).
+    payment_model: Payment / SupplierPayment (FK `invoice`, campos amount/date).
+    party_field: "customer" / "supplier" para el desglose.
+    party_name: expresión con el nombre de la parte (se trae en el mismo SELECT).
+
+    Devuelve {"buckets": {tramo: importe}, "total": ..., "parties": [...]}.
+    """
+    labels = bucket_labels(edges)
+    filters = _bucket_filters(as_of, edges)
+
+    paid = (
+        payment_model.objects.filter(invoice=OuterRef("pk"), date__lte=as_of)
+        .values("invoice")
+        .annotate(s=Sum("amount"))
+        .values("s")
+    )
+    qs = (
+        qs.filter(due_date__isnull=False, **{f"{issue_date_field}__lte": as_of})
+        .annotate(_paid=Coalesce(Subquery(paid, output_field=_DEC), _ZERO))
+        .annotate(_pending=ExpressionWrapper(F("total") - F("_paid"), output_field=_DEC))
+        .filter(_pending__gt=0)
+        .order_by()
+    )
+
+    aggregates = {
+        f"b{i}": Coalesce(Sum("_pending", filter=f), _ZERO)
+        for i, f in enumerate(filters)
+    }
+    aggregates["total"] = Coalesce(Sum("_pending"), _ZERO)
+
+    totals = qs.aggregate(**aggregates)
+    result = {
+        "buckets": {label: totals[f"b{i}"] for i, label in enumerate(labels)},
+        "total": totals["total"],
+    }
+
+    if breakdown:
+        party_id = f"{party_field}_id"
+        extra = {"_name": party_name} if party_name is not None else {}
+        rows = qs.values(party_id, **extra).annotate(**aggregates).order_by("-total", party_id)
+        result["parties"] = [
+            {
+                "id": r[party_id],
+                "name": r.get("_name"),
+                "total": r["total"],
+                "buckets": {label: r[f"b{i}"] for i, label in enumerate(labels)},
+            }
+            for r in rows
+        ]
+    return result
@@ -0,0 +1,162 @@
+# analytics/cache.py
+"""
+Caché de resultados de analítica por organización.
+
+Clave = org + versión de la org + endpoint + query params normalizados.
+Cada escritura que afecta a la analítica (contabilizar facturas, cobros,
+pagos a proveedor, gastos...) incrementa la versión de la org, con lo que
+todas sus entradas anteriores dejan de ser alcanzables y caducan solas por TTL.
+No hay que borrar claves una a una.
+"""
+import hashlib
+import logging
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.http import urlencode
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = "analytics"
+
+_HITS_KEY = "stats:hits"
+_MISSES_KEY = "stats:misses"
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _org_id(org_or_id):
+    return getattr(org_or_id, "pk", org_or_id)
+
+
+def _version_key(org_id) -> str:
+    return f"version:{org_id}"
+
+
+def _fresh_version() -> int:
+    # Si la versión se pierde (reinicio/evicción) arrancamos desde un valor
+    # que nunca coincide con uno anterior, para no resucitar entradas viejas.
+    return int(time.time() * 1000)
+
+
+def get_org_version(org) -> int:
+    cache = _cache()
+    key = _version_key(_org_id(org))
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _fresh_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(org_id):
+    cache = _cache()
+    key = _version_key(org_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # No existía: cualquier versión nueva invalida lo anterior
+        cache.set(key, _fresh_version(), timeout=None)
+    except Exception:
+        logger.exception("[Analytics] No se pudo invalidar la caché de la org %s", org_id)
+
+
+def bump_org_version(org):
+    """
+    Invalida toda la caché de analítica de la org.
+    Dentro de una transacción se aplica al hacer commit, para que ninguna
+    lectura concurrente guarde datos antiguos bajo la versión nueva.
+    """
+    org_id = _org_id(org)
+    transaction.on_commit(lambda: _bump(org_id))
+
+
+def build_key(org, endpoint: str, params) -> str:
+    """
+    Normaliza los query params (orden, vacíos, valores repetidos) y añade la
+    fecha de hoy: varios informes dependen de "hoy" (as_of por defecto, aging...).
+    """
+    items = []
+    for name, values in sorted(params.lists()):
+        values = sorted(v for v in values if v not in ("", None))
+        if values:
+            items.append((name, values))
+    raw = urlencode(items, doseq=True)
+    digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    today = timezone.localdate().isoformat()
+    return f"{_org_id(org)}:{get_org_version(org)}:{endpoint}:{today}:{digest}"
+
+
+def _count(key):
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def _safe_count(key):
+    try:
+        _count(key)
+    except Exception:
+        pass
+
+
+def lookup(org, endpoint: str, params):
+    """
+    Devuelve (key, data). data=None si no hay entrada; key=None si la caché
+    no está disponible (en ese caso se calcula sin guardar).
+    """
+    try:
+        key = build_key(org, endpoint, params)
+        data = _cache().get(key)
+    except Exception:
+        logger.exception("[Analytics] Caché no disponible, calculando sin caché")
+        return None, None
+
+    _safe_count(_HITS_KEY if data is not None else _MISSES_KEY)
+    return key, data
+
+
+def store(key, data):
+    if key is None:
+        return
+    try:
+        _cache().set(key, data)
+    except Exception:
+        logger.exception("[Analytics] No se pudo guardar en caché %s", key)
+
+
+def get_or_compute(org, endpoint: str, params, compute):
+    """
+    Devuelve (data, hit). Si Redis no responde se calcula sin caché:
+    la analítica nunca debe caerse por la capa de caché.
+    """
+    key, data = lookup(org, endpoint, params)
+    if data is not None:
+        return data, True
+
+    data = compute()
+    store(key, data)
+    return data, False
+
+
+def get_stats() -> dict:
+    cache = _cache()
+    hits = cache.get(_HITS_KEY) or 0
+    misses = cache.get(_MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else 0.0,
+    }
+
+
+def reset_stats():
+    _cache().delete_many([_HITS_KEY, _MISSES_KEY])
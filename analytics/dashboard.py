@@ -0,0 +1,331 @@
+# analytics/dashboard.py
+"""
+Dashboard agrupado: varios widgets de analítica en una sola petición.
+
+1) Cada widget se valida y se resuelve contra la caché de analítica con la
+   misma clave que su endpoint individual (se comparten entradas).
+2) Los widgets idénticos (mismo tipo + params) se calculan una vez.
+3) Serie de ventas, IVA y top clientes sobre el mismo rango se fusionan en
+   una única pasada sobre facturas contabilizadas.
+4) Los cálculos independientes pueden ir en paralelo en un pool de hilos.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.conf import settings
+from django.db import connections
+from django.http import QueryDict
+from rest_framework.exceptions import ValidationError
+
+from billing.decorators import plan_allows
+from . import aging, cache as analytics_cache
+from .abc import parse_rule
+from .aggregation import normalize_group_by
+from .services import (
+    get_yearly_overview,
+    get_sales_timeseries,
+    get_expenses_timeseries,
+    get_receivables_overview,
+    get_vat_summary,
+    get_top_customers,
+    get_quotes_vs_invoices,
+    get_margins,
+    get_aging_receivables,
+    get_aging_payables,
+    get_cashflow,
+    get_customers_abc,
+    get_products_abc,
+    get_suppliers_abc,
+    get_cohorts,
+    get_top_products,
+    get_posted_invoices_scan,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_WIDGETS = 30
+
+class _Params:
+    """
+    Params de un widget con el mismo parseo/errores que los endpoints sueltos.
+    """
+
+    def __init__(self, raw: dict):
+        self.raw = {k: v for k, v in raw.items() if v not in (None, "")}
+
+    def get(self, name, default=None):
+        value = self.raw.get(name, default)
+        return str(value) if value is not None else None
+
+    def date(self, name):
+        value = self.get(name)
+        if not value:
+            return None
+        try:
+            return date.fromisoformat(value)
+        except ValueError:
+            raise ValidationError({name: "Formato de fecha inválido. Usa YYYY-MM-DD."})
+
+    def int(self, name, default):
+        try:
+            return int(self.get(name, default))
+        except (TypeError, ValueError):
+            raise ValidationError({name: "Debe ser un entero."})
+
+    def as_querydict(self):
+        qd = QueryDict(mutable=True)
+        for name, value in self.raw.items():
+            qd.setlist(name, [str(v) for v in value] if isinstance(value, (list, tuple)) else [str(value)])
+        return qd
+
+
+class _Job:
+    def __init__(self, compute, *, date_range=None, group_by=None, limit=None):
+        self.compute = compute
+        self.date_range = date_range
+        self.group_by = group_by
+        self.limit = limit
+        self.type = None
+        self.params = None
+        self.org = None
+
+
+def _date_range_job(fn, org, p, **extra):
+    dfrom, dto = p.date("from"), p.date("to")
+    return _Job(lambda: fn(org=org, date_from=dfrom, date_to=dto, **extra), date_range=(dfrom, dto))
+
+
+def _sales_timeseries(org, p):
+    group_by = p.get("group_by", "month")
+    job = _date_range_job(get_sales_timeseries, org, p, group_by=group_by)
+    job.group_by = normalize_group_by(group_by)
+    return job
+
+
+def _vat(org, p):
+    group_by = p.get("group_by", "month")
+    job = _date_range_job(get_vat_summary, org, p, group_by=group_by)
+    job.group_by = normalize_group_by(group_by)
+    return job
+
+
+def _top_customers(org, p):
+    limit = p.int("limit", 5)
+    job = _date_range_job(get_top_customers, org, p, limit=limit)
+    job.limit = limit
+    return job
+
+
+def _receivables(org, p):
+    as_of = p.date("as_of")
+    limit = max(1, min(p.int("limit", 10), 200))
+    cursor = p.get("cursor")
+    return _Job(lambda: get_receivables_overview(org=org, as_of=as_of, limit=limit, cursor=cursor))
+
+
+def _aging(fn, org, p):
+    edges = aging.parse_edges(p.get("edges"))
+    breakdown = p.get("breakdown") in ("1", "true", "True")
+    return _Job(lambda: fn(org, p.get("as_of"), edges, breakdown))
+
+
+def _abc(fn, org, p):
+    rule = p.get("rule", "80-15-5")
+    parse_rule(rule)
+    return _Job(lambda: fn(org, p.get("from"), p.get("to"), rule))
+
+
+def _top_products(org, p):
+    limit = p.int("limit", 10)
+    return _Job(lambda: get_top_products(org, p.get("from"), p.get("to"), p.get("by", "revenue"), limit))
+
+
+def _margins(org, p):
+    limit = p.int("limit", 0) or None
+    return _Job(lambda: get_margins(org, p.get("from"), p.get("to"), p.get("group_by", "product"), limit))
+
+
+def _cohorts(org, p):
+    months = p.int("months", 6)
+    return _Job(lambda: get_cohorts(org, months))
+
+
+# tipo -> (plan mínimo, constructor del job). El tipo coincide con el
+# cache_endpoint de la view individual para compartir entradas de caché.
+WIDGETS = {
+    "yearly-summary": (None, lambda org, p: _Job(lambda: get_yearly_overview(org))),
+    "sales-timeseries": (None, _sales_timeseries),
+    "expenses-timeseries": (None, lambda org, p: _date_range_job(
+        get_expenses_timeseries, org, p, group_by=p.get("group_by", "month"))),
+    "receivables": (None, _receivables),
+    "vat": (None, _vat),
+    "top-customers": (None, _top_customers),
+    "quotes-vs-invoices": (None, lambda org, p: _date_range_job(get_quotes_vs_invoices, org, p)),
+    "margins": ("pro", _margins),
+    "aging-receivables": (None, lambda org, p: _aging(get_aging_receivables, org, p)),
+    "aging-payables": (None, lambda org, p: _aging(get_aging_payables, org, p)),
+    "cashflow": ("pro", lambda org, p: _Job(
+        lambda: get_cashflow(org, p.get("from"), p.get("to"), p.get("bucket", "day")))),
+    "customers-abc": ("pro", lambda org, p: _abc(get_customers_abc, org, p)),
+    "products-abc": ("pro", lambda org, p: _abc(get_products_abc, org, p)),
+    "suppliers-abc": ("pro", lambda org, p: _abc(get_suppliers_abc, org, p)),
+    "customers-cohorts": ("pro", _cohorts),
+    "products-top": (None, _top_products),
+}
+
+
+def _error(spec_id, wtype, detail, status_code):
+    return {"id": spec_id, "type": wtype, "error": detail, "status": status_code}
+
+
+def _plan_tasks(jobs):
+    """
+    Agrupa los jobs pendientes en tareas. Devuelve [(callable, [jobs])],
+    donde callable() -> {id(job): data}.
+    """
+    scans = {}
+    for job in jobs:
+        if job.type in ("sales-timeseries", "vat"):
+            scans.setdefault((job.date_range, job.group_by), []).append(job)
+    for job in jobs:
+        if job.type == "top-customers":
+            for (date_range, _), group in scans.items():
+                if date_range == job.date_range:
+                    group.append(job)
+                    break
+
+    tasks = []
+    fused = set()
+    for (date_range, group_by), group in scans.items():
+        if len(group) < 2:
+            continue
+        fused.update(id(j) for j in group)
+        tasks.append((_scan_task(date_range, group_by, group), group))
+
+    for job in jobs:
+        if id(job) not in fused:
+            tasks.append((lambda job=job: {id(job): job.compute()}, [job]))
+    return tasks
+
+
+def _scan_task(date_range, group_by, group):
+    def run():
+        org = group[0].org
+        limits = sorted({j.limit for j in group if j.type == "top-customers"})
+        scan = get_posted_invoices_scan(
+            org, date_range[0], date_range[1], group_by=group_by, top_limits=limits,
+        )
+        out = {}
+        for j in group:
+            if j.type == "sales-timeseries":
+                out[id(j)] = scan["sales_timeseries"]
+            elif j.type == "vat":
+                out[id(j)] = scan["vat"]
+            else:
+                out[id(j)] = scan["top_customers"][j.limit]
+        return out
+    return run
+
+
+def _run_task(task):
+    fn, jobs = task
+    try:
+        return fn(), None
+    except ValidationError as exc:
+        return None, (exc.detail, 400)
+    except Exception:
+        logger.exception("[Analytics] Error calculando widgets %s", [j.type for j in jobs])
+        return None, ("Error interno calculando el widget.", 500)
+
+
+def _run_task_in_thread(task):
+    try:
+        return _run_task(task)
+    finally:
+        # Cada hilo abre su propia conexión: la cerramos al terminar
+        connections.close_all()
+
+
+def run_dashboard(request, org, specs, parallel=False):
+    if not isinstance(specs, list) or not specs:
+        raise ValidationError({"widgets": "Debe ser una lista no vacía de widgets."})
+    if len(specs) > MAX_WIDGETS:
+        raise ValidationError({"widgets": f"Máximo {MAX_WIDGETS} widgets por petición."})
+
+    results = [None] * len(specs)
+    unique = {}  # (tipo, params normalizados) -> job
+    slots = []   # (posición, id, job)
+    seen_ids = set()
+
+    for pos, spec in enumerate(specs):
+        if not isinstance(spec, dict) or spec.get("type") not in WIDGETS:
+            raise ValidationError({"widgets": f"Widget #{pos}: tipo desconocido. Tipos: {', '.join(WIDGETS)}."})
+        wtype = spec["type"]
+        spec_id = str(spec.get("id") or wtype)
+        if spec_id in seen_ids:
+            raise ValidationError({"widgets": f"Id de widget duplicado: {spec_id}."})
+        seen_ids.add(spec_id)
+
+        params = spec.get("params") or {}
+        if not isinstance(params, dict):
+            raise ValidationError({"widgets": f"Widget {spec_id}: params debe ser un objeto."})
+
+        min_plan, build = WIDGETS[wtype]
+        if min_plan and not plan_allows(request, min_plan):
+            results[pos] = _error(spec_id, wtype, f"Disponible en plan {min_plan} o superior.", 403)
+            continue
+
+        p = _Params(params)
+        dedupe_key = (wtype, tuple(sorted((k, str(v)) for k, v in p.raw.items())))
+        job = unique.get(dedupe_key)
+        if job is None:
+            try:
+                job = build(org, p)
+            except ValidationError as exc:
+                results[pos] = _error(spec_id, wtype, exc.detail, 400)
+                continue
+            job.type, job.params, job.org = wtype, p, org
+            unique[dedupe_key] = job
+        slots.append((pos, spec_id, job))
+
+    # Caché: mismas claves que los endpoints individuales
+    data_by_job, keys, hits, pending = {}, {}, 0, []
+    for job in unique.values():
+        key, data = analytics_cache.lookup(org, job.type, job.params.as_querydict())
+        if data is not None:
+            data_by_job[id(job)] = data
+            hits += 1
+        else:
+            keys[id(job)] = key
+            pending.append(job)
+
+    tasks = _plan_tasks(pending)
+    workers = min(getattr(settings, "ANALYTICS_DASHBOARD_WORKERS", 4), len(tasks))
+    if parallel and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            outcomes = list(pool.map(_run_task_in_thread, tasks))
+    else:
+        outcomes = [_run_task(t) for t in tasks]
+
+    errors_by_job = {}
+    for (_, jobs), (computed, err) in zip(tasks, outcomes):
+        if err is not None:
+            errors_by_job.update({id(j): err for j in jobs})
+            continue
+        for job in jobs:
+            data_by_job[id(job)] = computed[id(job)]
+            analytics_cache.store(keys.get(id(job)), computed[id(job)])
+
+    for pos, spec_id, job in slots:
+        if id(job) in errors_by_job:
+            detail, status_code = errors_by_job[id(job)]
+            results[pos] = _error(spec_id, job.type, detail, status_code)
+        else:
+            results[pos] = {"id": spec_id, "type": job.type, "data": data_by_job[id(job)]}
+
+    return {
+        "widgets": results,
+        "cache": {"hits": hits, "misses": len(pending)},
+        "computed_tasks": len(tasks),
+    }
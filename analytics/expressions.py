@@ -0,0 +1,20 @@
+# analytics/expressions.py
+"""
+Expresiones SQL reutilizadas por varios informes de analítica.
+"""
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast, Coalesce, Concat, NullIf, Trim
+
+
+def contact_display_name(prefix=""):
+    """
+    Equivalente SQL de Contact.__str__ (razon_social o "nombre apellidos"
+    o "Contacto <id>"), para traer el nombre en la misma query sin N+1.
+    """
+    full_name = Trim(Concat(F(f"{prefix}nombre"), Value(" "), F(f"{prefix}apellidos"), output_field=CharField()))
+    return Coalesce(
+        NullIf(F(f"{prefix}razon_social"), Value("")),
+        NullIf(full_name, Value("")),
+        Concat(Value("Contacto "), Cast(F(f"{prefix}id"), CharField()), output_field=CharField()),
+        output_field=CharField(),
+    )
@@ -0,0 +1,400 @@
+# analytics/facts.py
+"""
+Mantenimiento de la capa de hechos mensuales (ver analytics.models).
+
+- apply_*: actualizaciones incrementales llamadas desde analytics.hooks
+  (posteo de facturas, pagos, facturas de proveedor) y desde las señales
+  de Expense. Trabajan en lote: un puñado de queries por tabla de hechos,
+  independientemente del número de documentos.
+- rebuild_org_facts: reconstrucción completa con GROUP BY sobre las tablas
+  originales (management command rebuild_analytics_facts).
+"""
+import calendar
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .cache import bump_org_version
+from .models import (
+    AnalyticsFactsState,
+    Expense,
+    MonthlyExpenseFact,
+    MonthlyProductFact,
+    MonthlyPurchaseFact,
+    MonthlySalesFact,
+)
+
+ZERO = Decimal("0.00")
+DEC0 = Value(Decimal("0.00"), output_field=DecimalField(max_digits=24, decimal_places=6))
+
+
+def month_start(d):
+    # DateField con default=timezone.now puede llegar aún como datetime
+    if isinstance(d, datetime):
+        d = timezone.localtime(d).date() if timezone.is_aware(d) else d.date()
+    return d.replace(day=1)
+
+
+def covers_whole_months(date_from=None, date_to=None) -> bool:
+    """
+    True si el rango [date_from, date_to] empieza el día 1 y termina el
+    último día de un mes (o está abierto por ese lado).
+    """
+    if date_from is not None and date_from.day != 1:
+        return False
+    if date_to is not None:
+        last_day = calendar.monthrange(date_to.year, date_to.month)[1]
+        if date_to.day != last_day:
+            return False
+    return True
+
+
+def facts_enabled(org) -> bool:
+    return AnalyticsFactsState.objects.filter(organization=org).exists()
+
+
+def can_use_facts(org, date_from=None, date_to=None, group_by: str = "month") -> bool:
+    return (
+        group_by in ("month", "quarter", "year")
+        and covers_whole_months(date_from, date_to)
+        and facts_enabled(org)
+    )
+
+
+def filter_period(qs, date_from=None, date_to=None):
+    if date_from is not None:
+        qs = qs.filter(period__gte=month_start(date_from))
+    if date_to is not None:
+        qs = qs.filter(period__lte=date_to)
+    return qs
+
+
+def _apply_deltas(model, org, key_fields, deltas):
+    """
+    Suma `deltas` ({clave: {campo: incremento}}) a las celdas de `model`.
+
+    1) crea las celdas que falten (ignore_conflicts, sin carreras)
+    2) las bloquea en orden de id
+    3) escribe los nuevos valores con un único bulk_update
+    """
+    if not deltas:
+        return
+    model.objects.bulk_create(
+        [model(org=org, **dict(zip(key_fields, key))) for key in deltas],
+        ignore_conflicts=True,
+    )
+    filters = {
+        f"{field}__in": {key[i] for key in deltas}
+        for i, field in enumerate(key_fields)
+    }
+    rows = model.objects.select_for_update().filter(org=org, **filters).order_by("id")
+
+    changed = []
+    fields = set()
+    for row in rows:
+        values = deltas.get(tuple(getattr(row, f) for f in key_fields))
+        if not values:
+            continue
+        for field, delta in values.items():
+            setattr(row, field, getattr(row, field) + delta)
+            fields.add(field)
+        changed.append(row)
+    if changed:
+        model.objects.bulk_update(changed, sorted(fields), batch_size=500)
+
+
+def _by_org(objs):
+    grouped = defaultdict(list)
+    for obj in objs:
+        grouped[obj.org_id].append(obj)
+    return grouped.values()
+
+
+# --------- INCREMENTAL ---------
+
+@transaction.atomic
+def apply_invoices_posted(invoices):
+    """
+    Añade a los hechos un lote de facturas de venta recién contabilizadas.
+    """
+    from sales.models import InvoiceLine, Payment
+    from .margins import line_amounts  # margins importa este módulo
+
+    for org_invoices in _by_org(invoices):
+        org = org_invoices[0].org
+        by_id = {inv.id: inv for inv in org_invoices}
+
+        sales = defaultdict(lambda: defaultdict(int))
+        for inv in org_invoices:
+            cell = sales[(month_start(inv.date_issue), inv.customer_id)]
+            cell["invoices_count"] += 1
+            cell["totals_base"] += inv.totals_base
+            cell["totals_tax"] += inv.totals_tax
+            cell["total"] += inv.total
+
+        # cobros registrados antes de contabilizar (p.ej. anticipos)
+        paid = (
+            Payment.objects.filter(invoice_id__in=by_id)
+            .values_list("invoice_id")
+            .annotate(s=Sum("amount"))
+        )
+        for invoice_id, amount in paid:
+            inv = by_id[invoice_id]
+            sales[(month_start(inv.date_issue), inv.customer_id)]["paid_amount"] += amount
+
+        products = defaultdict(lambda: defaultdict(int))
+        lines = InvoiceLine.objects.filter(invoice_id__in=by_id).values_list(
+            "invoice_id", "product_id", "qty", "unit_price", "discount_pct", "unit_cost", "product__cost_price"
+        )
+        for invoice_id, product_id, qty, unit_price, discount_pct, unit_cost, cost_price in lines:
+            inv = by_id[invoice_id]
+            period = month_start(inv.date_issue)
+            revenue, cogs = line_amounts(
+                qty, unit_price, discount_pct, unit_cost if unit_cost is not None else cost_price
+            )
+            cell = sales[(period, inv.customer_id)]
+            cell["revenue"] += revenue
+            cell["cogs"] += cogs
+            if product_id:
+                cell = products[(period, product_id)]
+                cell["qty"] += qty
+                cell["revenue"] += revenue
+                cell["cogs"] += cogs
+
+        _apply_deltas(MonthlySalesFact, org, ("period", "customer_id"), sales)
+        _apply_deltas(MonthlyProductFact, org, ("period", "product_id"), products)
+
+
+@transaction.atomic
+def apply_invoice_payment(inv, amount):
+    """
+    Suma `amount` (negativo al borrar) al cobrado de la celda de la factura.
+    Los cobros de borradores entran al contabilizar la factura.
+    """
+    if inv.status != "posted":
+        return
+    _apply_deltas(
+        MonthlySalesFact,
+        inv.org,
+        ("period", "customer_id"),
+        {(month_start(inv.date_issue), inv.customer_id): {"paid_amount": amount}},
+    )
+
+
+@transaction.atomic
+def apply_supplier_invoices_posted(invoices):
+    from purchases.models import SupplierPayment
+
+    for org_invoices in _by_org(invoices):
+        by_id = {inv.id: inv for inv in org_invoices}
+        purchases = defaultdict(lambda: defaultdict(int))
+        for inv in org_invoices:
+            cell = purchases[(month_start(inv.date), inv.supplier_id)]
+            cell["invoices_count"] += 1
+            cell["total_base"] += inv.total_base
+            cell["total_tax"] += inv.total_tax
+            cell["total"] += inv.total
+
+        paid = (
+            SupplierPayment.objects.filter(invoice_id__in=by_id)
+            .values_list("invoice_id")
+            .annotate(s=Sum("amount"))
+        )
+        for invoice_id, amount in paid:
+            inv = by_id[invoice_id]
+            purchases[(month_start(inv.date), inv.supplier_id)]["paid_amount"] += amount
+        _apply_deltas(
+            MonthlyPurchaseFact, org_invoices[0].org, ("period", "supplier_id"), purchases
+        )
+
+
+@transaction.atomic
+def apply_supplier_payment(inv, amount):
+    if inv.status != "posted":
+        return
+    _apply_deltas(
+        MonthlyPurchaseFact,
+        inv.org,
+        ("period", "supplier_id"),
+        {(month_start(inv.date), inv.supplier_id): {"paid_amount": amount}},
+    )
+
+
+@transaction.atomic
+def refresh_expense_cells(org, cells):
+    """
+    Recalcula desde Expense las celdas (period, category) indicadas.
+    Los gastos se editan/borran, así que aquí recalculamos la celda
+    completa en vez de aplicar deltas.
+    """
+    for period, category in set(cells):
+        agg = Expense.objects.filter(
+            org=org,
+            category=category,
+            date__gte=period,
+            date__lt=_next_month(period),
+        ).aggregate(n=Count("id"), amount=Sum("amount"))
+        if not agg["n"]:
+            # Celda vacía: la quitamos para que coincida con el GROUP BY sobre Expense
+            MonthlyExpenseFact.objects.filter(org=org, period=period, category=category).delete()
+            continue
+        MonthlyExpenseFact.objects.update_or_create(
+            org=org,
+            period=period,
+            category=category,
+            defaults={"expenses_count": agg["n"] or 0, "amount": agg["amount"] or ZERO},
+        )
+
+
+def _next_month(period):
+    if period.month == 12:
+        return period.replace(year=period.year + 1, month=1)
+    return period.replace(month=period.month + 1)
+
+
+# --------- RECONSTRUCCIÓN COMPLETA ---------
+
+@transaction.atomic
+def rebuild_org_facts(org):
+    """
+    Borra y recalcula todos los hechos de `org` (incluida la matriz de
+    cohortes) con GROUP BY sobre las tablas originales. Devuelve el nº de
+    filas por tabla de hechos.
+    """
+    from sales.models import Invoice, InvoiceLine, Payment
+    from purchases.models import SupplierInvoice, SupplierPayment
+    from .cohorts import rebuild_org_cohorts  # cohorts y margins importan este módulo
+    from .margins import line_cogs, line_revenue
+
+    for model in (MonthlySalesFact, MonthlyProductFact, MonthlyExpenseFact, MonthlyPurchaseFact):
+        model.objects.filter(org=org).delete()
+
+    # Ventas por (mes, cliente)
+    sales = defaultdict(dict)
+    inv_rows = (
+        Invoice.objects.filter(org=org, status="posted")
+        .annotate(period=TruncMonth("date_issue"))
+        .values("period", "customer_id")
+        .annotate(
+            invoices_count=Count("id"),
+            totals_base=Sum("totals_base"),
+            totals_tax=Sum("totals_tax"),
+            total=Sum("total"),
+        )
+    )
+    for r in inv_rows:
+        sales[(r.pop("period"), r.pop("customer_id"))].update(r)
+
+    paid_rows = (
+        Payment.objects.filter(invoice__org=org, invoice__status="posted")
+        .annotate(period=TruncMonth("invoice__date_issue"))
+        .values("period", customer_id=F("invoice__customer_id"))
+        .annotate(paid_amount=Sum("amount"))
+    )
+    for r in paid_rows:
+        sales[(r["period"], r["customer_id"])]["paid_amount"] = r["paid_amount"]
+
+    lines = InvoiceLine.objects.filter(invoice__org=org, invoice__status="posted").annotate(
+        period=TruncMonth("invoice__date_issue"),
+        line_revenue=Coalesce(line_revenue(), DEC0),
+        line_cogs=Coalesce(line_cogs(), DEC0),
+    )
+    for r in lines.values("period", customer_id=F("invoice__customer_id")).annotate(
+        revenue=Sum("line_revenue"), cogs=Sum("line_cogs")
+    ):
+        sales[(r["period"], r["customer_id"])].update(revenue=r["revenue"], cogs=r["cogs"])
+
+    MonthlySalesFact.objects.bulk_create(
+        [
+            MonthlySalesFact(org=org, period=period, customer_id=customer_id, **values)
+            for (period, customer_id), values in sales.items()
+        ],
+        batch_size=1000,
+    )
+
+    # Productos por (mes, producto)
+    product_rows = (
+        lines.filter(product__isnull=False)
+        .values("period", "product_id")
+        .annotate(qty_sum=Sum("qty"), revenue=Sum("line_revenue"), cogs=Sum("line_cogs"))
+    )
+    MonthlyProductFact.objects.bulk_create(
+        [
+            MonthlyProductFact(
+                org=org,
+                period=r["period"],
+                product_id=r["product_id"],
+                qty=r["qty_sum"],
+                revenue=r["revenue"],
+                cogs=r["cogs"],
+            )
+            for r in product_rows
+        ],
+        batch_size=1000,
+    )
+
+    # Gastos por (mes, categoría)
+    expense_rows = (
+        Expense.objects.filter(org=org)
+        .annotate(period=TruncMonth("date"))
+        .values("period", "category")
+        .annotate(expenses_count=Count("id"), amount=Sum("amount"))
+    )
+    MonthlyExpenseFact.objects.bulk_create(
+        [MonthlyExpenseFact(org=org, **r) for r in expense_rows],
+        batch_size=1000,
+    )
+
+    # Compras por (mes, proveedor)
+    purchases = defaultdict(dict)
+    si_rows = (
+        SupplierInvoice.objects.filter(org=org, status="posted")
+        .annotate(period=TruncMonth("date"))
+        .values("period", "supplier_id")
+        .annotate(
+            invoices_count=Count("id"),
+            total_base=Sum("total_base"),
+            total_tax=Sum("total_tax"),
+            total=Sum("total"),
+        )
+    )
+    for r in si_rows:
+        purchases[(r.pop("period"), r.pop("supplier_id"))].update(r)
+
+    sp_rows = (
+        SupplierPayment.objects.filter(invoice__org=org, invoice__status="posted")
+        .annotate(period=TruncMonth("invoice__date"))
+        .values("period", supplier_id=F("invoice__supplier_id"))
+        .annotate(paid_amount=Sum("amount"))
+    )
+    for r in sp_rows:
+        purchases[(r["period"], r["supplier_id"])]["paid_amount"] = r["paid_amount"]
+
+    MonthlyPurchaseFact.objects.bulk_create(
+        [
+            MonthlyPurchaseFact(org=org, period=period, supplier_id=supplier_id, **values)
+            for (period, supplier_id), values in purchases.items()
+        ],
+        batch_size=1000,
+    )
+
+    cohort_cells = rebuild_org_cohorts(org)
+
+    AnalyticsFactsState.objects.update_or_create(
+        organization=org, defaults={"rebuilt_at": timezone.now()}
+    )
+    bump_org_version(org)
+
+    return {
+        "sales": len(sales),
+        "products": MonthlyProductFact.objects.filter(org=org).count(),
+        "expenses": MonthlyExpenseFact.objects.filter(org=org).count(),
+        "purchases": len(purchases),
+        "cohorts": cohort_cells,
+    }
+
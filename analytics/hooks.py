@@ -2,18 +2,76 @@
 
 import logging
 
+from . import cache, cohorts, facts
+
 logger = logging.getLogger(__name__)
 
 """
-Hooks ligeros para registrar eventos de Compras (F6).
-No hacen nada complejo todavía. Solo dejan trazas para confirmar
-que los eventos se emiten correctamente y sirven de puente
-para F7 (Analítica).
+Hooks ligeros que Ventas (F5) y Compras (F6) llaman al contabilizar
+documentos o registrar pagos. Mantienen al día la capa de hechos
+mensuales de Analítica (F7) dentro de la misma transacción e invalidan
+la caché de analítica de la org al hacer commit.
 """
 
+
+# --------- VENTAS ---------
+
+def register_invoice_posted(inv):
+    logger.info(f"[Analytics] Factura venta contabilizada: {inv.id} – total={inv.total}")
+    facts.apply_invoices_posted([inv])
+    cohorts.apply_invoices_posted([inv])
+    cache.bump_org_version(inv.org_id)
+    return True
+
+
+def register_invoices_posted(invoices):
+    """
+    Igual que register_invoice_posted para un lote (contabilización masiva):
+    una pasada por hechos y cohortes e invalidación por org.
+    """
+    if not invoices:
+        return True
+    logger.info(f"[Analytics] {len(invoices)} facturas de venta contabilizadas en lote")
+    facts.apply_invoices_posted(invoices)
+    cohorts.apply_invoices_posted(invoices)
+    for org_id in {inv.org_id for inv in invoices}:
+        cache.bump_org_version(org_id)
+    return True
+
+
+def register_invoice_payment_created(payment):
+    logger.info(
+        f"[Analytics] Cobro creado: {payment.id} – "
+        f"invoice={payment.invoice_id}, amount={payment.amount}"
+    )
+    facts.apply_invoice_payment(payment.invoice, payment.amount)
+    cache.bump_org_version(payment.org_id)
+    return True
+
+
+def register_invoice_payment_updated(payment, previous_invoice, previous_amount):
+    facts.apply_invoice_payment(previous_invoice, -previous_amount)
+    facts.apply_invoice_payment(payment.invoice, payment.amount)
+    cache.bump_org_version(payment.org_id)
+    return True
+
+
+def register_invoice_payment_deleted(payment):
+    logger.info(
+        f"[Analytics] Cobro eliminado: {payment.id} – "
+        f"invoice={payment.invoice_id}"
+    )
+    facts.apply_invoice_payment(payment.invoice, -payment.amount)
+    cache.bump_org_version(payment.org_id)
+    return True
+
+
+# --------- COMPRAS ---------
+
 def register_supplier_invoice_posted(inv):
     logger.info(f"[Analytics] Factura proveedor contabilizada: {inv.id} – total={inv.total}")
-    # más adelante aquí crearemos: AnalyticsExpense.create_from_invoice(inv)
+    facts.apply_supplier_invoices_posted([inv])
+    cache.bump_org_version(inv.org_id)
     return True
 
 
@@ -22,6 +80,15 @@ def register_supplier_payment_created(payment):
         f"[Analytics] Pago proveedor creado: {payment.id} – "
         f"invoice={payment.invoice_id}, amount={payment.amount}"
     )
+    facts.apply_supplier_payment(payment.invoice, payment.amount)
+    cache.bump_org_version(payment.org_id)
+    return True
+
+
+def register_supplier_payment_updated(payment, previous_invoice, previous_amount):
+    facts.apply_supplier_payment(previous_invoice, -previous_amount)
+    facts.apply_supplier_payment(payment.invoice, payment.amount)
+    cache.bump_org_version(payment.org_id)
     return True
 
 
@@ -30,4 +97,6 @@ def register_supplier_payment_deleted(payment):
         f"[Analytics] Pago proveedor eliminado: {payment.id} – "
         f"invoice={payment.invoice_id}"
     )
+    facts.apply_supplier_payment(payment.invoice, -payment.amount)
+    cache.bump_org_version(payment.org_id)
     return True
@@ -0,0 +1,226 @@
+# analytics/management/commands/explain_analytics.py
+"""
+EXPLAIN (ANALYZE) de las queries de analítica.
+
+Ejecuta los servicios de analítica (ventas, IVA, top clientes, cobros, aging,
+cashflow, márgenes, ABC, cohortes...), captura el SQL que lanzan y lo vuelve
+a ejecutar con EXPLAIN (ANALYZE, BUFFERS). Resume qué índice usa cada query y
+avisa de los Seq Scan sobre las tablas grandes de facturación.
+
+- Sin --org siembra varias organizaciones sintéticas dentro de una transacción
+  que se deshace al final (no deja datos).
+- Con --org analiza una organización real, solo lectura.
+- Con --fail-on-seqscan sale con error si algún plan hace Seq Scan sobre una
+  tabla caliente (para CI / regresiones de índices).
+
+Solo PostgreSQL.
+"""
+import random
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from analytics import services
+from analytics.models import Expense
+from contacts.models import Contact
+from core.models import Organization
+from inventory.models import Category, Product, Warehouse
+from purchases.models import SupplierInvoice, SupplierPayment
+from sales.models import Invoice, InvoiceLine, Payment
+
+HOT_MODELS = (Invoice, InvoiceLine, Payment, SupplierInvoice, SupplierPayment, Expense)
+
+_SCAN_RE = re.compile(
+    r"(Seq Scan|Parallel Seq Scan|Index Only Scan|Index Scan|Bitmap Index Scan)"
+    r"(?: Backward)?(?: using (\S+))? on (\S+)"
+)
+_TIME_RE = re.compile(r"Execution Time: ([\d.]+) ms")
+_DECLARE_RE = re.compile(r"^DECLARE .*? CURSOR .*? FOR (.*)$", re.S | re.I)
+
+
+def _reports(org, today):
+    d_from = today - timedelta(days=365)
+    s_from, s_to, s_today = d_from.isoformat(), today.isoformat(), today.isoformat()
+    return [
+        ("yearly-summary", lambda: services.get_yearly_overview(org)),
+        ("sales-timeseries", lambda: services.get_sales_timeseries(org, d_from, today, "month")),
+        ("vat", lambda: services.get_vat_summary(org, d_from, today, "month")),
+        ("top-customers", lambda: services.get_top_customers(org, d_from, today, 10)),
+        ("expenses-timeseries", lambda: services.get_expenses_timeseries(org, d_from, today, "month")),
+        ("receivables", lambda: services.get_receivables_overview(org, today, 50)),
+        ("aging-receivables", lambda: services.get_aging_receivables(org, s_today, None, True)),
+        ("aging-payables", lambda: services.get_aging_payables(org, s_today, None, True)),
+        ("cashflow", lambda: services.get_cashflow(org, s_from, s_to, "week")),
+        ("margins", lambda: services.get_margins(org, s_from, s_to, "product", 20)),
+        ("products-top", lambda: services.get_top_products(org, s_from, s_to, "margin", 10)),
+        ("customers-abc", lambda: services.get_customers_abc(org, s_from, s_to)),
+        ("suppliers-abc", lambda: services.get_suppliers_abc(org, s_from, s_to)),
+        ("customers-cohorts", lambda: services.get_cohorts(org, 12)),
+    ]
+
+
+def _explainable(sql):
+    match = _DECLARE_RE.match(sql.strip())
+    if match:
+        sql = match.group(1)
+    return sql if sql.lstrip().upper().startswith(("SELECT", "WITH")) else None
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN (ANALYZE) de las queries de analítica sobre datos sembrados o de una organización."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", dest="org_slug", help="Analizar una organización existente (sin sembrar)")
+        parser.add_argument("--orgs", type=int, default=8, help="Organizaciones sintéticas a sembrar (por defecto 8)")
+        parser.add_argument("--invoices", type=int, default=20000, help="Facturas de venta por organización sembrada")
+        parser.add_argument("--seed", type=int, default=42, help="Semilla aleatoria")
+        parser.add_argument("--fail-on-seqscan", action="store_true", help="Error si hay Seq Scan sobre tablas calientes")
+        parser.add_argument("--plans", action="store_true", help="Imprimir los planes completos")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("explain_analytics solo funciona con PostgreSQL.")
+
+        if options["org_slug"]:
+            org = Organization.objects.filter(slug=options["org_slug"]).first()
+            if org is None:
+                raise CommandError(f"Organización '{options['org_slug']}' no encontrada")
+            offenders = self._explain_org(org, options)
+        else:
+            with transaction.atomic():
+                orgs = self._seed(options["orgs"], options["invoices"], options["seed"])
+                offenders = self._explain_org(orgs[0], options)
+                transaction.set_rollback(True)
+
+        if offenders:
+            msg = "Seq Scan sobre tablas calientes: " + ", ".join(sorted(offenders))
+            if options["fail_on_seqscan"]:
+                raise CommandError(msg)
+            self.stdout.write(self.style.WARNING(msg))
+        else:
+            self.stdout.write(self.style.SUCCESS("Ninguna query de analítica hace Seq Scan sobre tablas calientes."))
+
+    # ------------------------------------------------------------------ explain
+
+    def _explain_org(self, org, options):
+        hot_tables = {m._meta.db_table for m in HOT_MODELS}
+        offenders = set()
+        today = timezone.localdate()
+
+        for name, run in _reports(org, today):
+            with CaptureQueriesContext(connection) as captured:
+                run()
+            statements = [sql for sql in (_explainable(q["sql"]) for q in captured.captured_queries) if sql]
+
+            total_ms = 0.0
+            scans = []
+            for sql in statements:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}")
+                    plan = "\n".join(row[0] for row in cursor.fetchall())
+                time_match = _TIME_RE.search(plan)
+                total_ms += float(time_match.group(1)) if time_match else 0.0
+                for kind, index, table in _SCAN_RE.findall(plan):
+                    scans.append(f"{kind} {'using ' + index + ' ' if index else ''}on {table}")
+                    if "Seq Scan" in kind and table in hot_tables:
+                        offenders.add(f"{name}:{table}")
+                if options["plans"]:
+                    self.stdout.write(plan + "\n")
+
+            self.stdout.write(f"{name}: {len(statements)} queries, {total_ms:.1f} ms")
+            for scan in dict.fromkeys(scans):
+                self.stdout.write(f"    {scan}")
+        return offenders
+
+    # -------------------------------------------------------------------- seed
+
+    def _seed(self, n_orgs, n_invoices, seed):
+        rnd = random.Random(seed)
+        today = timezone.localdate()
+        orgs = []
+        for i in range(n_orgs):
+            org = Organization.objects.create(name=f"Explain {i}", slug=f"explain-analytics-{i}")
+            orgs.append(org)
+            self._seed_org(org, n_invoices, rnd, today)
+            self.stdout.write(f"Sembrada {org.slug}: {n_invoices} facturas")
+
+        with connection.cursor() as cursor:
+            for model in HOT_MODELS:
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+        return orgs
+
+    def _seed_org(self, org, n_invoices, rnd, today):
+        customers = Contact.objects.bulk_create(
+            [Contact(org=org, tipo="client", nombre=f"Cliente {i}") for i in range(max(10, n_invoices // 50))]
+        )
+        suppliers = Contact.objects.bulk_create(
+            [Contact(org=org, tipo="supplier", nombre=f"Proveedor {i}") for i in range(30)]
+        )
+        warehouse = Warehouse.objects.create(org=org, code="MAIN", name="Principal", is_primary=True)
+        category = Category.objects.create(org=org, name="General")
+        products = Product.objects.bulk_create([
+            Product(org=org, category=category, sku=f"SKU-{i}", name=f"Producto {i}",
+                    price=Decimal(rnd.randint(5, 500)), cost_price=Decimal(rnd.randint(2, 300)))
+            for i in range(100)
+        ])
+
+        def random_day():
+            return today - timedelta(days=rnd.randint(0, 730))
+
+        invoices = []
+        for n in range(n_invoices):
+            issued = random_day()
+            base = Decimal(rnd.randint(1000, 500000)) / 100
+            tax = (base * Decimal("0.21")).quantize(Decimal("0.01"))
+            posted = rnd.random() < 0.9
+            invoices.append(Invoice(
+                org=org, series="A", number=n + 1 if posted else None, date_issue=issued,
+                due_date=issued + timedelta(days=30), customer=rnd.choice(customers),
+                status="posted" if posted else "draft",
+                totals_base=base, totals_tax=tax, total=base + tax,
+            ))
+        invoices = Invoice.objects.bulk_create(invoices, batch_size=2000)
+
+        lines, payments = [], []
+        for inv in invoices:
+            half = (inv.totals_base / 2).quantize(Decimal("0.01"))
+            for amount in (half, inv.totals_base - half):
+                product = rnd.choice(products)
+                lines.append(InvoiceLine(
+                    invoice=inv, product=product, description=product.name, qty=Decimal("1"),
+                    unit_price=amount, unit_cost=product.cost_price, tax_rate=Decimal("21"),
+                ))
+            if inv.status == "posted" and rnd.random() < 0.6:
+                payments.append(Payment(
+                    org=org, invoice=inv, amount=inv.total,
+                    date=min(today, inv.date_issue + timedelta(days=rnd.randint(0, 60))),
+                ))
+        InvoiceLine.objects.bulk_create(lines, batch_size=5000)
+        Payment.objects.bulk_create(payments, batch_size=5000)
+
+        supplier_invoices = []
+        for n in range(max(1, n_invoices // 10)):
+            issued = random_day()
+            base = Decimal(rnd.randint(1000, 300000)) / 100
+            tax = (base * Decimal("0.21")).quantize(Decimal("0.01"))
+            supplier_invoices.append(SupplierInvoice(
+                org=org, number=f"SI-{n + 1}", date=issued, due_date=issued + timedelta(days=45),
+                supplier=rnd.choice(suppliers), warehouse=warehouse, status="posted",
+                total_base=base, total_tax=tax, total=base + tax,
+            ))
+        supplier_invoices = SupplierInvoice.objects.bulk_create(supplier_invoices, batch_size=2000)
+        SupplierPayment.objects.bulk_create([
+            SupplierPayment(org=org, invoice=si, amount=si.total, date=min(today, si.date + timedelta(days=30)))
+            for si in supplier_invoices if rnd.random() < 0.5
+        ], batch_size=5000)
+
+        Expense.objects.bulk_create([
+            Expense(org=org, date=random_day(), amount=Decimal(rnd.randint(1000, 200000)) / 100,
+                    category=rnd.choice(Expense.CATEGORY_CHOICES)[0])
+            for _ in range(max(1, n_invoices // 20))
+        ], batch_size=5000)
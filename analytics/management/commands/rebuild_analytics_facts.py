@@ -0,0 +1,31 @@
+# analytics/management/commands/rebuild_analytics_facts.py
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Organization
+from analytics.facts import rebuild_org_facts
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruye desde cero los hechos mensuales de analítica "
+        "(ventas, productos, gastos, compras y cohortes) de una o todas las organizaciones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", dest="org_slug", help="Slug de la organización (por defecto, todas)")
+
+    def handle(self, *args, **options):
+        orgs = Organization.objects.all().order_by("slug")
+        if options["org_slug"]:
+            orgs = orgs.filter(slug=options["org_slug"])
+            if not orgs.exists():
+                raise CommandError(f"Organización '{options['org_slug']}' no encontrada")
+
+        for org in orgs:
+            counts = rebuild_org_facts(org)
+            self.stdout.write(
+                f"{org.slug}: ventas={counts['sales']} productos={counts['products']} "
+                f"gastos={counts['expenses']} compras={counts['purchases']} "
+                f"cohortes={counts['cohorts']}"
+            )
+        self.stdout.write(self.style.SUCCESS("Hechos de analítica reconstruidos."))
@@ -0,0 +1,140 @@
+# analytics/margins.py
+"""
+Motor de márgenes sobre líneas de factura 'posted'.
+
+- Ingreso de línea = qty * unit_price * (1 - discount_pct/100) (mismo criterio
+  que sales.pricing para la base).
+- Coste de línea = qty * unit_cost, la foto del coste que se guarda en la
+  línea al contabilizar; si falta (líneas antiguas) se usa Product.cost_price.
+- Agrupa por id (producto, categoría, cliente) y ordena/limita en la BD.
+  Las queries terminan en values(), así que no hay select_related: solo los
+  JOIN que pide la clave de agrupación.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import facts
+from .expressions import contact_display_name
+from .models import MonthlyProductFact, MonthlySalesFact
+
+_DEC = DecimalField(max_digits=24, decimal_places=6)
+_ZERO = Value(Decimal("0.00"), output_field=_DEC)
+_DASH = Value("—")
+
+ORDER_FIELDS = ("margin", "revenue", "cogs")
+
+
+def line_revenue(prefix: str = ""):
+    return ExpressionWrapper(
+        F(f"{prefix}qty") * F(f"{prefix}unit_price")
+        * (Value(Decimal("100")) - F(f"{prefix}discount_pct")) / Value(Decimal("100")),
+        output_field=_DEC,
+    )
+
+
+def line_cogs(prefix: str = ""):
+    return ExpressionWrapper(
+        F(f"{prefix}qty")
+        * Coalesce(F(f"{prefix}unit_cost"), F(f"{prefix}product__cost_price"), _ZERO),
+        output_field=_DEC,
+    )
+
+
+def line_amounts(qty, unit_price, discount_pct, unit_cost):
+    """Versión Python de line_revenue/line_cogs (actualización incremental de hechos)."""
+    revenue = qty * unit_price * (Decimal("1") - (discount_pct or Decimal("0")) / Decimal("100"))
+    cogs = qty * (unit_cost or Decimal("0"))
+    return revenue, cogs
+
+
+def _line_group(group_by):
+    if group_by == "category":
+        return {"group_id": F("product__category_id"), "key": F("product__category__name")}
+    if group_by == "customer":
+        return {"group_id": F("invoice__customer_id"), "key": contact_display_name("invoice__customer__")}
+    if group_by == "seller":
+        return {"key": _DASH}
+    return {"group_id": F("product_id"), "key": F("product__name")}
+
+
+def _lines_qs(org, dfrom, dto):
+    from sales.models import InvoiceLine
+
+    qs = InvoiceLine.objects.filter(invoice__org=org, invoice__status="posted")
+    if dfrom:
+        qs = qs.filter(invoice__date_issue__gte=dfrom)
+    if dto:
+        qs = qs.filter(invoice__date_issue__lte=dto)
+    return qs.annotate(line_revenue=line_revenue(), line_cogs=line_cogs())
+
+
+def _rows_from_lines(org, dfrom, dto, group_by, order, limit):
+    rows = (
+        _lines_qs(org, dfrom, dto)
+        .values(**_line_group(group_by))
+        .annotate(
+            revenue=Coalesce(Sum("line_revenue"), _ZERO),
+            cogs=Coalesce(Sum("line_cogs"), _ZERO),
+        )
+        .annotate(margin=ExpressionWrapper(F("revenue") - F("cogs"), output_field=_DEC))
+        .order_by(f"-{order}")
+    )
+    return list(rows[:limit] if limit else rows)
+
+
+def _rows_from_facts(org, dfrom, dto, group_by, order, limit):
+    sales_qs = facts.filter_period(MonthlySalesFact.objects.filter(org=org), dfrom, dto)
+    sums = {"revenue": Sum("revenue"), "cogs": Sum("cogs")}
+
+    if group_by in ("customer", "seller"):
+        group = {"group_id": F("customer_id"), "key": contact_display_name("customer__")} if group_by == "customer" else {"key": _DASH}
+        rows = list(sales_qs.values(**group).annotate(**sums))
+    else:
+        # Las líneas sin producto solo están en MonthlySalesFact: van a una
+        # fila group_id=None con la diferencia, como el GROUP BY con producto NULL.
+        product_qs = facts.filter_period(MonthlyProductFact.objects.filter(org=org), dfrom, dto)
+        if group_by == "category":
+            group = {"group_id": F("product__category_id"), "key": F("product__category__name")}
+        else:
+            group = {"group_id": F("product_id"), "key": F("product__name")}
+        rows = list(product_qs.values(**group).annotate(**sums))
+        totals = sales_qs.aggregate(**sums)
+        remainder = {
+            name: (totals[name] or Decimal("0")) - sum((r[name] or Decimal("0") for r in rows), Decimal("0"))
+            for name in sums
+        }
+        if any(remainder.values()):
+            rows.append({"group_id": None, "key": None, **remainder})
+
+    for r in rows:
+        r["revenue"] = r["revenue"] or Decimal("0")
+        r["cogs"] = r["cogs"] or Decimal("0")
+        r["margin"] = r["revenue"] - r["cogs"]
+    # Tabla de hechos ya agregada: pocas filas, se ordena aquí
+    rows.sort(key=lambda r: r[order], reverse=True)
+    return rows[:limit] if limit else rows
+
+
+def margin_rows(org, dfrom, dto, group_by="product", order="margin", limit=None):
+    """
+    Filas {group_id, key, revenue, cogs, margin} ordenadas por `order` DESC.
+    """
+    order = order if order in ORDER_FIELDS else "margin"
+    if facts.can_use_facts(org, dfrom, dto):
+        return _rows_from_facts(org, dfrom, dto, group_by, order, limit)
+    return _rows_from_lines(org, dfrom, dto, group_by, order, limit)
+
+
+def margin_totals(org, dfrom, dto):
+    sums = {"revenue": Sum("revenue"), "cogs": Sum("cogs")}
+    if facts.can_use_facts(org, dfrom, dto):
+        totals = facts.filter_period(MonthlySalesFact.objects.filter(org=org), dfrom, dto).aggregate(**sums)
+    else:
+        totals = _lines_qs(org, dfrom, dto).aggregate(
+            revenue=Sum("line_revenue"), cogs=Sum("line_cogs")
+        )
+    revenue = totals["revenue"] or Decimal("0")
+    cogs = totals["cogs"] or Decimal("0")
+    return revenue, cogs
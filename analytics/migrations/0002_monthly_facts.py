@@ -0,0 +1,92 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+        ('contacts', '0003_alter_contact_unique_together_and_more'),
+        ('core', '0003_organizationemailsettings'),
+        ('inventory', '0002_product_cost_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsFactsState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rebuilt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('organization', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analytics_facts_state', to='core.organization')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MonthlyExpenseFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('category', models.CharField(max_length=32)),
+                ('expenses_count', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('org', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='core.organization')),
+            ],
+            options={
+                'unique_together': {('org', 'period', 'category')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyProductFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('qty', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=20)),
+                ('revenue', models.DecimalField(decimal_places=6, default=Decimal('0.00'), max_digits=24)),
+                ('cogs', models.DecimalField(decimal_places=6, default=Decimal('0.00'), max_digits=24)),
+                ('org', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='core.organization')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.product')),
+            ],
+            options={
+                'unique_together': {('org', 'period', 'product')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyPurchaseFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('invoices_count', models.PositiveIntegerField(default=0)),
+                ('total_base', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('total_tax', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('org', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='core.organization')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contacts.contact')),
+            ],
+            options={
+                'unique_together': {('org', 'period', 'supplier')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlySalesFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('invoices_count', models.PositiveIntegerField(default=0)),
+                ('totals_base', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('totals_tax', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('revenue', models.DecimalField(decimal_places=6, default=Decimal('0.00'), max_digits=24)),
+                ('cogs', models.DecimalField(decimal_places=6, default=Decimal('0.00'), max_digits=24)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contacts.contact')),
+                ('org', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='core.organization')),
+            ],
+            options={
+                'unique_together': {('org', 'period', 'customer')},
+            },
+        ),
+    ]
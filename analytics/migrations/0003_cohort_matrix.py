@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:29
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0002_monthly_facts'),
+        ('core', '0003_organizationemailsettings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyCohortCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort', models.DateField()),
+                ('month_index', models.PositiveSmallIntegerField()),
+                ('active_customers', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=16)),
+                ('org', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='core.organization')),
+            ],
+            options={
+                'unique_together': {('org', 'cohort', 'month_index')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:34
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY: no bloquea escrituras en tablas grandes
+    atomic = False
+
+    dependencies = [
+        ('analytics', '0003_cohort_matrix'),
+        ('core', '0003_organizationemailsettings'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='expense',
+            index=models.Index(fields=['org', 'date'], include=('category', 'amount'), name='analytics_exp_org_date_cov'),
+        ),
+        AddIndexConcurrently(
+            model_name='expense',
+            index=django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['date'], name='analytics_exp_date_brin'),
+        ),
+    ]
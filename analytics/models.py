@@ -1,5 +1,6 @@
 # analytics/models.py
 from decimal import Decimal
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 from django.utils import timezone
 
@@ -99,6 +100,122 @@ class Expense(OrgScopedModel):
 
     class Meta:
         ordering = ["-date", "-created_at"]
+        indexes = [
+            models.Index(fields=["org", "date"], include=["category", "amount"], name="analytics_exp_org_date_cov"),
+            BrinIndex(fields=["date"], name="analytics_exp_date_brin", autosummarize=True),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.amount} ({self.get_category_display()})"
+
+
+# ---------------------------------------------------------------------------
+# Capa de hechos pre-agregados (F7)
+# Mantenida incrementalmente desde analytics.hooks y reconstruible con
+# `python manage.py rebuild_analytics_facts`.
+# `period` es siempre el primer día del mes.
+# ---------------------------------------------------------------------------
+
+class AnalyticsFactsState(models.Model):
+    """
+    Marca que la capa de hechos de una organización se ha reconstruido al menos
+    una vez. Mientras no exista, los servicios leen de las tablas originales.
+    """
+    organization = models.OneToOneField(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name="analytics_facts_state",
+    )
+    rebuilt_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.organization.slug} - {self.rebuilt_at:%Y-%m-%d %H:%M}"
+
+
+class MonthlySalesFact(OrgScopedModel):
+    """
+    Facturas de venta 'posted' por (mes de emisión, cliente).
+    """
+    period = models.DateField()
+    customer = models.ForeignKey(
+        "contacts.Contact",
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    invoices_count = models.PositiveIntegerField(default=0)
+    totals_base = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    totals_tax = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    total = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    paid_amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    # Ingreso y coste de las líneas (para márgenes por cliente)
+    revenue = models.DecimalField(max_digits=24, decimal_places=6, default=Decimal("0.00"))
+    cogs = models.DecimalField(max_digits=24, decimal_places=6, default=Decimal("0.00"))
+
+    class Meta:
+        unique_together = ("org", "period", "customer")
+
+
+class MonthlyProductFact(OrgScopedModel):
+    """
+    Líneas de factura de venta 'posted' con producto, por (mes de emisión, producto).
+    Las líneas sin producto solo cuentan en MonthlySalesFact.revenue.
+    """
+    period = models.DateField()
+    product = models.ForeignKey(
+        "inventory.Product",
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    qty = models.DecimalField(max_digits=20, decimal_places=3, default=Decimal("0.000"))
+    revenue = models.DecimalField(max_digits=24, decimal_places=6, default=Decimal("0.00"))
+    cogs = models.DecimalField(max_digits=24, decimal_places=6, default=Decimal("0.00"))
+
+    class Meta:
+        unique_together = ("org", "period", "product")
+
+
+class MonthlyExpenseFact(OrgScopedModel):
+    """
+    Gastos (Expense) por (mes, categoría).
+    """
+    period = models.DateField()
+    category = models.CharField(max_length=32)
+    expenses_count = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        unique_together = ("org", "period", "category")
+
+
+class MonthlyPurchaseFact(OrgScopedModel):
+    """
+    Facturas de proveedor 'posted' por (mes de factura, proveedor).
+    """
+    period = models.DateField()
+    supplier = models.ForeignKey(
+        "contacts.Contact",
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    invoices_count = models.PositiveIntegerField(default=0)
+    total_base = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    total_tax = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    total = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+    paid_amount = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        unique_together = ("org", "period", "supplier")
+
+
+class MonthlyCohortCell(OrgScopedModel):
+    """
+    Matriz de cohortes de clientes: cohorte = mes de la primera factura 'posted'
+    del cliente; month_index = meses transcurridos desde la cohorte.
+    """
+    cohort = models.DateField()
+    month_index = models.PositiveSmallIntegerField()
+    active_customers = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        unique_together = ("org", "cohort", "month_index")
@@ -1,25 +1,40 @@
 # analytics/services.py
+import base64
+import json
 from decimal import Decimal
-from collections import defaultdict, Counter
+from collections import defaultdict
 from datetime import date, datetime
 
 from django.db import models
-from django.db.models import Sum, Count, Value, F, DecimalField as D
+from django.db.models import (
+    Sum, Count, Value, F, Q, DecimalField as D, IntegerField,
+    ExpressionWrapper, OuterRef, Subquery,
+)
 from django.db.models.functions import (
     ExtractYear,
-    ExtractMonth,
-    ExtractQuarter,
     Coalesce,
     TruncDay,
     TruncWeek,
     TruncMonth,
 )
 from django.utils import timezone
+from rest_framework.exceptions import ValidationError
 
 from core.models import Organization
-from sales.models import Invoice, Quote, InvoiceLine
-from .models import OrgFinancialYear, Expense
-from purchases.models import SupplierInvoice
+from sales.models import Invoice, Quote, InvoiceLine, Payment
+from .models import (
+    OrgFinancialYear,
+    Expense,
+    MonthlySalesFact,
+    MonthlyProductFact,
+    MonthlyExpenseFact,
+    MonthlyPurchaseFact,
+    MonthlyCohortCell,
+)
+from .expressions import contact_display_name
+from .aggregation import PERIOD_TRUNCS, aggregate_by_period, normalize_group_by, period_label
+from . import abc, aging, cohorts, facts, margins
+from purchases.models import SupplierInvoice, SupplierPayment
 from inventory.models import Product
 from django.db.models import CharField as C
 
@@ -42,13 +57,23 @@ def get_yearly_summary(org: Organization):
         }
     )
 
+    use_facts = facts.facts_enabled(org)
+
     # 1) Ingresos por año (facturas "posted")
-    inv_qs = (
-        Invoice.objects.filter(org=org, status="posted")
-        .annotate(year=ExtractYear("date_issue"))
-        .values("year")
-        .annotate(income=Sum("totals_base"))
-    )
+    if use_facts:
+        inv_qs = (
+            MonthlySalesFact.objects.filter(org=org)
+            .annotate(year=ExtractYear("period"))
+            .values("year")
+            .annotate(income=Sum("totals_base"))
+        )
+    else:
+        inv_qs = (
+            Invoice.objects.filter(org=org, status="posted")
+            .annotate(year=ExtractYear("date_issue"))
+            .values("year")
+            .annotate(income=Sum("totals_base"))
+        )
     for row in inv_qs:
         year = row["year"]
         if year is None:
@@ -57,12 +82,20 @@ def get_yearly_summary(org: Organization):
         result[year]["income"] += row["income"] or Decimal("0.00")
 
     # 2) Gastos por año (Expense)
-    exp_qs = (
-        Expense.objects.filter(org=org)
-        .annotate(year=ExtractYear("date"))
-        .values("year")
-        .annotate(expenses=Sum("amount"))
-    )
+    if use_facts:
+        exp_qs = (
+            MonthlyExpenseFact.objects.filter(org=org)
+            .annotate(year=ExtractYear("period"))
+            .values("year")
+            .annotate(expenses=Sum("amount"))
+        )
+    else:
+        exp_qs = (
+            Expense.objects.filter(org=org)
+            .annotate(year=ExtractYear("date"))
+            .values("year")
+            .annotate(expenses=Sum("amount"))
+        )
     for row in exp_qs:
         year = row["year"]
         if year is None:
@@ -89,386 +122,271 @@ def get_yearly_summary(org: Organization):
     return items
 
 
-def get_sales_timeseries(org: Organization, date_from=None, date_to=None, group_by: str = "month"):
+def get_yearly_overview(org: Organization):
     """
-    Serie temporal de ventas (ingresos) agrupadas por month|quarter|year.
+    Resumen anual + año con mayor beneficio (payload del endpoint yearly-summary).
     """
-    qs = Invoice.objects.filter(org=org, status="posted")
-    if date_from is not None:
-        qs = qs.filter(date_issue__gte=date_from)
-    if date_to is not None:
-        qs = qs.filter(date_issue__lte=date_to)
-
-    group_by = (group_by or "month").lower()
-    if group_by not in ("month", "quarter", "year"):
-        group_by = "month"
+    items = get_yearly_summary(org)
 
-    items = []
+    # Año con mayor beneficio (por si quieres mostrarlo en el frontend)
+    best_year = None
+    if items:
+        best_year = max(items, key=lambda x: x["profit"])
 
-    if group_by == "year":
-        qs = (
-            qs.annotate(year=ExtractYear("date_issue"))
-            .values("year")
-            .annotate(
-                total_base=Sum("totals_base"),
-                total_tax=Sum("totals_tax"),
-                invoices_count=Count("id"),
-            )
-            .order_by("year")
-        )
-        for row in qs:
-            year = row["year"]
-            if year is None:
-                continue
-            items.append(
-                {
-                    "period": str(year),
-                    "invoiced_base": row["total_base"] or Decimal("0.00"),
-                    "invoiced_tax": row["total_tax"] or Decimal("0.00"),
-                    "invoices_count": row["invoices_count"] or 0,
-                }
-            )
+    return {
+        "items": items,
+        "best_year": best_year,  # puede ser null si no hay datos
+    }
 
-    elif group_by == "quarter":
-        qs = (
-            qs.annotate(year=ExtractYear("date_issue"), quarter=ExtractQuarter("date_issue"))
-            .values("year", "quarter")
-            .annotate(
-                total_base=Sum("totals_base"),
-                total_tax=Sum("totals_tax"),
-                invoices_count=Count("id"),
-            )
-            .order_by("year", "quarter")
-        )
-        for row in qs:
-            year = row["year"]
-            quarter = row["quarter"]
-            if year is None or quarter is None:
-                continue
-            items.append(
-                {
-                    "period": f"{year}-Q{quarter}",
-                    "invoiced_base": row["total_base"] or Decimal("0.00"),
-                    "invoiced_tax": row["total_tax"] or Decimal("0.00"),
-                    "invoices_count": row["invoices_count"] or 0,
-                }
-            )
 
-    else:  # month
-        qs = (
-            qs.annotate(year=ExtractYear("date_issue"), month=ExtractMonth("date_issue"))
-            .values("year", "month")
-            .annotate(
-                total_base=Sum("totals_base"),
-                total_tax=Sum("totals_tax"),
-                invoices_count=Count("id"),
-            )
-            .order_by("year", "month")
+def get_sales_timeseries(org: Organization, date_from=None, date_to=None, group_by: str = "month"):
+    """
+    Serie temporal de ventas (ingresos) agrupadas por day|week|month|quarter|year.
+    """
+    group_by = normalize_group_by(group_by)
+    if facts.can_use_facts(org, date_from, date_to, group_by):
+        return aggregate_by_period(
+            facts.filter_period(MonthlySalesFact.objects.filter(org=org), date_from, date_to),
+            "period",
+            {
+                "invoiced_base": Sum("totals_base"),
+                "invoiced_tax": Sum("totals_tax"),
+                "invoices_count": Sum("invoices_count", output_field=IntegerField()),
+            },
+            group_by=group_by,
         )
-        for row in qs:
-            year = row["year"]
-            month = row["month"]
-            if year is None or month is None:
-                continue
-            items.append(
-                {
-                    "period": f"{year}-{int(month):02d}",
-                    "invoiced_base": row["total_base"] or Decimal("0.00"),
-                    "invoiced_tax": row["total_tax"] or Decimal("0.00"),
-                    "invoices_count": row["invoices_count"] or 0,
-                }
-            )
 
-    total_base = sum(item["invoiced_base"] for item in items) or Decimal("0.00")
-    total_tax = sum(item["invoiced_tax"] for item in items) or Decimal("0.00")
-    total_count = sum(item["invoices_count"] for item in items) or 0
+    qs = Invoice.objects.filter(org=org, status="posted")
+    if date_from is not None:
+        qs = qs.filter(date_issue__gte=date_from)
+    if date_to is not None:
+        qs = qs.filter(date_issue__lte=date_to)
 
-    return {
-        "group_by": group_by,
-        "items": items,
-        "totals": {
-            "invoiced_base": total_base,
-            "invoiced_tax": total_tax,
-            "invoices_count": total_count,
+    return aggregate_by_period(
+        qs,
+        "date_issue",
+        {
+            "invoiced_base": Sum("totals_base"),
+            "invoiced_tax": Sum("totals_tax"),
+            "invoices_count": Count("id"),
         },
-    }
+        group_by=group_by,
+    )
 
 
 def get_expenses_timeseries(org: Organization, date_from=None, date_to=None, group_by: str = "month"):
     """
-    Serie temporal de gastos agrupados por month|quarter|year.
+    Serie temporal de gastos agrupados por day|week|month|quarter|year.
     """
+    group_by = normalize_group_by(group_by)
+    if facts.can_use_facts(org, date_from, date_to, group_by):
+        return aggregate_by_period(
+            facts.filter_period(MonthlyExpenseFact.objects.filter(org=org), date_from, date_to),
+            "period",
+            {
+                "expenses_amount": Sum("amount"),
+                "expenses_count": Sum("expenses_count", output_field=IntegerField()),
+            },
+            group_by=group_by,
+        )
+
     qs = Expense.objects.filter(org=org)
     if date_from is not None:
         qs = qs.filter(date__gte=date_from)
     if date_to is not None:
         qs = qs.filter(date__lte=date_to)
 
-    group_by = (group_by or "month").lower()
-    if group_by not in ("month", "quarter", "year"):
-        group_by = "month"
+    return aggregate_by_period(
+        qs,
+        "date",
+        {
+            "expenses_amount": Sum("amount"),
+            "expenses_count": Count("id"),
+        },
+        group_by=group_by,
+    )
 
-    items = []
 
-    if group_by == "year":
-        qs = (
-            qs.annotate(year=ExtractYear("date"))
-            .values("year")
-            .annotate(total_amount=Sum("amount"), expenses_count=Count("id"))
-            .order_by("year")
-        )
-        for row in qs:
-            year = row["year"]
-            if year is None:
-                continue
-            items.append(
-                {
-                    "period": str(year),
-                    "expenses_amount": row["total_amount"] or Decimal("0.00"),
-                    "expenses_count": row["expenses_count"] or 0,
-                }
-            )
+def _encode_cursor(values) -> str:
+    raw = json.dumps(values, default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
 
-    elif group_by == "quarter":
-        qs = (
-            qs.annotate(year=ExtractYear("date"), quarter=ExtractQuarter("date"))
-            .values("year", "quarter")
-            .annotate(total_amount=Sum("amount"), expenses_count=Count("id"))
-            .order_by("year", "quarter")
-        )
-        for row in qs:
-            year = row["year"]
-            quarter = row["quarter"]
-            if year is None or quarter is None:
-                continue
-            items.append(
-                {
-                    "period": f"{year}-Q{quarter}",
-                    "expenses_amount": row["total_amount"] or Decimal("0.00"),
-                    "expenses_count": row["expenses_count"] or 0,
-                }
-            )
 
-    else:  # month
-        qs = (
-            qs.annotate(year=ExtractYear("date"), month=ExtractMonth("date"))
-            .values("year", "month")
-            .annotate(total_amount=Sum("amount"), expenses_count=Count("id"))
-            .order_by("year", "month")
-        )
-        for row in qs:
-            year = row["year"]
-            month = row["month"]
-            if year is None or month is None:
-                continue
-            items.append(
-                {
-                    "period": f"{year}-{int(month):02d}",
-                    "expenses_amount": row["total_amount"] or Decimal("0.00"),
-                    "expenses_count": row["expenses_count"] or 0,
-                }
-            )
+def _decode_cursor(cursor: str):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
 
-    total_amount = sum(item["expenses_amount"] for item in items) or Decimal("0.00")
-    total_count = sum(item["expenses_count"] for item in items) or 0
 
-    return {
-        "group_by": group_by,
-        "items": items,
-        "totals": {
-            "expenses_amount": total_amount,
-            "expenses_count": total_count,
-        },
-    }
+def _pending_invoices_qs(org: Organization):
+    """
+    Facturas contabilizadas con pending = total - cobrado > 0, todo en SQL.
+    El cobrado va en subquery para no multiplicar filas con el JOIN.
+    """
+    paid = (
+        Payment.objects.filter(invoice=OuterRef("pk"))
+        .values("invoice")
+        .annotate(s=Sum("amount"))
+        .values("s")
+    )
+    return (
+        Invoice.objects.filter(org=org, status="posted")
+        .exclude(payment_status="paid")
+        .annotate(paid_amount=Coalesce(Subquery(paid, output_field=D(max_digits=14, decimal_places=2)), DEC0))
+        .annotate(pending_amount=ExpressionWrapper(
+            F("total") - F("paid_amount"), output_field=D(max_digits=24, decimal_places=6)
+        ))
+        .filter(pending_amount__gt=0)
+    )
 
 
-def get_receivables_overview(org: Organization, as_of=None, limit: int = 10):
+def get_receivables_overview(org: Organization, as_of=None, limit: int = 10, cursor=None):
     """
     Resumen de cobros pendientes (ventas no pagadas totalmente).
+
+    Totales por estado con GROUP BY y top de facturas con ORDER BY ... LIMIT
+    en la BD. `next_cursor` permite paginar todas las pendientes (keyset sobre
+    pending DESC, date_issue ASC, id ASC).
     """
     if as_of is None:
         as_of = timezone.now().date()
 
-    qs = Invoice.objects.filter(org=org, status="posted").exclude(payment_status="paid")
+    qs = _pending_invoices_qs(org)
 
-    # paid_amount con Coalesce tipado
-    qs = qs.annotate(paid_amount=Coalesce(Sum("payments__amount"), DEC0))
-
-    total_pending = Decimal("0.00")
     by_status = {"unpaid": Decimal("0.00"), "partial": Decimal("0.00")}
-    invoices_data = []
-
-    for inv in qs:
-        paid_amount = inv.paid_amount or Decimal("0.00")
-        total = inv.total or Decimal("0.00")
-        pending = total - paid_amount
-        if pending <= Decimal("0.00"):
-            continue
-
-        total_pending += pending
-        status = inv.payment_status or "unpaid"
-        by_status[status] = by_status.get(status, Decimal("0.00")) + pending
-
-        days_since_issue = (as_of - inv.date_issue).days if inv.date_issue else None
-        invoices_data.append(
-            {
-                "invoice_id": inv.id,
-                "series": inv.series,
-                "number": inv.number,
-                "date_issue": inv.date_issue,
-                "customer_name": str(inv.customer),
-                "pending_amount": pending,
-                "days_since_issue": days_since_issue,
-                "payment_status": status,
-            }
+    total_pending = Decimal("0.00")
+    for row in qs.order_by().values("payment_status").annotate(s=Sum("pending_amount")):
+        status = row["payment_status"] or "unpaid"
+        by_status[status] = by_status.get(status, Decimal("0.00")) + (row["s"] or Decimal("0.00"))
+        total_pending += row["s"] or Decimal("0.00")
+
+    page = qs
+    if cursor:
+        try:
+            pending, date_issue, pk = _decode_cursor(cursor)
+            pending, date_issue, pk = Decimal(pending), date.fromisoformat(date_issue), int(pk)
+        except (ValueError, TypeError, ArithmeticError):
+            raise ValidationError({"cursor": "Cursor inválido."})
+        page = page.filter(
+            Q(pending_amount__lt=pending)
+            | Q(pending_amount=pending, date_issue__gt=date_issue)
+            | Q(pending_amount=pending, date_issue=date_issue, pk__gt=pk)
         )
 
-    invoices_data.sort(key=lambda x: (x["pending_amount"], x["days_since_issue"] or 0), reverse=True)
-    top_invoices = invoices_data[:limit]
+    rows = list(
+        page.order_by("-pending_amount", "date_issue", "pk")
+        .values(
+            "id", "series", "number", "date_issue", "payment_status", "currency",
+            "pending_amount", customer_name=contact_display_name("customer__"),
+        )[: limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    top_invoices = [
+        {
+            "invoice_id": r["id"],
+            "series": r["series"],
+            "number": r["number"],
+            "date_issue": r["date_issue"],
+            "customer_name": r["customer_name"],
+            "pending_amount": r["pending_amount"],
+            "days_since_issue": (as_of - r["date_issue"]).days if r["date_issue"] else None,
+            "payment_status": r["payment_status"] or "unpaid",
+        }
+        for r in rows
+    ]
 
-    first_inv = qs.first()
-    currency = getattr(first_inv, "currency", "EUR") if first_inv else "EUR"
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = _encode_cursor([str(last["pending_amount"]), last["date_issue"].isoformat(), last["id"]])
 
     return {
         "as_of": as_of,
-        "currency": currency,
+        "currency": rows[0]["currency"] if rows else "EUR",
         "total_pending": total_pending,
         "by_status": by_status,
         "top_invoices": top_invoices,
+        "next_cursor": next_cursor,
     }
 
 
 def get_vat_summary(org: Organization, date_from=None, date_to=None, group_by: str = "month"):
     """
-    IVA repercutido (ventas) agrupado por month|quarter|year.
+    IVA repercutido (ventas) agrupado por day|week|month|quarter|year.
     """
+    group_by = normalize_group_by(group_by)
+    if facts.can_use_facts(org, date_from, date_to, group_by):
+        return aggregate_by_period(
+            facts.filter_period(MonthlySalesFact.objects.filter(org=org), date_from, date_to),
+            "period",
+            {
+                "base_amount": Sum("totals_base"),
+                "tax_amount": Sum("totals_tax"),
+                "invoices_count": Sum("invoices_count", output_field=IntegerField()),
+            },
+            group_by=group_by,
+        )
+
     qs = Invoice.objects.filter(org=org, status="posted")
     if date_from is not None:
         qs = qs.filter(date_issue__gte=date_from)
     if date_to is not None:
         qs = qs.filter(date_issue__lte=date_to)
 
-    group_by = (group_by or "month").lower()
-    if group_by not in ("month", "quarter", "year"):
-        group_by = "month"
-
-    items = []
+    return aggregate_by_period(
+        qs,
+        "date_issue",
+        {
+            "base_amount": Sum("totals_base"),
+            "tax_amount": Sum("totals_tax"),
+            "invoices_count": Count("id"),
+        },
+        group_by=group_by,
+    )
 
-    if group_by == "year":
-        qs = (
-            qs.annotate(year=ExtractYear("date_issue"))
-            .values("year")
-            .annotate(
-                base_amount=Sum("totals_base"),
-                tax_amount=Sum("totals_tax"),
-                invoices_count=Count("id"),
-            )
-            .order_by("year")
-        )
-        for row in qs:
-            year = row["year"]
-            if year is None:
-                continue
-            items.append(
-                {
-                    "period": str(year),
-                    "base_amount": row["base_amount"] or Decimal("0.00"),
-                    "tax_amount": row["tax_amount"] or Decimal("0.00"),
-                    "invoices_count": row["invoices_count"] or 0,
-                }
-            )
 
-    elif group_by == "quarter":
+def get_top_customers(org: Organization, date_from=None, date_to=None, limit: int = 5):
+    """
+    Top clientes por facturación (base) en un rango.
+    """
+    if facts.can_use_facts(org, date_from, date_to):
         qs = (
-            qs.annotate(year=ExtractYear("date_issue"), quarter=ExtractQuarter("date_issue"))
-            .values("year", "quarter")
+            facts.filter_period(MonthlySalesFact.objects.filter(org=org), date_from, date_to)
+            .values("customer_id")
             .annotate(
-                base_amount=Sum("totals_base"),
-                tax_amount=Sum("totals_tax"),
-                invoices_count=Count("id"),
+                total_base=Sum("totals_base"),
+                total_tax=Sum("totals_tax"),
+                invoices_count=Sum("invoices_count"),
             )
-            .order_by("year", "quarter")
+            .order_by("-total_base")
         )
-        for row in qs:
-            year = row["year"]
-            quarter = row["quarter"]
-            if year is None or quarter is None:
-                continue
-            items.append(
-                {
-                    "period": f"{year}-Q{quarter}",
-                    "base_amount": row["base_amount"] or Decimal("0.00"),
-                    "tax_amount": row["tax_amount"] or Decimal("0.00"),
-                    "invoices_count": row["invoices_count"] or 0,
-                }
-            )
+    else:
+        qs = Invoice.objects.filter(org=org, status="posted")
+        if date_from is not None:
+            qs = qs.filter(date_issue__gte=date_from)
+        if date_to is not None:
+            qs = qs.filter(date_issue__lte=date_to)
 
-    else:  # month
         qs = (
-            qs.annotate(year=ExtractYear("date_issue"), month=ExtractMonth("date_issue"))
-            .values("year", "month")
+            qs.values("customer_id")
             .annotate(
-                base_amount=Sum("totals_base"),
-                tax_amount=Sum("totals_tax"),
+                total_base=Sum("totals_base"),
+                total_tax=Sum("totals_tax"),
                 invoices_count=Count("id"),
             )
-            .order_by("year", "month")
+            .order_by("-total_base")
         )
-        for row in qs:
-            year = row["year"]
-            month = row["month"]
-            if year is None or month is None:
-                continue
-            items.append(
-                {
-                    "period": f"{year}-{int(month):02d}",
-                    "base_amount": row["base_amount"] or Decimal("0.00"),
-                    "tax_amount": row["tax_amount"] or Decimal("0.00"),
-                    "invoices_count": row["invoices_count"] or 0,
-                }
-            )
-
-    total_base = sum(i["base_amount"] for i in items) or Decimal("0.00")
-    total_tax = sum(i["tax_amount"] for i in items) or Decimal("0.00")
-    total_count = sum(i["invoices_count"] for i in items) or 0
 
-    return {
-        "group_by": group_by,
-        "items": items,
-        "totals": {
-            "base_amount": total_base,
-            "tax_amount": total_tax,
-            "invoices_count": total_count,
-        },
-    }
+    return {"items": _top_customer_items(list(qs[:limit]))}
 
 
-def get_top_customers(org: Organization, date_from=None, date_to=None, limit: int = 5):
-    """
-    Top clientes por facturación (base) en un rango.
-    """
-    qs = Invoice.objects.filter(org=org, status="posted")
-    if date_from is not None:
-        qs = qs.filter(date_issue__gte=date_from)
-    if date_to is not None:
-        qs = qs.filter(date_issue__lte=date_to)
-
-    qs = (
-        qs.values("customer_id")
-        .annotate(
-            total_base=Sum("totals_base"),
-            total_tax=Sum("totals_tax"),
-            invoices_count=Count("id"),
-        )
-        .order_by("-total_base")
-    )
-
+def _top_customer_items(rows):
     from contacts.models import Contact  # import local para evitar ciclos
-    customer_ids = [row["customer_id"] for row in qs]
+    customer_ids = [row["customer_id"] for row in rows]
     contacts_by_id = {c.id: str(c) for c in Contact.objects.filter(id__in=customer_ids)}
 
     items = []
-    for row in qs[:limit]:
+    for row in rows:
         cid = row["customer_id"]
         items.append(
             {
@@ -479,8 +397,109 @@ def get_top_customers(org: Organization, date_from=None, date_to=None, limit: in
                 "invoices_count": row["invoices_count"] or 0,
             }
         )
+    return items
+
 
-    return {"items": items}
+def _add(a, b):
+    # Suma que respeta None (celda sin valor) sin forzar la escala del Decimal
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def get_posted_invoices_scan(org: Organization, date_from=None, date_to=None, group_by: str = "month", top_limits=()):
+    """
+    Una sola pasada sobre facturas contabilizadas (o sus hechos mensuales)
+    que alimenta a la vez la serie de ventas, el resumen de IVA y, si se piden
+    `top_limits`, el top de clientes del mismo rango. La usa el dashboard
+    agrupado para no escanear las mismas facturas tres veces.
+
+    Devuelve {"sales_timeseries": ..., "vat": ..., "top_customers": {limit: ...}}
+    con el mismo formato que get_sales_timeseries / get_vat_summary / get_top_customers.
+    """
+    group_by = normalize_group_by(group_by)
+    if facts.can_use_facts(org, date_from, date_to, group_by):
+        qs = facts.filter_period(MonthlySalesFact.objects.filter(org=org), date_from, date_to)
+        date_field = "period"
+        count = Sum("invoices_count", output_field=IntegerField())
+    else:
+        qs = Invoice.objects.filter(org=org, status="posted")
+        if date_from is not None:
+            qs = qs.filter(date_issue__gte=date_from)
+        if date_to is not None:
+            qs = qs.filter(date_issue__lte=date_to)
+        date_field = "date_issue"
+        count = Count("id")
+
+    metrics = {"base": Sum("totals_base"), "tax": Sum("totals_tax"), "n": count}
+
+    if not top_limits:
+        series = aggregate_by_period(qs, date_field, metrics, group_by=group_by)
+        periods = [(i["period"], i["period_start"], i["base"], i["tax"], i["n"]) for i in series["items"]]
+        totals = series["totals"]
+        return _split_invoice_scan(group_by, periods, totals, {})
+
+    # Periodo x cliente: de ahí salen serie, IVA y ranking de clientes
+    rows = (
+        qs.annotate(_period=PERIOD_TRUNCS[group_by](date_field))
+        .values("_period", "customer_id")
+        .annotate(**metrics)
+        .order_by("_period")
+    )
+    by_period = {}
+    by_customer = {}
+    totals = {"base": None, "tax": None, "n": 0}
+    for r in rows:
+        start = r["_period"]
+        if start is None:
+            continue
+        if hasattr(start, "date"):
+            start = start.date()
+        cell = by_period.setdefault(start, {"base": None, "tax": None, "n": 0})
+        cust = by_customer.setdefault(r["customer_id"], {"base": None, "tax": None, "n": 0})
+        for target in (cell, cust, totals):
+            target["base"] = _add(target["base"], r["base"])
+            target["tax"] = _add(target["tax"], r["tax"])
+            target["n"] += r["n"] or 0
+
+    zero = Decimal("0.00")
+    periods = [
+        (period_label(start, group_by), start, v["base"] or zero, v["tax"] or zero, v["n"])
+        for start, v in sorted(by_period.items())
+    ]
+    totals = {"base": totals["base"] or zero, "tax": totals["tax"] or zero, "n": totals["n"]}
+
+    ranking = sorted(
+        (
+            {"customer_id": cid, "total_base": v["base"], "total_tax": v["tax"], "invoices_count": v["n"]}
+            for cid, v in by_customer.items()
+        ),
+        key=lambda x: x["total_base"] or zero,
+        reverse=True,
+    )
+    top = {limit: {"items": _top_customer_items(ranking[:limit])} for limit in top_limits}
+    return _split_invoice_scan(group_by, periods, totals, top)
+
+
+def _split_invoice_scan(group_by, periods, totals, top):
+    sales = {"group_by": group_by, "items": [], "totals": {
+        "invoiced_base": totals["base"], "invoiced_tax": totals["tax"], "invoices_count": totals["n"],
+    }}
+    vat = {"group_by": group_by, "items": [], "totals": {
+        "base_amount": totals["base"], "tax_amount": totals["tax"], "invoices_count": totals["n"],
+    }}
+    for label, start, base, tax, n in periods:
+        sales["items"].append({
+            "period": label, "period_start": start,
+            "invoiced_base": base, "invoiced_tax": tax, "invoices_count": n,
+        })
+        vat["items"].append({
+            "period": label, "period_start": start,
+            "base_amount": base, "tax_amount": tax, "invoices_count": n,
+        })
+    return {"sales_timeseries": sales, "vat": vat, "top_customers": top}
 
 
 def get_quotes_vs_invoices(org: Organization, date_from=None, date_to=None):
@@ -510,68 +529,27 @@ def _parse_date(s):
     return datetime.fromisoformat(s).date()
 
 
-def get_margins(org, dfrom, dto, group_by="product"):
+def get_margins(org, dfrom, dto, group_by="product", limit=None):
+    """
+    Márgenes por producto | category | customer | seller, ordenados por margen
+    en la BD. Ingreso con descuento y coste con la foto de coste de la línea.
+    """
     dfrom = _parse_date(dfrom)
     dto = _parse_date(dto)
 
-    qs = (
-        InvoiceLine.objects.filter(invoice__org=org, invoice__status="posted")
-        .select_related("product", "invoice", "invoice__customer")
-    )
-    if dfrom:
-        qs = qs.filter(invoice__date_issue__gte=dfrom)
-    if dto:
-        qs = qs.filter(invoice__date_issue__lte=dto)
-
-    qs = qs.annotate(
-        revenue=Coalesce(F("qty") * F("unit_price"), DEC0),
-        cogs=Coalesce(F("qty") * F("product__cost_price"), DEC0),
-    )
-
-    # Elegir clave de agrupación
-    if group_by == "product":
-        vals = qs.values(key=F("product__name"))
-    elif group_by == "category":
-        vals = qs.values(key=F("product__category__name"))
-    elif group_by == "customer":
-        # Contact no tiene 'name'. Usamos Coalesce sobre campos reales:
-        # preferencia: razon_social -> nombre_comercial -> nombre
-        customer_key = Coalesce(
-            F("invoice__customer__razon_social"),
-            F("invoice__customer__nombre_comercial"),
-            F("invoice__customer__nombre"),
-            STR_DASH,
-        )
-        vals = qs.values(key=customer_key)
-    elif group_by == "seller":
-        vals = qs.values(key=STR_DASH)
-    else:
-        vals = qs.values(key=F("product__name"))
-
-    agg = vals.annotate(
-        revenue=Coalesce(Sum("revenue"), DEC0),
-        cogs=Coalesce(Sum("cogs"),   DEC0),
-    )
-
     rows = []
-    total_rev = Decimal("0")
-    total_cogs = Decimal("0")
-    for r in agg:
-        rev = r["revenue"] or Decimal("0")
-        c = r["cogs"] or Decimal("0")
-        m = rev - c
-        pct = (m / rev) if rev else Decimal("0")
+    for r in margins.margin_rows(org, dfrom, dto, group_by, order="margin", limit=limit):
+        rev, c, m = r["revenue"], r["cogs"], r["margin"]
         rows.append({
+            "id": r.get("group_id"),
             "key": r["key"] or "—",
             "revenue": rev,
             "cogs": c,
             "margin": m,
-            "margin_pct": pct,
+            "margin_pct": (m / rev) if rev else Decimal("0"),
         })
-        total_rev += rev
-        total_cogs += c
 
-    rows.sort(key=lambda x: x["margin"], reverse=True)
+    total_rev, total_cogs = margins.margin_totals(org, dfrom, dto)
     totals = {
         "revenue": total_rev,
         "cogs": total_cogs,
@@ -582,42 +560,55 @@ def get_margins(org, dfrom, dto, group_by="product"):
 
 
 
-def _bucket_days(overdue_days):
-    if overdue_days <= 30:
-        return "0-30"
-    if overdue_days <= 60:
-        return "31-60"
-    if overdue_days <= 90:
-        return "61-90"
-    return ">90"
-
-
-def get_aging_receivables(org, as_of=None):
+def get_aging_receivables(org, as_of=None, edges=None, breakdown=False):
     """
-    Aging de clientes por due_date (requiere Invoice.due_date).
+    Aging de clientes por due_date, neto de cobros hasta as_of.
+    Tramos configurables (edges, días) y desglose opcional por cliente.
     """
     as_of = _parse_date(as_of) or date.today()
-    inv = Invoice.objects.filter(org=org, status="posted").exclude(due_date__isnull=True)
-    buckets = Counter()
-    for x in inv.values("due_date", "total"):
-        days = (as_of - x["due_date"]).days
-        overdue = max(0, days)
-        buckets[_bucket_days(overdue)] += x["total"] or Decimal("0")
-    return {"as_of": str(as_of), "buckets": buckets}
+    edges = aging.parse_edges(edges)
+    result = aging.compute_aging(
+        Invoice.objects.filter(org=org, status="posted"),
+        Payment,
+        as_of=as_of,
+        issue_date_field="date_issue",
+        party_field="customer",
+        edges=edges,
+        breakdown=breakdown,
+        party_name=contact_display_name("customer__"),
+    )
+    data = {"as_of": str(as_of), "edges": list(edges), "buckets": result["buckets"], "total": result["total"]}
+    if breakdown:
+        data["by_customer"] = [
+            {"customer_id": p["id"], "customer_name": p["name"], "total": p["total"], "buckets": p["buckets"]}
+            for p in result["parties"]
+        ]
+    return data
 
 
-def get_aging_payables(org, as_of=None):
+def get_aging_payables(org, as_of=None, edges=None, breakdown=False):
     """
-    Aging de proveedores por due_date.
+    Aging de proveedores por due_date, neto de pagos hasta as_of.
     """
     as_of = _parse_date(as_of) or date.today()
-    inv = SupplierInvoice.objects.filter(org=org, status="posted").exclude(due_date__isnull=True)
-    buckets = Counter()
-    for x in inv.values("due_date", "total"):
-        days = (as_of - x["due_date"]).days
-        overdue = max(0, days)
-        buckets[_bucket_days(overdue)] += x["total"] or Decimal("0")
-    return {"as_of": str(as_of), "buckets": buckets}
+    edges = aging.parse_edges(edges)
+    result = aging.compute_aging(
+        SupplierInvoice.objects.filter(org=org, status="posted"),
+        SupplierPayment,
+        as_of=as_of,
+        issue_date_field="date",
+        party_field="supplier",
+        edges=edges,
+        breakdown=breakdown,
+        party_name=contact_display_name("supplier__"),
+    )
+    data = {"as_of": str(as_of), "edges": list(edges), "buckets": result["buckets"], "total": result["total"]}
+    if breakdown:
+        data["by_supplier"] = [
+            {"supplier_id": p["id"], "supplier_name": p["name"], "total": p["total"], "buckets": p["buckets"]}
+            for p in result["parties"]
+        ]
+    return data
 
 
 def get_cashflow(org, dfrom, dto, bucket="day"):
@@ -667,81 +658,162 @@ def get_cashflow(org, dfrom, dto, bucket="day"):
 
 
 
-def get_customers_abc(org, dfrom, dto, rule="80-15-5"):
-    dfrom = _parse_date(dfrom)
-    dto = _parse_date(dto)
-    a, b, c = map(int, rule.split("-"))
-
-    # Construimos la "customer_key" de forma robusta según tus campos reales
-    customer_key = Coalesce(
-        F("customer__razon_social"),
-        F("customer__nombre_comercial"),
-        F("customer__nombre"),
-        STR_DASH,
+def _customers_abc_qs(org, dfrom, dto):
+    if facts.can_use_facts(org, dfrom, dto):
+        qs = facts.filter_period(MonthlySalesFact.objects.filter(org=org), dfrom, dto)
+    else:
+        qs = Invoice.objects.filter(org=org, status="posted")
+        if dfrom:
+            qs = qs.filter(date_issue__gte=dfrom)
+        if dto:
+            qs = qs.filter(date_issue__lte=dto)
+    # Agrupamos por id (dos clientes con el mismo nombre no se mezclan)
+    return qs.values("customer_id", name=contact_display_name("customer__")).annotate(
+        revenue=Coalesce(Sum("total"), DEC0)
     )
 
-    qs = (
-        Invoice.objects.filter(org=org, status="posted")
+
+def _products_abc_qs(org, dfrom, dto):
+    if facts.can_use_facts(org, dfrom, dto):
+        qs = facts.filter_period(MonthlyProductFact.objects.filter(org=org), dfrom, dto)
+        revenue = Sum("revenue")
+    else:
+        qs = InvoiceLine.objects.filter(
+            invoice__org=org, invoice__status="posted", product__isnull=False
+        )
+        if dfrom:
+            qs = qs.filter(invoice__date_issue__gte=dfrom)
+        if dto:
+            qs = qs.filter(invoice__date_issue__lte=dto)
+        revenue = Sum(margins.line_revenue())
+    return qs.values("product_id", name=F("product__name"), sku=F("product__sku")).annotate(
+        revenue=Coalesce(revenue, DEC0)
     )
-    if dfrom:
-        qs = qs.filter(date_issue__gte=dfrom)
-    if dto:
-        qs = qs.filter(date_issue__lte=dto)
-
-    # Primero anotamos la clave, luego values() y luego agregamos
-    qs = (
-        qs.annotate(customer_key=customer_key)
-          .values("customer_key")
-          .annotate(revenue=Coalesce(Sum("total"), DEC0))  # o Sum("totals_base") si prefieres base
-          .order_by("-revenue")
+
+
+def _suppliers_abc_qs(org, dfrom, dto):
+    if facts.can_use_facts(org, dfrom, dto):
+        qs = facts.filter_period(MonthlyPurchaseFact.objects.filter(org=org), dfrom, dto)
+    else:
+        qs = SupplierInvoice.objects.filter(org=org, status="posted")
+        if dfrom:
+            qs = qs.filter(date__gte=dfrom)
+        if dto:
+            qs = qs.filter(date__lte=dto)
+    return qs.values("supplier_id", name=contact_display_name("supplier__")).annotate(
+        revenue=Coalesce(Sum("total"), DEC0)
     )
 
-    rows = list(qs)
-    total = sum((r["revenue"] for r in rows), Decimal("0"))
-    a_cut = total * Decimal(a / 100)
-    b_cut = total * Decimal((a + b) / 100)
 
-    A, B, Cc = [], [], []
-    acc = Decimal("0")
-    for r in rows:
-        acc += r["revenue"]
-        item = {"customer_name": r["customer_key"], "revenue": r["revenue"]}
-        if acc <= a_cut:
-            A.append(item)
-        elif acc <= b_cut:
-            B.append(item)
-        else:
-            Cc.append(item)
+# entidad -> (queryset agrupado, campo id, item público)
+_ABC_SOURCES = {
+    "customers": (
+        _customers_abc_qs,
+        "customer_id",
+        lambda r: {"customer_id": r["customer_id"], "customer_name": r["name"], "revenue": r["revenue"]},
+    ),
+    "products": (
+        _products_abc_qs,
+        "product_id",
+        lambda r: {"product_id": r["product_id"], "product_name": r["name"], "sku": r["sku"], "revenue": r["revenue"]},
+    ),
+    "suppliers": (
+        _suppliers_abc_qs,
+        "supplier_id",
+        lambda r: {"supplier_id": r["supplier_id"], "supplier_name": r["name"], "revenue": r["revenue"]},
+    ),
+}
+
+
+def iter_abc(org, entity, dfrom, dto, rule="80-15-5"):
+    """
+    Generador (streaming) de filas ABC de `entity` (customers|products|suppliers):
+    item público + abc_class + cumulative_share.
+    """
+    build_qs, key_field, item = _ABC_SOURCES[entity]
+    for row in abc.iter_abc(build_qs(org, _parse_date(dfrom), _parse_date(dto)), key_field, rule):
+        yield {**item(row), "abc_class": row["abc_class"], "cumulative_share": row["cumulative_share"]}
+
 
-    return {"rule": rule, "a": A, "b": B, "c": Cc, "total": total}
+def _get_abc(org, entity, dfrom, dto, rule):
+    build_qs, key_field, item = _ABC_SOURCES[entity]
+    rows = abc.iter_abc(build_qs(org, _parse_date(dfrom), _parse_date(dto)), key_field, rule)
+    return abc.summarize_abc(rows, item, rule)
+
+
+def get_customers_abc(org, dfrom, dto, rule="80-15-5"):
+    return _get_abc(org, "customers", dfrom, dto, rule)
+
+
+def get_products_abc(org, dfrom, dto, rule="80-15-5"):
+    return _get_abc(org, "products", dfrom, dto, rule)
+
+
+def get_suppliers_abc(org, dfrom, dto, rule="80-15-5"):
+    return _get_abc(org, "suppliers", dfrom, dto, rule)
 
 
 def get_cohorts(org, months=6):
-    # Placeholder; implementaremos cuando fijemos la definición de cohorte.
-    return {"months": months, "cohorts": []}
+    """
+    Cohortes de clientes de los últimos `months` meses (máx. 36).
+    Lee la matriz persistida (MonthlyCohortCell) si la org tiene la capa de
+    hechos activa; si no, la calcula con una query agrupada sobre Invoice.
+    """
+    months = max(1, min(int(months), cohorts.MAX_MONTHS))
+    current = timezone.localdate().replace(day=1)
+    first = _add_months(current, -(months - 1))
+
+    if facts.facts_enabled(org):
+        rows = (
+            MonthlyCohortCell.objects.filter(org=org, cohort__gte=first, month_index__lt=months)
+            .values("cohort", "month_index", "active_customers", "revenue")
+        )
+    else:
+        rows = [
+            {
+                "cohort": facts.month_start(r["cohort"]),
+                "month_index": cohorts.month_index(facts.month_start(r["cohort"]), facts.month_start(r["month"])),
+                "active_customers": r["active_customers"],
+                "revenue": r["revenue"] or Decimal("0.00"),
+            }
+            for r in cohorts.cohort_rows(org).filter(cohort__gte=first)
+        ]
+
+    matrix = defaultdict(dict)
+    for r in rows:
+        if r["month_index"] < months:
+            matrix[r["cohort"]][r["month_index"]] = r
+
+    items = []
+    for cohort in sorted(matrix):
+        size = matrix[cohort].get(0, {}).get("active_customers", 0)
+        cells = []
+        for idx in range(min(months, cohorts.month_index(cohort, current) + 1)):
+            cell = matrix[cohort].get(idx)
+            active = cell["active_customers"] if cell else 0
+            cells.append({
+                "month": idx,
+                "active_customers": active,
+                "retention": round(active / size, 4) if size else 0.0,
+                "revenue": cell["revenue"] if cell else Decimal("0.00"),
+            })
+        items.append({"cohort": f"{cohort.year}-{cohort.month:02d}", "customers": size, "cells": cells})
+
+    return {"months": months, "cohorts": items}
+
+
+def _add_months(d, n):
+    y, m = divmod(d.month - 1 + n, 12)
+    return d.replace(year=d.year + y, month=m + 1, day=1)
 
 
 def get_top_products(org, dfrom, dto, by="revenue", limit=10):
     dfrom = _parse_date(dfrom)
     dto = _parse_date(dto)
-
-    qs = (
-        InvoiceLine.objects.filter(invoice__org=org, invoice__status="posted")
-        .select_related("product", "invoice")
-    )
-    if dfrom:
-        qs = qs.filter(invoice__date_issue__gte=dfrom)
-    if dto:
-        qs = qs.filter(invoice__date_issue__lte=dto)
-
-    qs = qs.annotate(
-        revenue=Coalesce(F("qty") * F("unit_price"), DEC0),
-        margin=Coalesce(F("qty") * F("unit_price"), DEC0) - Coalesce(F("qty") * F("product__cost_price"), DEC0),
-    ).values("product__name").annotate(
-        revenue=Coalesce(Sum("revenue"), DEC0),
-        margin=Coalesce(Sum("margin"), DEC0),
-    )
-
     key = "margin" if by == "margin" else "revenue"
-    rows = sorted(qs, key=lambda x: x[key], reverse=True)[:limit]
+
+    rows = [
+        {"product_id": r["group_id"], "product__name": r["key"], "revenue": r["revenue"], "margin": r["margin"]}
+        for r in margins.margin_rows(org, dfrom, dto, "product", order=key, limit=limit)
+    ]
     return {"by": key, "rows": rows}
@@ -0,0 +1,41 @@
+# analytics/signals.py
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_org_version
+from .facts import month_start, refresh_expense_cells
+from .models import Expense
+from sales.models import Quote
+
+
+@receiver(pre_save, sender=Expense)
+def remember_expense_cell(sender, instance, **kwargs):
+    # Guardamos la celda anterior por si cambia fecha/categoría
+    instance._previous_fact_cell = None
+    if instance.pk:
+        old = Expense.objects.filter(pk=instance.pk).values("date", "category").first()
+        if old:
+            instance._previous_fact_cell = (month_start(old["date"]), old["category"])
+
+
+@receiver(post_save, sender=Expense)
+def update_expense_facts_on_save(sender, instance, **kwargs):
+    cells = [(month_start(instance.date), instance.category)]
+    previous = getattr(instance, "_previous_fact_cell", None)
+    if previous:
+        cells.append(previous)
+    refresh_expense_cells(instance.org, cells)
+    bump_org_version(instance.org_id)
+
+
+@receiver(post_delete, sender=Expense)
+def update_expense_facts_on_delete(sender, instance, **kwargs):
+    refresh_expense_cells(instance.org, [(month_start(instance.date), instance.category)])
+    bump_org_version(instance.org_id)
+
+
+@receiver(post_save, sender=Quote)
+@receiver(post_delete, sender=Quote)
+def invalidate_cache_on_quote_change(sender, instance, **kwargs):
+    # quotes-vs-invoices depende de los presupuestos
+    bump_org_version(instance.org_id)
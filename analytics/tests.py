@@ -1,3 +1,225 @@
-from django.test import TestCase
+# analytics/tests.py
+import time
+from datetime import date
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from contacts.models import Contact
+from core.models import Organization
+from sales.models import Invoice, InvoiceLine
+from sales.services_invoice import post_invoice, post_invoices
+
+from . import cache as analytics_cache
+from .cohorts import cohort_rows, month_index, rebuild_org_cohorts
+from .facts import month_start
+from .models import MonthlyCohortCell
+from .services import _encode_cursor, get_receivables_overview
+from .views import AnalyticsCacheStatsView, YearlySummaryView
+
+# Caché de analítica en memoria (sin Redis)
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "analytics": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "analytics-tests",
+        "KEY_PREFIX": "analytics",
+    },
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AnalyticsCacheTests(TestCase):
+    def setUp(self):
+        caches[analytics_cache.CACHE_ALIAS].clear()
+        self.org = Organization.objects.create(name="Org", slug="org")
+        self.other = Organization.objects.create(name="Otra", slug="otra")
+        self.params = QueryDict("from=2025-01-01&group_by=month")
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return {"calls": self.calls}
+
+    def get(self, org, params=None):
+        return analytics_cache.get_or_compute(org, "sales-timeseries", params or self.params, self.compute)
+
+    def bump(self, org):
+        # bump_org_version se aplica al hacer commit
+        with self.captureOnCommitCallbacks(execute=True):
+            analytics_cache.bump_org_version(org)
+
+    def test_second_read_is_a_hit(self):
+        self.assertEqual(self.get(self.org), ({"calls": 1}, False))
+        self.assertEqual(self.get(self.org), ({"calls": 1}, True))
+        self.assertEqual(self.calls, 1)
+
+    def test_params_are_normalized(self):
+        self.get(self.org)
+        data, hit = self.get(self.org, QueryDict("group_by=month&empty=&from=2025-01-01"))
+        self.assertTrue(hit)
+        self.assertEqual(data, {"calls": 1})
+
+    def test_bump_invalidates_only_that_org(self):
+        self.get(self.org)
+        self.get(self.other)
+        version = analytics_cache.get_org_version(self.org)
+
+        self.bump(self.org)
+
+        self.assertNotEqual(analytics_cache.get_org_version(self.org), version)
+        self.assertEqual(self.get(self.org), ({"calls": 3}, False))
+        self.assertEqual(self.get(self.other), ({"calls": 2}, True))
+
+    def test_bump_waits_for_commit(self):
+        self.get(self.org)
+        with self.captureOnCommitCallbacks() as callbacks:
+            analytics_cache.bump_org_version(self.org)
+            # antes del commit se sigue sirviendo la versión anterior
+            self.assertTrue(self.get(self.org)[1])
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertFalse(self.get(self.org)[1])
+
+    def test_lost_version_does_not_resurrect_entries(self):
+        self.get(self.org)
+        caches[analytics_cache.CACHE_ALIAS].delete(analytics_cache._version_key(self.org.pk))
+        # la versión nueva sale del reloj (ms): un instante después
+        later = time.time() + 1
+        with mock.patch("analytics.cache.time.time", return_value=later):
+            self.assertFalse(self.get(self.org)[1])
+
+    def test_stats_count_hits_and_misses(self):
+        analytics_cache.reset_stats()
+        self.get(self.org)
+        self.get(self.org)
+        self.get(self.org)
+        self.assertEqual(analytics_cache.get_stats(), {"hits": 2, "misses": 1, "hit_ratio": 0.6667})
+
+
+@override_settings(CACHES=LOCMEM_CACHES, ALLOWED_HOSTS=["testserver"])
+class AnalyticsCacheViewTests(TestCase):
+    def setUp(self):
+        caches[analytics_cache.CACHE_ALIAS].clear()
+        self.org = Organization.objects.create(name="Org", slug="org")
+        self.user = User.objects.create(email="user@example.com")
+        self.staff = User.objects.create(email="staff@example.com", is_staff=True)
+
+    def call(self, view, user):
+        request = APIRequestFactory().get("/")
+        request.org = self.org
+        force_authenticate(request, user=user)
+        response = view.as_view()(request, org_slug=self.org.slug)
+        response.render()
+        return response
+
+    def test_cache_header_and_invalidation(self):
+        self.assertEqual(self.call(YearlySummaryView, self.user)["X-Analytics-Cache"], "MISS")
+        self.assertEqual(self.call(YearlySummaryView, self.user)["X-Analytics-Cache"], "HIT")
+        with self.captureOnCommitCallbacks(execute=True):
+            analytics_cache.bump_org_version(self.org)
+        self.assertEqual(self.call(YearlySummaryView, self.user)["X-Analytics-Cache"], "MISS")
+
+    def test_cache_stats_is_staff_only(self):
+        self.assertEqual(self.call(AnalyticsCacheStatsView, self.user).status_code, 403)
+        response = self.call(AnalyticsCacheStatsView, self.staff)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["org_version"], analytics_cache.get_org_version(self.org))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CohortMatrixTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.customers = [
+            Contact.objects.create(org=cls.org, tipo="client", razon_social=f"Cliente {i}") for i in range(3)
+        ]
+
+    def draft(self, customer, issued, amount):
+        inv = Invoice.objects.create(org=self.org, customer=customer, series="A", date_issue=issued)
+        InvoiceLine.objects.create(invoice=inv, description="Línea", qty=Decimal("1"), unit_price=Decimal(amount))
+        return inv
+
+    def matrix(self):
+        return {
+            (c.cohort, c.month_index): (c.active_customers, c.revenue)
+            for c in MonthlyCohortCell.objects.filter(org=self.org)
+        }
+
+    def rebuilt(self):
+        """Matriz esperada: la del agregado completo de rebuild_org_cohorts."""
+        expected = {}
+        for r in cohort_rows(self.org):
+            cohort = month_start(r["cohort"])
+            expected[(cohort, month_index(cohort, month_start(r["month"])))] = (r["active_customers"], r["revenue"])
+        return expected
+
+    def test_incremental_matrix_matches_rebuild(self):
+        c1, c2, c3 = self.customers
+        steps = [
+            [self.draft(c1, date(2025, 3, 10), "100.00")],
+            [self.draft(c2, date(2025, 3, 20), "40.00")],
+            # factura anterior a su cohorte: c1 pasa de marzo a enero
+            [self.draft(c1, date(2025, 1, 5), "10.00")],
+            # lote con varias facturas del mismo cliente y mes, y un cliente nuevo
+            [self.draft(c1, date(2025, 4, 1), "5.00"), self.draft(c1, date(2025, 4, 30), "7.50"),
+             self.draft(c3, date(2025, 2, 1), "20.00"), self.draft(c2, date(2024, 12, 31), "1.00")],
+        ]
+        for invoices in steps:
+            with self.subTest(invoices=[inv.date_issue for inv in invoices]):
+                if len(invoices) == 1:
+                    post_invoice(invoices[0])
+                else:
+                    post_invoices(self.org, [inv.id for inv in invoices])
+                self.assertEqual(self.matrix(), self.rebuilt())
+
+        incremental = self.matrix()
+        self.assertEqual(incremental[(date(2025, 1, 1), 3)], (1, Decimal("12.50")))
+        rebuild_org_cohorts(self.org)
+        self.assertEqual(self.matrix(), incremental)
+
+
+class ReceivablesCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        customer = Contact.objects.create(org=cls.org, tipo="client", razon_social="Cliente")
+        # importes repetidos: el desempate va por fecha e id
+        Invoice.objects.bulk_create([
+            Invoice(org=cls.org, customer=customer, status="posted", date_issue=date(2026, 1, 1 + i % 3),
+                    total=Decimal(10 * (1 + i % 2)))
+            for i in range(7)
+        ])
+
+    def test_pages_cover_all_pending_invoices(self):
+        seen, cursor = [], None
+        while True:
+            data = get_receivables_overview(self.org, as_of=date(2026, 2, 1), limit=2, cursor=cursor)
+            seen += [row["invoice_id"] for row in data["top_invoices"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        expected = Invoice.objects.filter(org=self.org).order_by("-total", "date_issue", "pk")
+        self.assertEqual(seen, list(expected.values_list("pk", flat=True)))
+
+    def test_crafted_cursor_is_a_validation_error(self):
+        crafted = [
+            "no-es-base64$",
+            _encode_cursor({"a": 1}),
+            _encode_cursor(["10.00", "2026-01-01"]),
+            _encode_cursor(["diez", "2026-01-01", 1]),
+            _encode_cursor(["10.00", "ayer", 1]),
+            _encode_cursor(["10.00", "2026-01-01", "uno"]),
+            _encode_cursor(["10.00", "2026-01-01", None]),
+            _encode_cursor(["10.00", "2026-01-01", [1]]),
+        ]
+        for cursor in crafted:
+            with self.subTest(cursor=cursor), self.assertRaises(ValidationError):
+                get_receivables_overview(self.org, limit=2, cursor=cursor)
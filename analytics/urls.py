@@ -4,7 +4,8 @@ from .views import (
     health, YearlySummaryView, SalesTimeseriesView, ExpensesTimeseriesView,
     ReceivablesView, VatSummaryView, TopCustomersView, QuotesVsInvoicesView,
     MarginsView, AgingReceivablesView, AgingPayablesView,
-    CashflowView, CustomersABCView, CohortsView, TopProductsView,
+    CashflowView, CustomersABCView, ProductsABCView, SuppliersABCView, CohortsView, TopProductsView,
+    AnalyticsCacheStatsView, DashboardView,
 )
 
 urlpatterns = [
@@ -24,4 +25,8 @@ urlpatterns = [
     path("customers/abc/", CustomersABCView.as_view(), name="analytics-customers-abc"),
     path("customers/cohorts/", CohortsView.as_view(), name="analytics-customers-cohorts"),
     path("products/top/", TopProductsView.as_view(), name="analytics-products-top"),
+    path("products/abc/", ProductsABCView.as_view(), name="analytics-products-abc"),
+    path("suppliers/abc/", SuppliersABCView.as_view(), name="analytics-suppliers-abc"),
+    path("dashboard/", DashboardView.as_view(), name="analytics-dashboard"),
+    path("cache-stats/", AnalyticsCacheStatsView.as_view(), name="analytics-cache-stats"),
 ]
@@ -1,24 +1,30 @@
 # analytics/views.py
+import csv
 from datetime import date
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.exceptions import ValidationError
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 
-from .services import get_yearly_summary, get_sales_timeseries, get_expenses_timeseries, get_receivables_overview, get_vat_summary, get_top_customers, get_quotes_vs_invoices, get_margins, get_aging_receivables, get_aging_payables, get_cashflow, get_customers_abc, get_cohorts, get_top_products
+from .services import get_yearly_overview, get_sales_timeseries, get_expenses_timeseries, get_receivables_overview, get_vat_summary, get_top_customers, get_quotes_vs_invoices, get_margins, get_aging_receivables, get_aging_payables, get_cashflow, get_customers_abc, get_products_abc, get_suppliers_abc, iter_abc, get_cohorts, get_top_products
+from .abc import parse_rule
 from billing.decorators import require_plan
+from . import cache as analytics_cache
+from .dashboard import run_dashboard
 
 def health(_request):
     return JsonResponse({"app": "analytics", "status": "ok"})
 
 class BaseAnalyticsView(APIView):
     """
-    Base para views de analytics, para reutilizar get_org.
+    Base para views de analytics, para reutilizar get_org y la caché por org.
     """
     permission_classes = [IsAuthenticated]
+    # Nombre del endpoint dentro de la clave de caché (None = sin caché)
+    cache_endpoint = None
 
     def get_org(self, request):
         org = getattr(request, "org", None)
@@ -26,41 +32,41 @@ class BaseAnalyticsView(APIView):
             raise ValidationError("No se ha podido resolver la organización (org) desde la URL.")
         return org
 
+    def cached_response(self, request, compute):
+        """
+        Sirve `compute()` desde la caché de analítica de la org (clave por
+        endpoint + query params). Cabecera X-Analytics-Cache: HIT | MISS.
+        """
+        if not self.cache_endpoint:
+            return Response(compute())
+        data, hit = analytics_cache.get_or_compute(
+            self.get_org(request), self.cache_endpoint, request.query_params, compute
+        )
+        response = Response(data)
+        response["X-Analytics-Cache"] = "HIT" if hit else "MISS"
+        return response
+
 
-class YearlySummaryView(APIView):
+class YearlySummaryView(BaseAnalyticsView):
     """
     GET /api/v1/t/{org_slug}/analytics/yearly-summary/
 
     Devuelve ingresos, gastos y beneficio por año para la org de la request.
     """
-    permission_classes = [IsAuthenticated]
-
-    def get_org(self, request):
-        org = getattr(request, "org", None)
-        if org is None:
-            raise ValidationError("No se ha podido resolver la organización (org) desde la URL.")
-        return org
+    cache_endpoint = "yearly-summary"
 
     def get(self, request, *args, **kwargs):
         org = self.get_org(request)
-        items = get_yearly_summary(org)
 
-        # Año con mayor beneficio (por si quieres mostrarlo en el frontend)
-        best_year = None
-        if items:
-            best_year = max(items, key=lambda x: x["profit"])
-
-        return Response({
-            "items": items,
-            "best_year": best_year,  # puede ser null si no hay datos
-        })
+        return self.cached_response(request, lambda: get_yearly_overview(org))
 
 class SalesTimeseriesView(BaseAnalyticsView):
     """
-    GET /api/v1/t/{org_slug}/analytics/sales-timeseries/?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=month|quarter|year
+    GET /api/v1/t/{org_slug}/analytics/sales-timeseries/?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=day|week|month|quarter|year
 
     Devuelve la serie temporal de ingresos agrupada según group_by.
     """
+    cache_endpoint = "sales-timeseries"
 
     def parse_date(self, value, field_name):
         if not value:
@@ -80,21 +86,23 @@ class SalesTimeseriesView(BaseAnalyticsView):
         date_from = self.parse_date(from_str, "from")
         date_to = self.parse_date(to_str, "to")
 
-        data = get_sales_timeseries(
-            org=org,
-            date_from=date_from,
-            date_to=date_to,
-            group_by=group_by,
+        return self.cached_response(
+            request,
+            lambda: get_sales_timeseries(
+                org=org,
+                date_from=date_from,
+                date_to=date_to,
+                group_by=group_by,
+            ),
         )
 
-        return Response(data)
-
 class ExpensesTimeseriesView(BaseAnalyticsView):
     """
-    GET /api/v1/t/{org_slug}/analytics/expenses-timeseries/?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=month|quarter|year
+    GET /api/v1/t/{org_slug}/analytics/expenses-timeseries/?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=day|week|month|quarter|year
 
     Devuelve la serie temporal de gastos agrupada según group_by.
     """
+    cache_endpoint = "expenses-timeseries"
 
     def parse_date(self, value, field_name):
         if not value:
@@ -114,21 +122,24 @@ class ExpensesTimeseriesView(BaseAnalyticsView):
         date_from = self.parse_date(from_str, "from")
         date_to = self.parse_date(to_str, "to")
 
-        data = get_expenses_timeseries(
-            org=org,
-            date_from=date_from,
-            date_to=date_to,
-            group_by=group_by,
+        return self.cached_response(
+            request,
+            lambda: get_expenses_timeseries(
+                org=org,
+                date_from=date_from,
+                date_to=date_to,
+                group_by=group_by,
+            ),
         )
 
-        return Response(data)
-
 class ReceivablesView(BaseAnalyticsView):
     """
-    GET /api/v1/t/{org_slug}/analytics/receivables/?as_of=YYYY-MM-DD&limit=10
+    GET /api/v1/t/{org_slug}/analytics/receivables/?as_of=YYYY-MM-DD&limit=10&cursor=...
 
     Devuelve total pendiente, desglose por estado y top facturas pendientes.
+    `next_cursor` de la respuesta pagina el resto de facturas pendientes.
     """
+    cache_endpoint = "receivables"
 
     def parse_date(self, value, field_name):
         if not value:
@@ -145,28 +156,31 @@ class ReceivablesView(BaseAnalyticsView):
         limit_str = request.query_params.get("limit")
 
         as_of = self.parse_date(as_of_str, "as_of")
-        if as_of is None:
-            # Si no viene, usamos hoy dentro del servicio
-            data = get_receivables_overview(org=org)
-        else:
-            # Limit opcional
-            try:
-                limit = int(limit_str) if limit_str else 10
-            except ValueError:
-                raise ValidationError({"limit": "Debe ser un entero."})
-
-            data = get_receivables_overview(
+        cursor = request.query_params.get("cursor")
+
+        # Limit opcional
+        try:
+            limit = int(limit_str) if limit_str else 10
+        except ValueError:
+            raise ValidationError({"limit": "Debe ser un entero."})
+        limit = max(1, min(limit, 200))
+
+        # Si as_of no viene, el servicio usa hoy
+        return self.cached_response(
+            request,
+            lambda: get_receivables_overview(
                 org=org,
                 as_of=as_of,
                 limit=limit,
-            )
-
-        return Response(data)
+                cursor=cursor,
+            ),
+        )
 
 class VatSummaryView(BaseAnalyticsView):
     """
-    GET /api/v1/t/{org_slug}/analytics/vat/?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=month|quarter|year
+    GET /api/v1/t/{org_slug}/analytics/vat/?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=day|week|month|quarter|year
     """
+    cache_endpoint = "vat"
 
     def parse_date(self, value, field_name):
         if not value:
@@ -186,19 +200,21 @@ class VatSummaryView(BaseAnalyticsView):
         date_from = self.parse_date(from_str, "from")
         date_to = self.parse_date(to_str, "to")
 
-        data = get_vat_summary(
-            org=org,
-            date_from=date_from,
-            date_to=date_to,
-            group_by=group_by,
+        return self.cached_response(
+            request,
+            lambda: get_vat_summary(
+                org=org,
+                date_from=date_from,
+                date_to=date_to,
+                group_by=group_by,
+            ),
         )
 
-        return Response(data)
-
 class TopCustomersView(BaseAnalyticsView):
     """
     GET /api/v1/t/{org_slug}/analytics/top-customers/?from=YYYY-MM-DD&to=YYYY-MM-DD&limit=5
     """
+    cache_endpoint = "top-customers"
 
     def parse_date(self, value, field_name):
         if not value:
@@ -223,19 +239,21 @@ class TopCustomersView(BaseAnalyticsView):
         except ValueError:
             raise ValidationError({"limit": "Debe ser un entero."})
 
-        data = get_top_customers(
-            org=org,
-            date_from=date_from,
-            date_to=date_to,
-            limit=limit,
+        return self.cached_response(
+            request,
+            lambda: get_top_customers(
+                org=org,
+                date_from=date_from,
+                date_to=date_to,
+                limit=limit,
+            ),
         )
 
-        return Response(data)
-
 class QuotesVsInvoicesView(BaseAnalyticsView):
     """
     GET /api/v1/t/{org_slug}/analytics/quotes-vs-invoices/?from=YYYY-MM-DD&to=YYYY-MM-DD
     """
+    cache_endpoint = "quotes-vs-invoices"
 
     def parse_date(self, value, field_name):
         if not value:
@@ -254,66 +272,200 @@ class QuotesVsInvoicesView(BaseAnalyticsView):
         date_from = self.parse_date(from_str, "from")
         date_to = self.parse_date(to_str, "to")
 
-        data = get_quotes_vs_invoices(
-            org=org,
-            date_from=date_from,
-            date_to=date_to,
+        return self.cached_response(
+            request,
+            lambda: get_quotes_vs_invoices(
+                org=org,
+                date_from=date_from,
+                date_to=date_to,
+            ),
         )
 
-        return Response(data)
-
 
 class MarginsView(BaseAnalyticsView):
+    cache_endpoint = "margins"
+
     @require_plan("pro")
     def get(self, request, *args, **kwargs):
         org = self.get_org(request)
         group_by = request.query_params.get("group_by", "product")
         dfrom = request.query_params.get("from")
         dto = request.query_params.get("to")
-        return Response(get_margins(org, dfrom, dto, group_by))
+        try:
+            limit = int(request.query_params.get("limit") or 0) or None
+        except ValueError:
+            raise ValidationError({"limit": "Debe ser un entero."})
+        return self.cached_response(request, lambda: get_margins(org, dfrom, dto, group_by, limit))
 
 class AgingReceivablesView(BaseAnalyticsView):
+    """
+    GET /api/v1/t/{org_slug}/analytics/aging/receivables/?as_of=YYYY-MM-DD&edges=30,60,90&breakdown=1
+    """
+    cache_endpoint = "aging-receivables"
+
     def get(self, request, *args, **kwargs):
         org = self.get_org(request)
         as_of = request.query_params.get("as_of")
-        return Response(get_aging_receivables(org, as_of))
+        edges = request.query_params.get("edges")
+        breakdown = request.query_params.get("breakdown") in ("1", "true", "True")
+        return self.cached_response(request, lambda: get_aging_receivables(org, as_of, edges, breakdown))
 
 class AgingPayablesView(BaseAnalyticsView):
+    """
+    GET /api/v1/t/{org_slug}/analytics/aging/payables/?as_of=YYYY-MM-DD&edges=30,60,90&breakdown=1
+    """
+    cache_endpoint = "aging-payables"
+
     def get(self, request, *args, **kwargs):
         org = self.get_org(request)
         as_of = request.query_params.get("as_of")
-        return Response(get_aging_payables(org, as_of))
+        edges = request.query_params.get("edges")
+        breakdown = request.query_params.get("breakdown") in ("1", "true", "True")
+        return self.cached_response(request, lambda: get_aging_payables(org, as_of, edges, breakdown))
 
 class CashflowView(BaseAnalyticsView):
+    cache_endpoint = "cashflow"
+
     @require_plan("pro")
     def get(self, request, *args, **kwargs):
         org = self.get_org(request)
         dfrom = request.query_params.get("from")
         dto = request.query_params.get("to")
         bucket = request.query_params.get("bucket", "day")
-        return Response(get_cashflow(org, dfrom, dto, bucket))
+        return self.cached_response(request, lambda: get_cashflow(org, dfrom, dto, bucket))
+
+class _Echo:
+    """Pseudo-buffer para csv.writer: devuelve la línea en vez de escribirla."""
+
+    def write(self, value):
+        return value
+
+
+class BaseABCView(BaseAnalyticsView):
+    """
+    GET ...?from=YYYY-MM-DD&to=YYYY-MM-DD&rule=80-15-5[&stream=csv]
+
+    Con stream=csv se devuelven TODAS las filas en streaming (sin pasar por
+    caché ni cargar la lista completa en memoria).
+    """
+    entity = None
+    abc_fn = None
+    csv_columns = ()
 
-class CustomersABCView(BaseAnalyticsView):
     @require_plan("pro")
     def get(self, request, *args, **kwargs):
         org = self.get_org(request)
         dfrom = request.query_params.get("from")
         dto = request.query_params.get("to")
         rule = request.query_params.get("rule", "80-15-5")
-        return Response(get_customers_abc(org, dfrom, dto, rule))
+        parse_rule(rule)
+
+        if request.query_params.get("stream") == "csv":
+            return self.stream_csv(iter_abc(org, self.entity, dfrom, dto, rule))
+        return self.cached_response(request, lambda: self.abc_fn(org, dfrom, dto, rule))
+
+    def stream_csv(self, rows):
+        writer = csv.writer(_Echo())
+        columns = (*self.csv_columns, "revenue", "cumulative_share", "abc_class")
+
+        def lines():
+            yield writer.writerow(columns)
+            for row in rows:
+                yield writer.writerow([row[c] for c in columns])
+
+        response = StreamingHttpResponse(lines(), content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="abc_{self.entity}.csv"'
+        return response
+
+
+class CustomersABCView(BaseABCView):
+    cache_endpoint = "customers-abc"
+    entity = "customers"
+    abc_fn = staticmethod(get_customers_abc)
+    csv_columns = ("customer_id", "customer_name")
+
+
+class ProductsABCView(BaseABCView):
+    cache_endpoint = "products-abc"
+    entity = "products"
+    abc_fn = staticmethod(get_products_abc)
+    csv_columns = ("product_id", "sku", "product_name")
+
+
+class SuppliersABCView(BaseABCView):
+    cache_endpoint = "suppliers-abc"
+    entity = "suppliers"
+    abc_fn = staticmethod(get_suppliers_abc)
+    csv_columns = ("supplier_id", "supplier_name")
 
 class CohortsView(BaseAnalyticsView):
+    """
+    GET /api/v1/t/{org_slug}/analytics/customers/cohorts/?months=12  (máx. 36)
+    """
+    cache_endpoint = "customers-cohorts"
+
     @require_plan("pro")
     def get(self, request, *args, **kwargs):
         org = self.get_org(request)
-        months = int(request.query_params.get("months", "6"))
-        return Response(get_cohorts(org, months))
+        try:
+            months = int(request.query_params.get("months", "6"))
+        except ValueError:
+            raise ValidationError({"months": "Debe ser un entero."})
+        return self.cached_response(request, lambda: get_cohorts(org, months))
 
 class TopProductsView(BaseAnalyticsView):
+    cache_endpoint = "products-top"
+
     def get(self, request, *args, **kwargs):
         org = self.get_org(request)
         dfrom = request.query_params.get("from")
         dto = request.query_params.get("to")
         by = request.query_params.get("by", "revenue")
         limit = int(request.query_params.get("limit", "10"))
-        return Response(get_top_products(org, dfrom, dto, by, limit))
\ No newline at end of file
+        return self.cached_response(request, lambda: get_top_products(org, dfrom, dto, by, limit))
+
+
+class AnalyticsCacheStatsView(BaseAnalyticsView):
+    """
+    GET /api/v1/t/{org_slug}/analytics/cache-stats/
+
+    Contadores globales de aciertos/fallos de la caché de analítica
+    y versión actual de la caché de la org. Solo staff: los contadores son
+    de todas las organizaciones.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        org = self.get_org(request)
+        data = analytics_cache.get_stats()
+        data["org_version"] = analytics_cache.get_org_version(org)
+        return Response(data)
+
+
+class DashboardView(BaseAnalyticsView):
+    """
+    POST /api/v1/t/{org_slug}/analytics/dashboard/
+
+    Body:
+    {
+      "parallel": true,
+      "widgets": [
+        {"id": "ventas", "type": "sales-timeseries", "params": {"from": "2025-01-01", "group_by": "month"}},
+        {"id": "iva", "type": "vat", "params": {"from": "2025-01-01"}},
+        {"type": "top-customers", "params": {"from": "2025-01-01", "limit": 5}}
+      ]
+    }
+
+    Devuelve todos los widgets en una respuesta; los errores (plan, params)
+    van por widget sin tumbar el resto.
+    """
+
+    def post(self, request, *args, **kwargs):
+        org = self.get_org(request)
+        data = run_dashboard(
+            request,
+            org,
+            request.data.get("widgets"),
+            parallel=bool(request.data.get("parallel", False)),
+        )
+        return Response(data)
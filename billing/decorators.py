@@ -24,8 +24,20 @@ def enforce_limit(resource_key: str, count_fn):
         return _wrapped_view
     return decorator
 
+PLAN_ORDER = {"free": 0, "starter": 1, "pro": 2, "enterprise": 3}
+
+def plan_allows(request, min_plan: str) -> bool:
+    """
+    True si la org de la request tiene plan >= min_plan
+    (o estamos en DEBUG / el usuario es staff).
+    """
+    if getattr(settings, "DEBUG", False) or getattr(request.user, "is_staff", False) or getattr(request.user, "is_superuser", False):
+        return True
+    org = getattr(request, "org", None)
+    current = getattr(org, "subscription_plan", "starter")
+    return PLAN_ORDER.get(current, 0) >= PLAN_ORDER.get(min_plan, 0)
+
 def require_plan(min_plan: str):
-    order = {"free": 0, "starter": 1, "pro": 2, "enterprise": 3}
     def deco(view_func):
         @wraps(view_func)
         def _wrapped(view, request, *args, **kwargs):
@@ -37,12 +49,11 @@ def require_plan(min_plan: str):
             if org is None:
                 return Response({"detail": "Org no resuelta"}, status=status.HTTP_400_BAD_REQUEST)
 
-            current = getattr(org, "subscription_plan", "starter")
-            if order.get(current, 0) < order.get(min_plan, 0):
+            if not plan_allows(request, min_plan):
                 return Response(
                     {"detail": f"Disponible en plan {min_plan} o superior."},
                     status=status.HTTP_403_FORBIDDEN,
                 )
             return view_func(view, request, *args, **kwargs)
         return _wrapped
-    return deco
\ No newline at end of file
+    return deco
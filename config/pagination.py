@@ -1,7 +1,162 @@
 # config/pagination.py
-from rest_framework.pagination import PageNumberPagination
+import base64
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = "page_size"   # permite ?page_size=100, etc.
     max_page_size = 1000                  # límite sano para exportaciones grandes
+
+
+def estimated_count(queryset):
+    """
+    Nº de filas estimado por el planificador (EXPLAIN, sin ejecutar la query)
+    o None fuera de PostgreSQL.
+    """
+    if connections[queryset.db].vendor != "postgresql":
+        return None
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _field(model, key):
+    name = key.lstrip("-")
+    return model._meta.pk if name == "pk" else model._meta.get_field(name)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre las claves de view.keyset_ordering,
+    p.ej. ("-date_issue", "-id"): cada página es WHERE (claves) < (última
+    fila) ORDER BY claves LIMIT n, sin OFFSET ni COUNT(*). Las claves deben
+    ser campos del modelo, no nulos, y la última única (normalmente id).
+
+    Respuesta: {"next", "previous", "results"}; el total estimado por el
+    planificador va en la cabecera X-Total-Count-Estimate (solo PostgreSQL).
+    """
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    cursor_query_param = "cursor"
+    count_header = "X-Total-Count-Estimate"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            size = self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    @staticmethod
+    def _encode(values, reverse):
+        raw = json.dumps({"v": values, "r": reverse}, default=str).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    def _decode(self, request, model):
+        """(valores de las claves ya convertidos al tipo de cada campo, hacia atrás)."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            values, reverse = data["v"], bool(data["r"])
+            if not isinstance(values, list) or len(values) != len(self.ordering) or None in values:
+                raise ValueError(values)
+            values = [_field(model, key).to_python(value) for key, value in zip(self.ordering, values)]
+        except (ValueError, TypeError, KeyError, DjangoValidationError):
+            raise ValidationError({self.cursor_query_param: "Cursor inválido."})
+        return values, reverse
+
+    @staticmethod
+    def _after(ordering, values):
+        """Filas posteriores a `values` en `ordering` (comparación de tuplas desplegada)."""
+        q, equal = Q(), {}
+        for key, value in zip(ordering, values):
+            name = key.lstrip("-")
+            q |= Q(**equal, **{f"{name}__{'lt' if key.startswith('-') else 'gt'}": value})
+            equal[name] = value
+        return q
+
+    def _key(self, obj):
+        return [getattr(obj, key.lstrip("-")) for key in self.ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(view.keyset_ordering)
+        self.page_size = self.get_page_size(request)
+        self.estimate = estimated_count(queryset)
+
+        values, reverse = self._decode(request, queryset.model)
+        # hacia atrás: mismo filtro con el orden invertido y luego se da la vuelta
+        ordering = tuple(k[1:] if k.startswith("-") else f"-{k}" for k in self.ordering) if reverse else self.ordering
+        qs = queryset.order_by(*ordering)
+        if values is not None:
+            qs = qs.filter(self._after(ordering, values))
+
+        rows = list(qs[: self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[: self.page_size]
+        if reverse:
+            rows.reverse()
+
+        has_next, has_previous = (values is not None, has_more) if reverse else (has_more, values is not None)
+        self.next_cursor = self._encode(self._key(rows[-1]), False) if has_next and rows else None
+        self.previous_cursor = self._encode(self._key(rows[0]), True) if has_previous and rows else None
+        return rows
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        response = Response({
+            "next": self._link(self.next_cursor),
+            "previous": self._link(self.previous_cursor),
+            "results": data,
+        })
+        if self.estimate is not None:
+            response[self.count_header] = str(self.estimate)
+        return response
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class KeysetPaginationMixin:
+    """
+    Modo cursor opcional para viewsets paginados: con ?pagination=cursor (o
+    un ?cursor= de un enlace next/previous) se usa KeysetPagination sobre
+    keyset_ordering en lugar de la paginación por número de página.
+    En ese modo se ignora ?ordering=: el orden lo fijan las claves.
+    """
+    keyset_ordering = ("-pk",)
+
+    def use_keyset_pagination(self):
+        params = self.request.query_params
+        return bool(self.keyset_ordering) and (
+            params.get("pagination") == "cursor" or KeysetPagination.cursor_query_param in params
+        )
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator") and getattr(self, "request", None) and self.use_keyset_pagination():
+            self._paginator = KeysetPagination()
+        return super().paginator
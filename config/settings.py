@@ -118,6 +118,13 @@ USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# Ficheros subidos / generados (adjuntos, impresiones de facturas...)
+MEDIA_URL = "media/"
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", str(BASE_DIR / "media"))
+
+# Procesos para generar PDFs de facturas en lote (ZIP de fin de mes)
+SALES_PRINT_WORKERS = int(os.getenv("SALES_PRINT_WORKERS", "4"))
+
 # CORS / CSRF
 CORS_ALLOW_CREDENTIALS = True
 CSRF_TRUSTED_ORIGINS = [o for o in os.environ.get("CSRF_TRUSTED_ORIGINS","").split(",") if o]
@@ -187,6 +194,30 @@ REFRESH_COOKIE_PATH = "/api/v1/auth/"
 # Redis & RQ
 RQ_QUEUES = { "default": {"URL": os.environ["REDIS_URL"]} }
 
+# Caché de resultados de analítica (por org). Reutiliza el Redis de RQ;
+# con ANALYTICS_CACHE_BACKEND=locmem se usa memoria local (tests / desarrollo).
+ANALYTICS_CACHE_TIMEOUT = int(os.getenv("ANALYTICS_CACHE_TIMEOUT", "21600"))
+if os.getenv("ANALYTICS_CACHE_BACKEND", "redis") == "locmem":
+    _ANALYTICS_CACHE = {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "analytics",
+    }
+else:
+    _ANALYTICS_CACHE = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["REDIS_URL"],
+    }
+# Hilos para calcular widgets del dashboard agrupado en paralelo
+ANALYTICS_DASHBOARD_WORKERS = int(os.getenv("ANALYTICS_DASHBOARD_WORKERS", "4"))
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "analytics": {
+        **_ANALYTICS_CACHE,
+        "KEY_PREFIX": "analytics",
+        "TIMEOUT": ANALYTICS_CACHE_TIMEOUT,
+    },
+}
+
 # Stripe
 STRIPE_PUBLIC_KEY = os.environ.get("STRIPE_PUBLIC_KEY","")
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY","")
@@ -1,10 +1,13 @@
 # contacts/views/mixins.py
 from rest_framework import viewsets
 
-class OrgScopedViewSet(viewsets.GenericViewSet):
+from config.pagination import KeysetPaginationMixin
+
+class OrgScopedViewSet(KeysetPaginationMixin, viewsets.GenericViewSet):
     """
     Aplica un filtro por organización al queryset.
     Por defecto usa 'org'; para modelos sin org directo, sobreescribe org_lookup.
+    Con ?pagination=cursor pagina por keyset sobre keyset_ordering.
     """
     org_lookup = "org"
     queryset = None
@@ -3,12 +3,14 @@ from rest_framework import viewsets
 from rest_framework.exceptions import ValidationError
 from django.utils.functional import cached_property
 from core.models import Organization  # ajusta import si procede
+from config.pagination import KeysetPaginationMixin
 
-class OrgScopedModelViewSet(viewsets.ModelViewSet):
+class OrgScopedModelViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     - Filtra queryset por organización.
     - Inyecta self.org y la pasa automáticamente en perform_create(..., org=self.org).
     - Añade 'org' al serializer_context.
+    - ?pagination=cursor: paginación keyset sobre keyset_ordering (ver config.pagination).
     """
     org_lookup = "org"
     queryset = None  # obligatorio en subclases
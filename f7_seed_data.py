@@ -21,6 +21,7 @@ from core.models import Organization
 from contacts.models import Contact
 from inventory.models import Category, Product, Warehouse
 from sales.models import Invoice, InvoiceLine, Payment
+from sales.pricing import line_totals, price_rows
 from purchases.models import SupplierInvoice, SupplierInvoiceLine, SupplierPayment
 
 # Helpers ----------------------------------------------------------------------
@@ -40,29 +41,25 @@ def posted(obj):
     return obj
 
 def compute_invoice_totals(inv):
-    base = Decimal("0.00")
-    tax  = Decimal("0.00")
-    for line in inv.lines.all():
-        line_base = (line.qty * line.unit_price) * (Decimal("1.00") - (line.discount_pct/Decimal("100")))
-        line_tax  = line_base * (line.tax_rate/Decimal("100"))
-        base += line_base
-        tax  += line_tax
-    inv.totals_base = base.quantize(Decimal("0.01"))
-    inv.totals_tax  = tax.quantize(Decimal("0.01"))
-    inv.total       = (base + tax).quantize(Decimal("0.01"))
-    inv.save(update_fields=["totals_base","totals_tax","total"])
+    # Mismo motor que la app (sales.pricing): bases por IVA + totales
+    rows = inv.lines.values_list("invoice_id", "qty", "unit_price", "discount_pct", "tax_rate")
+    inv.tax_bases, inv.totals_base, inv.totals_tax, inv.total = price_rows(rows, include=[inv.id])[inv.id]
+    inv.save(update_fields=["tax_bases","totals_base","totals_tax","total"])
 
 def compute_supplier_totals(inv):
+    # Como purchases: cuota redondeada por línea y totales = suma de líneas
     base = Decimal("0.00")
     tax  = Decimal("0.00")
     for line in inv.lines.all():
-        line_base = (line.qty * line.unit_price) * (Decimal("1.00") - (line.discount_pct/Decimal("100")))
-        line_tax  = line_base * (line.tax_rate/Decimal("100"))
-        base += line_base
-        tax  += line_tax
-    inv.total_base = base.quantize(Decimal("0.01"))
-    inv.total_tax  = tax.quantize(Decimal("0.01"))
-    inv.total      = (base + tax).quantize(Decimal("0.01"))
+        line.line_base, line.line_tax, line.line_total = line_totals(
+            line.qty, line.unit_price, line.tax_rate, line.discount_pct
+        )
+        line.save(update_fields=["line_base","line_tax","line_total"])
+        base += line.line_base
+        tax  += line.line_tax
+    inv.total_base = base
+    inv.total_tax  = tax
+    inv.total      = base + tax
     inv.save(update_fields=["total_base","total_tax","total"])
 
 random.seed(42)
@@ -78,6 +78,10 @@ class WebhookDelivery(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # logs por endpoint, más recientes primero (paginación por cursor)
+            models.Index(fields=["endpoint", "created_at", "id"], name="integ_delivery_ep_created"),
+        ]
 
     def __str__(self):
         return f"{self.event_name} → {self.endpoint.target_url} ({self.status})"
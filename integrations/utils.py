@@ -3,6 +3,7 @@ import os          # 👈 nuevo
 import json
 import hmac
 import hashlib
+from django.db import transaction
 from django.utils import timezone
 from django.conf import settings   # 👈 nuevo
 from django_rq import enqueue
@@ -42,6 +43,52 @@ def trigger_webhook_event(org, event_name: str, payload: dict):
     return deliveries
 
 
+# Entregas por job de RQ en los disparos en bloque
+WEBHOOK_BATCH_JOB_SIZE = 200
+
+
+def trigger_webhook_events(org, event_name: str, payloads: list[dict]):
+    """
+    Versión en bloque de trigger_webhook_event para lotes (p.ej. contabilizar
+    miles de facturas): una query de endpoints, un bulk_create de entregas y
+    un job de RQ por cada WEBHOOK_BATCH_JOB_SIZE entregas, encolados al hacer
+    commit para que el worker ya vea las filas.
+    """
+    endpoints = list(
+        WebhookEndpoint.objects.filter(organization=org, is_active=True, event=event_name)
+    )
+    if not endpoints or not payloads:
+        return []
+
+    deliveries = WebhookDelivery.objects.bulk_create(
+        [
+            WebhookDelivery(endpoint=ep, event_name=event_name, payload=payload)
+            for payload in payloads
+            for ep in endpoints
+        ],
+        batch_size=1000,
+    )
+    ids = [d.id for d in deliveries]
+
+    def _dispatch():
+        if settings.DEBUG and os.name == "nt":
+            process_webhook_deliveries(ids)
+            return
+        for start in range(0, len(ids), WEBHOOK_BATCH_JOB_SIZE):
+            enqueue(process_webhook_deliveries, ids[start:start + WEBHOOK_BATCH_JOB_SIZE])
+
+    transaction.on_commit(_dispatch, robust=True)
+    return deliveries
+
+
+def process_webhook_deliveries(delivery_ids: list[int]):
+    """
+    Job RQ: procesa un bloque de entregas (ver trigger_webhook_events).
+    """
+    for delivery_id in delivery_ids:
+        process_webhook_delivery(delivery_id)
+
+
 def _make_signature(secret: str, body_bytes: bytes) -> str:
     return hmac.new(secret.encode("utf-8"), body_bytes, hashlib.sha256).hexdigest()
 
@@ -6,6 +6,7 @@ from rest_framework.exceptions import NotFound
 from .models import WebhookEndpoint, WebhookDelivery
 from .serializers import WebhookEndpointSerializer, WebhookDeliverySerializer
 from .permissions import CanManageIntegrations
+from config.pagination import KeysetPaginationMixin
 
 
 class WebhookEndpointViewSet(viewsets.ModelViewSet):
@@ -34,10 +35,12 @@ class WebhookEndpointViewSet(viewsets.ModelViewSet):
         serializer.save(organization=org)
 
 
-class WebhookDeliveryListView(generics.ListAPIView):
+class WebhookDeliveryListView(KeysetPaginationMixin, generics.ListAPIView):
     """
     Lista de entregas (logs) para un endpoint concreto de la organización.
+    Con ?pagination=cursor pagina por (created_at, id) sin COUNT ni OFFSET.
     """
+    keyset_ordering = ("-created_at", "-id")
     serializer_class = WebhookDeliverySerializer
     permission_classes = (IsAuthenticated, CanManageIntegrations)
 
@@ -50,4 +53,4 @@ class WebhookDeliveryListView(generics.ListAPIView):
         return WebhookDelivery.objects.filter(
             endpoint__organization=org,
             endpoint_id=endpoint_id,
-        ).order_by("-created_at")
+        ).order_by("-created_at", "-id")
@@ -0,0 +1,47 @@
+# inventory/jobs.py
+from .services_ledger import build_stock_snapshots, reconcile_stock
+from .services_reservations import EXPIRE_BATCH, expire_reservations
+
+
+def _orgs(org_id=None):
+    from core.models import Organization
+
+    orgs = Organization.objects.all().order_by("slug")
+    if org_id is not None:
+        orgs = orgs.filter(pk=org_id)
+    return orgs
+
+
+def build_stock_snapshots_job(org_id=None):
+    """
+    Job RQ (nocturno): cierra los meses completos pendientes del libro de
+    stock de una organización o de todas. Devuelve {slug: meses cerrados}.
+    """
+    return {org.slug: build_stock_snapshots(org) for org in _orgs(org_id)}
+
+
+def reconcile_stock_job(org_id=None, repair: bool = True):
+    """
+    Job RQ (nocturno): cuadra InventoryItem con el libro de movimientos de
+    una organización o de todas (una transacción por organización).
+    Devuelve {slug: {"checked", "drift", "product_drift", "repaired"}} con el nº de diferencias.
+    """
+    result = {}
+    for org in _orgs(org_id):
+        report = reconcile_stock(org, repair=repair)
+        result[org.slug] = {**report, "drift": len(report["drift"]), "product_drift": len(report["product_drift"])}
+    return result
+
+
+def expire_reservations_job(batch_size: int = EXPIRE_BATCH):
+    """
+    Job RQ (periódico, p.ej. cada 5 minutos): caduca las reservas de stock
+    vencidas de todas las organizaciones, en transacciones de batch_size.
+    Devuelve el nº de reservas caducadas.
+    """
+    total = 0
+    while True:
+        expired = expire_reservations(batch_size=batch_size)
+        total += expired
+        if expired < batch_size:
+            return total
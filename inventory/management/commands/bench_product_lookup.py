@@ -0,0 +1,131 @@
+# inventory/management/commands/bench_product_lookup.py
+"""
+Mide el autocompletado de productos (/inventory/products/lookup/) y el
+listado con ?in_stock=1.
+
+Dentro de una transacción que se deshace al final: crea --products productos
+en varios almacenes (parte con stock, entradas por inventory.services para
+que se mantenga ProductStock) y lanza --runs búsquedas con prefijos de nombre
+y SKU. Comprueba:
+
+- que el lookup hace una sola query y el listado in_stock no usa DISTINCT,
+- que ProductStock cuadra con la suma de InventoryItem,
+- p95 del lookup por debajo de --target-ms (20 ms; en PostgreSQL con los
+  índices de trigramas; en otras bases es orientativo).
+"""
+import random
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from core.models import Organization
+from inventory import services
+from inventory.models import Category, InventoryItem, Product, ProductStock, Warehouse
+from inventory.views import ProductViewSet
+
+WORDS = ["tornillo", "tuerca", "arandela", "cable", "tubo", "panel", "perfil", "brida", "junta", "codo"]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Mide la latencia del autocompletado de productos y comprueba el agregado de stock."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument("--warehouses", type=int, default=3)
+        parser.add_argument("--runs", type=int, default=200)
+        parser.add_argument("--target-ms", type=float, default=20.0)
+
+    def handle(self, *args, **options):
+        try:
+            # APIRequestFactory usa el host "testserver" (enlaces de paginación)
+            with override_settings(ALLOWED_HOSTS=["testserver"]), transaction.atomic():
+                self._run(options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _seed(self, n_products, n_warehouses):
+        org = Organization.objects.create(name="Bench lookup", slug=f"bench-lookup-{uuid.uuid4().hex[:8]}")
+        user = User.objects.create(email=f"{org.slug}@example.com")
+        category = Category.objects.create(org=org, name="General")
+        warehouses = Warehouse.objects.bulk_create([
+            Warehouse(org=org, code=f"W{i}", name=f"Almacén {i}") for i in range(n_warehouses)
+        ])
+        rnd = random.Random(42)
+        products = Product.objects.bulk_create([
+            Product(org=org, category=category, sku=f"{WORDS[i % len(WORDS)][:3].upper()}-{i:06d}",
+                    name=f"{WORDS[i % len(WORDS)]} {rnd.randint(1, 999)} mm", price=Decimal("1.00"))
+            for i in range(n_products)
+        ], batch_size=2000)
+        services.receive_many(org, user, [
+            (p.id, wh.id, Decimal(rnd.randint(1, 50)))
+            for p in products[: n_products * 2 // 3] for wh in warehouses if rnd.random() < 0.6
+        ])
+        return org, user
+
+    def _call(self, org, user, action, params):
+        request = APIRequestFactory().get("/", params)
+        request.org = org
+        force_authenticate(request, user=user)
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = ProductViewSet.as_view({"get": action})(request, org_slug=org.slug)
+            response.render()
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise CommandError(f"{action} {params}: HTTP {response.status_code} {response.content[:200]!r}")
+        return elapsed, ctx.captured_queries
+
+    def _run(self, options):
+        org, user = self._seed(options["products"], options["warehouses"])
+        errors = []
+
+        totals = (
+            InventoryItem.objects.filter(org=org).order_by()
+            .values_list("product_id").annotate(Sum("qty_on_hand"), Sum("qty_reserved"))
+        )
+        stocks = ProductStock.objects.filter(org=org).values_list("product_id", "qty_on_hand", "qty_reserved")
+        expected = {p: (on_hand, reserved) for p, on_hand, reserved in totals}
+        if {p: (on_hand, reserved) for p, on_hand, reserved in stocks} != expected:
+            errors.append("ProductStock no cuadra con InventoryItem")
+
+        rnd = random.Random(7)
+        terms = [rnd.choice(WORDS)[: rnd.randint(2, 6)] for _ in range(options["runs"])]
+        terms += [f"{rnd.choice(WORDS)[:3].upper()}-00{rnd.randint(0, 9)}" for _ in range(options["runs"] // 4)]
+        timings = []
+        for term in terms:
+            elapsed, queries = self._call(org, user, "lookup", {"q": term})
+            timings.append(elapsed)
+            if len(queries) != 1:
+                errors.append(f"lookup '{term}': {len(queries)} queries")
+                break
+
+        _, queries = self._call(org, user, "list", {"in_stock": "1", "q": "tu"})
+        if any("DISTINCT" in q["sql"].upper() for q in queries):
+            errors.append("el listado in_stock usa DISTINCT")
+
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        self.stdout.write(
+            f"{options['products']} productos, {len(timings)} búsquedas: "
+            f"p50={statistics.median(timings):.1f} ms p95={p95:.1f} ms ({connection.vendor})"
+        )
+        if p95 > options["target_ms"]:
+            if connection.vendor == "postgresql":
+                errors.append(f"p95 {p95:.1f} ms > {options['target_ms']} ms")
+            else:
+                self.stdout.write(self.style.WARNING(f"p95 por encima de {options['target_ms']} ms (sin índices de trigramas)"))
+        if errors:
+            raise CommandError("; ".join(errors))
+        self.stdout.write(self.style.SUCCESS("OK: autocompletado y agregado de stock correctos."))
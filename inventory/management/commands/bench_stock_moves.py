@@ -0,0 +1,108 @@
+# inventory/management/commands/bench_stock_moves.py
+"""
+Mide la confirmación de un albarán grande con el motor de movimientos por
+lotes (inventory.services.apply_movements).
+
+Dentro de una transacción que se deshace al final: crea productos con stock
+(parte con reservas), un albarán de --lines líneas (con productos repetidos)
+y lo confirma. Comprueba:
+
+- nº de queries acotado (MAX_QUERIES): líneas, reservas del albarán,
+  bloqueo, UPDATE, agregado por producto (lectura, bloqueo + UPDATE), INSERT de
+  movimientos, reservas sobrantes y estado (+ savepoints); en SQLite los
+  UPDATE/INSERT grandes se trocean por el límite de parámetros,
+- qty_on_hand / qty_reserved finales y un StockMove por línea,
+- que un lote con una salida sin stock no aplica nada.
+"""
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from contacts.models import Contact
+from core.models import Organization
+from inventory import services
+from inventory.models import Category, InventoryItem, Product, StockMove, Warehouse
+from sales.models import DeliveryNote, DeliveryNoteLine
+from sales.services_delivery import confirm
+
+MAX_QUERIES = 22
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Confirma un albarán grande y comprueba que el nº de queries de stock es fijo."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lines", type=int, default=300)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options["lines"])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _run(self, n_lines):
+        org = Organization.objects.create(name="Bench stock", slug=f"bench-stock-{uuid.uuid4().hex[:8]}")
+        wh = Warehouse.objects.create(org=org, code="B", name="Bench")
+        customer = Contact.objects.create(org=org, tipo="client", razon_social="Cliente")
+        category = Category.objects.create(org=org, name="General")
+        n_products = max(1, n_lines * 2 // 3)  # algunos productos en varias líneas
+        products = Product.objects.bulk_create([
+            Product(org=org, category=category, sku=f"S{i}", name=f"Producto {i}") for i in range(n_products)
+        ])
+        # la mitad ya tiene fila de stock (con reserva), la otra se crea al recibir
+        services.receive_many(org, None, [(p.id, wh.id, Decimal("100")) for p in products[: n_products // 2]])
+        for p in products[: n_products // 2: 3]:
+            services.reserve_stock(org, None, p.id, wh.id, Decimal("4"))
+        services.receive_many(org, None, [(p.id, wh.id, Decimal("100")) for p in products[n_products // 2:]])
+
+        dn = DeliveryNote.objects.create(org=org, number="BENCH", customer=customer, warehouse=wh)
+        DeliveryNoteLine.objects.bulk_create([
+            DeliveryNoteLine(delivery_note=dn, product=products[i % n_products], qty=Decimal("3"))
+            for i in range(n_lines)
+        ])
+        before = dict(InventoryItem.objects.filter(org=org).values_list("product_id", "qty_on_hand"))
+
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as ctx:
+            confirm(dn, user=None)
+        elapsed = (time.perf_counter() - started) * 1000
+        queries = len(ctx.captured_queries)
+        self.stdout.write(f"{n_lines} líneas: {queries} queries, {elapsed:.1f} ms")
+
+        errors = []
+        if queries > MAX_QUERIES:
+            errors.append(f"{queries} queries (máximo {MAX_QUERIES})")
+        used = {}
+        for i in range(n_lines):
+            used[products[i % n_products].id] = used.get(products[i % n_products].id, 0) + Decimal("3")
+        after = InventoryItem.objects.filter(org=org).values_list("product_id", "qty_on_hand", "qty_reserved")
+        for product_id, on_hand, reserved in after:
+            if on_hand != before[product_id] - used.get(product_id, 0) or reserved < 0:
+                errors.append(f"producto {product_id}: on_hand={on_hand} reserved={reserved}")
+        moves = StockMove.objects.filter(org=org, ref_type="DN", ref_id=str(dn.id)).count()
+        if moves != n_lines:
+            errors.append(f"{moves} StockMove (se esperaban {n_lines})")
+
+        snapshot = list(InventoryItem.objects.filter(org=org).order_by("id").values_list("qty_on_hand", "qty_reserved"))
+        try:
+            services.confirm_outgoing_many(org, None, [(products[0].id, wh.id, Decimal("1")),
+                                                        (products[1].id, wh.id, Decimal("100000"))])
+            errors.append("la salida sin stock no falló")
+        except ValueError:
+            pass
+        if snapshot != list(InventoryItem.objects.filter(org=org).order_by("id").values_list("qty_on_hand", "qty_reserved")):
+            errors.append("un lote fallido dejó cambios aplicados")
+
+        if errors:
+            raise CommandError("; ".join(errors))
+        self.stdout.write(self.style.SUCCESS("OK: stock y movimientos correctos con nº de queries fijo."))
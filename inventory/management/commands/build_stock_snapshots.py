@@ -0,0 +1,41 @@
+# inventory/management/commands/build_stock_snapshots.py
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.models import Organization
+from inventory.services_ledger import build_stock_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera los cierres mensuales de stock (StockSnapshot) pendientes de una o todas "
+        "las organizaciones. Pensado para ejecutarse cada noche."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", dest="org_slug", help="Slug de la organización (por defecto, todas)")
+        parser.add_argument(
+            "--rebuild-from", dest="rebuild_from",
+            help="YYYY-MM-DD: rehace los cierres desde ese mes (tras cargar movimientos con fecha pasada)",
+        )
+
+    def handle(self, *args, **options):
+        rebuild_from = None
+        if options["rebuild_from"]:
+            try:
+                rebuild_from = parse_date(options["rebuild_from"])
+            except ValueError:
+                rebuild_from = None
+            if rebuild_from is None:
+                raise CommandError("--rebuild-from debe tener formato YYYY-MM-DD")
+
+        orgs = Organization.objects.all().order_by("slug")
+        if options["org_slug"]:
+            orgs = orgs.filter(slug=options["org_slug"])
+            if not orgs.exists():
+                raise CommandError(f"Organización '{options['org_slug']}' no encontrada")
+
+        for org in orgs:
+            built = build_stock_snapshots(org, rebuild_from=rebuild_from)
+            self.stdout.write(f"{org.slug}: {built} meses cerrados")
+        self.stdout.write(self.style.SUCCESS("Cierres de stock al día."))
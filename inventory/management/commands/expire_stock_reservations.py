@@ -0,0 +1,16 @@
+# inventory/management/commands/expire_stock_reservations.py
+from django.core.management.base import BaseCommand
+
+from inventory.jobs import expire_reservations_job
+from inventory.services_reservations import EXPIRE_BATCH
+
+
+class Command(BaseCommand):
+    help = "Caduca las reservas de stock vencidas (libera su cantidad en InventoryItem)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=EXPIRE_BATCH)
+
+    def handle(self, *args, **options):
+        expired = expire_reservations_job(batch_size=max(1, options["batch_size"]))
+        self.stdout.write(self.style.SUCCESS(f"{expired} reservas caducadas."))
@@ -0,0 +1,39 @@
+# inventory/management/commands/reconcile_stock.py
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Organization
+from inventory.services_ledger import reconcile_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Cuadra el stock (InventoryItem.qty_on_hand y el agregado ProductStock) con el libro de "
+        "movimientos de una o todas las organizaciones y corrige las diferencias. "
+        "Pensado para ejecutarse cada noche."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", dest="org_slug", help="Slug de la organización (por defecto, todas)")
+        parser.add_argument("--dry-run", action="store_true", help="Solo informa de las diferencias")
+        parser.add_argument("--verbose-drift", action="store_true", help="Lista cada diferencia encontrada")
+
+    def handle(self, *args, **options):
+        orgs = Organization.objects.all().order_by("slug")
+        if options["org_slug"]:
+            orgs = orgs.filter(slug=options["org_slug"])
+            if not orgs.exists():
+                raise CommandError(f"Organización '{options['org_slug']}' no encontrada")
+
+        for org in orgs:
+            report = reconcile_stock(org, repair=not options["dry_run"])
+            self.stdout.write(
+                f"{org.slug}: filas={report['checked']} diferencias={len(report['drift'])} "
+                f"productos={len(report['product_drift'])} corregidas={report['repaired']}"
+            )
+            if options["verbose_drift"]:
+                for d in report["drift"]:
+                    self.stdout.write(
+                        f"  producto={d['product_id']} almacén={d['warehouse_id']} "
+                        f"stock={d['qty_on_hand']} libro={d['ledger']}"
+                    )
+        self.stdout.write(self.style.SUCCESS("Stock cuadrado con el libro." if not options["dry_run"] else "Revisión terminada."))
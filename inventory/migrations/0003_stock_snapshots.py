@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_organizationemailsettings'),
+        ('inventory', '0002_product_cost_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('qty', models.DecimalField(decimal_places=3, max_digits=16)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stockmove',
+            index=models.Index(fields=['org', 'created_at'], name='inv_move_org_created'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshot',
+            name='org',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='core.organization'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshot',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.product'),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshot',
+            name='warehouse',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='inventory.warehouse'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stocksnapshot',
+            unique_together={('org', 'period', 'product', 'warehouse')},
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:18
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_product_stock(apps, schema_editor):
+    """Agregado inicial desde InventoryItem (una fila por producto con stock)."""
+    InventoryItem = apps.get_model("inventory", "InventoryItem")
+    ProductStock = apps.get_model("inventory", "ProductStock")
+    totals = (
+        InventoryItem.objects.order_by()
+        .values_list("org_id", "product_id")
+        .annotate(on_hand=models.Sum("qty_on_hand"), reserved=models.Sum("qty_reserved"))
+    )
+    ProductStock.objects.bulk_create(
+        [
+            ProductStock(org_id=org_id, product_id=product_id, qty_on_hand=on_hand,
+                         qty_reserved=reserved, qty_available=on_hand - reserved)
+            for org_id, product_id, on_hand, reserved in totals.iterator()
+        ],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_organizationemailsettings'),
+        ('inventory', '0003_stock_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStock',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock', serialize=False, to='inventory.product')),
+                ('qty_on_hand', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=16)),
+                ('qty_reserved', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=16)),
+                ('qty_available', models.DecimalField(decimal_places=3, default=Decimal('0.000'), max_digits=16)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='productstock',
+            name='org',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='core.organization'),
+        ),
+        migrations.RunPython(backfill_product_stock, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from decimal import Decimal
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils import timezone
 
 from core.models import Organization  # ajusta import si tu core difiere
@@ -41,7 +43,13 @@ class Product(OrgScopedModel):
 
     class Meta:
         unique_together = ("org", "sku")
-        indexes = [models.Index(fields=["org", "name"]), models.Index(fields=["org", "sku"])]
+        indexes = [
+            models.Index(fields=["org", "name"]),
+            models.Index(fields=["org", "sku"]),
+            # búsqueda ?q= (icontains -> UPPER(col) LIKE '%...%'): trigramas sobre UPPER(col)
+            GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="inv_product_name_trgm"),
+            GinIndex(OpClass(Upper("sku"), name="gin_trgm_ops"), name="inv_product_sku_trgm"),
+        ]
         ordering = ["name"]
 
     def __str__(self):
@@ -89,6 +97,19 @@ class InventoryItem(OrgScopedModel):
     class Meta:
         unique_together = ("org", "product", "warehouse")
 
+class ProductStock(OrgScopedModel):
+    """
+    Stock agregado de un producto (suma de sus InventoryItem en todos los
+    almacenes). Lo mantiene inventory.services en cada lote de movimientos y
+    lo recalcula services_ledger.reconcile_stock. Sirve los filtros de stock
+    de productos sin JOIN a inventory_items ni DISTINCT.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="stock")
+    qty_on_hand = models.DecimalField(max_digits=16, decimal_places=3, default=Decimal("0.000"))
+    qty_reserved = models.DecimalField(max_digits=16, decimal_places=3, default=Decimal("0.000"))
+    qty_available = models.DecimalField(max_digits=16, decimal_places=3, default=Decimal("0.000"))  # on_hand - reserved
+
+
 class StockMove(OrgScopedModel):
     REASONS = (
         ("purchase", "Purchase"),
@@ -110,3 +131,65 @@ class StockMove(OrgScopedModel):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # tramos del libro por fecha (cierres y stock a fecha, ver services_ledger)
+            models.Index(fields=["org", "created_at"], name="inv_move_org_created"),
+        ]
+
+
+class StockSnapshot(OrgScopedModel):
+    """
+    Cierre mensual del libro de movimientos: saldo de (producto, almacén) al
+    final del mes `period` (día 1 del mes). Solo se guardan saldos no nulos.
+    Se construye incrementalmente con services_ledger.build_stock_snapshots.
+    """
+    period = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="+")
+    qty = models.DecimalField(max_digits=16, decimal_places=3)
+
+    class Meta:
+        unique_together = ("org", "period", "product", "warehouse")
+
+
+class StockReservation(OrgScopedModel):
+    """
+    Reserva de stock de una línea de documento (presupuesto o albarán),
+    identificada por ref_type / ref_id (documento) + line_id. Mientras está
+    activa su qty cuenta en InventoryItem.qty_reserved, que es lo que se lee
+    para el disponible; estas filas solo dicen de quién es cada reserva y
+    cuándo caduca. Ver services_reservations.
+    """
+    ACTIVE, CONSUMED, RELEASED, EXPIRED = "active", "consumed", "released", "expired"
+    STATUS_CHOICES = (
+        (ACTIVE, "Active"),
+        (CONSUMED, "Consumed"),
+        (RELEASED, "Released"),
+        (EXPIRED, "Expired"),
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="reservations")
+    qty = models.DecimalField(max_digits=16, decimal_places=3)
+    ref_type = models.CharField(max_length=64)
+    ref_id = models.CharField(max_length=64)
+    line_id = models.IntegerField()
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=ACTIVE)
+    expires_at = models.DateTimeField(null=True, blank=True)  # None: sin caducidad
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(default=timezone.now)
+    closed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            # una reserva activa por línea
+            models.UniqueConstraint(
+                fields=["org", "ref_type", "ref_id", "line_id"],
+                condition=models.Q(status="active"),
+                name="inv_resv_active_line",
+            ),
+        ]
+        indexes = [
+            # barrido de caducadas (jobs.expire_reservations_job)
+            models.Index(fields=["expires_at"], condition=models.Q(status="active"), name="inv_resv_active_expires"),
+        ]
@@ -1,6 +1,6 @@
 # inventory/serializers.py
 from rest_framework import serializers
-from .models import Category, Product, Warehouse, Worksite, InventoryItem, StockMove
+from .models import Category, Product, Warehouse, Worksite, InventoryItem, StockMove, StockReservation
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -36,3 +36,9 @@ class StockMoveSerializer(serializers.ModelSerializer):
         model = StockMove
         fields = ["id","product","qty","uom","warehouse_from","warehouse_to","reason","ref_type","ref_id","created_by","created_at"]
         read_only_fields = ["created_by","created_at"]
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockReservation
+        fields = ["id","product","warehouse","qty","ref_type","ref_id","line_id","status","expires_at","created_by","created_at","closed_at"]
+        read_only_fields = fields
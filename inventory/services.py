@@ -1,77 +1,248 @@
 # inventory/services.py
+"""
+Movimientos de stock.
+
+Todo pasa por apply_movements, que procesa un lote de movimientos (entrada,
+salida, reserva, liberación) de muchos (producto, almacén) a la vez:
+
+1. Bloquea todos los InventoryItem afectados en un único
+   SELECT ... FOR UPDATE ORDER BY id (orden fijo: sin deadlocks entre lotes)
+   y crea los que falten.
+2. Aplica y valida los movimientos en memoria, en el orden recibido.
+3. Guarda las cantidades con un bulk_update y los StockMove con un bulk_create.
+4. Lleva las variaciones al agregado por producto (ProductStock), bloqueando
+   sus filas después de las de InventoryItem (mismo orden en todos los lotes).
+
+Las funciones de un solo producto (receive_stock, confirm_outgoing, ...) son
+lotes de un movimiento. Las reservas con dueño y caducidad (presupuestos,
+albaranes) están en services_reservations.
+"""
+from dataclasses import dataclass
 from decimal import Decimal
+
 from django.db import transaction
-from django.db.models import F
-from .models import InventoryItem, StockMove
+from django.db.models import Q, Sum
+
+from .models import InventoryItem, Product, ProductStock, StockMove
+
+IN, OUT, RESERVE, RELEASE = "in", "out", "reserve", "release"
+
+
+@dataclass(frozen=True)
+class Movement:
+    kind: str  # IN | OUT | RESERVE | RELEASE
+    product_id: int
+    warehouse_id: int
+    qty: Decimal
+    reason: str = ""
+    ref_type: str = ""
+    ref_id: str = ""
+    uom: str | None = None  # por defecto, Product.uom
+    # OUT: reserva propia que consume la salida (services_reservations). Con
+    # None la salida descuenta la reserva que haya, sin dueño (ajustes,
+    # traspasos); con un valor solo libera esa cantidad y no puede tocar el
+    # stock reservado para otros.
+    consume: Decimal | None = None
+
+
+def _items_filter(keys):
+    by_warehouse = {}
+    for product_id, warehouse_id in keys:
+        by_warehouse.setdefault(warehouse_id, set()).add(product_id)
+    q = Q()
+    for warehouse_id, product_ids in by_warehouse.items():
+        q |= Q(warehouse_id=warehouse_id, product_id__in=sorted(product_ids))
+    return q
+
+
+def _lock_items(org, keys):
+    """{(product_id, warehouse_id): InventoryItem} bloqueados, creando los que falten."""
+    locked = InventoryItem.objects.select_for_update().filter(org=org).order_by("id")
+    items = {(i.product_id, i.warehouse_id): i for i in locked.filter(_items_filter(keys))}
+    missing = [key for key in keys if key not in items]
+    if missing:
+        InventoryItem.objects.bulk_create(
+            [InventoryItem(org=org, product_id=p, warehouse_id=w) for p, w in missing],
+            ignore_conflicts=True,
+        )
+        items.update({(i.product_id, i.warehouse_id): i for i in locked.filter(_items_filter(missing))})
+    return items
+
 
-def _get_item_for_update(org, product_id, warehouse_id):
-    item, _ = InventoryItem.objects.select_for_update().get_or_create(
-        org=org, product_id=product_id, warehouse_id=warehouse_id,
-        defaults={}
+def _update_product_stock(org, deltas):
+    """
+    Suma las variaciones {product_id: (on_hand, reserved)} a ProductStock.
+    Las filas que falten se crean antes (sin pisar las que cree otra
+    transacción a la vez: el INSERT espera a que termine) con el total de
+    InventoryItem anterior al lote; después se bloquean todas en orden de
+    producto y se suman las variaciones, así ningún lote pierde la suya.
+    """
+    deltas = {p: d for p, d in deltas.items() if any(d)}
+    if not deltas:
+        return
+    product_ids = sorted(deltas)
+    existing = set(
+        ProductStock.objects.filter(org=org, product_id__in=product_ids).values_list("product_id", flat=True)
     )
-    return item
+    missing = [p for p in product_ids if p not in existing]
+    if missing:
+        # InventoryItem ya incluye el lote: se descuenta para partir de antes
+        totals = {
+            p: (on_hand, reserved)
+            for p, on_hand, reserved in InventoryItem.objects.filter(org=org, product_id__in=missing)
+            .order_by().values_list("product_id")
+            .annotate(on_hand=Sum("qty_on_hand"), reserved=Sum("qty_reserved"))
+        }
+        seeds = []
+        for p in missing:
+            on_hand, reserved = totals.get(p, (0, 0))
+            on_hand, reserved = on_hand - deltas[p][0], reserved - deltas[p][1]
+            seeds.append(ProductStock(org=org, product_id=p, qty_on_hand=on_hand, qty_reserved=reserved,
+                                      qty_available=on_hand - reserved))
+        ProductStock.objects.bulk_create(seeds, ignore_conflicts=True)
 
-@transaction.atomic
-def receive_stock(org, user, product_id, warehouse_id, qty: Decimal, reason="purchase", ref_type="", ref_id=""):
-    item = _get_item_for_update(org, product_id, warehouse_id)
-    item.qty_on_hand = F("qty_on_hand") + qty
-    item.save(update_fields=["qty_on_hand"])
-    # 👇 refrescamos valores reales desde BD para evitar F() en memoria
-    item.refresh_from_db(fields=["qty_on_hand", "qty_reserved"])
-    StockMove.objects.create(
-        org=org, product_id=product_id, qty=qty, uom=item.product.uom,
-        warehouse_to_id=warehouse_id, reason=reason,
-        ref_type=ref_type, ref_id=ref_id, created_by=user
+    stocks = list(
+        ProductStock.objects.select_for_update().filter(org=org, product_id__in=product_ids).order_by("product_id")
     )
-    return item
+    for stock in stocks:
+        stock.qty_on_hand += deltas[stock.product_id][0]
+        stock.qty_reserved += deltas[stock.product_id][1]
+        stock.qty_available = stock.qty_on_hand - stock.qty_reserved
+    ProductStock.objects.bulk_update(stocks, ["qty_on_hand", "qty_reserved", "qty_available"], batch_size=1000)
+
 
 @transaction.atomic
-def reserve_stock(org, user, product_id, warehouse_id, qty: Decimal):
-    item = _get_item_for_update(org, product_id, warehouse_id)
-    item.refresh_from_db(fields=["qty_on_hand", "qty_reserved"])
-    if item.qty_on_hand - item.qty_reserved < qty:
-        raise ValueError("Stock insuficiente para reservar")
-    item.qty_reserved = F("qty_reserved") + qty
-    item.save(update_fields=["qty_reserved"])
-    item.refresh_from_db(fields=["qty_on_hand", "qty_reserved"])
+def apply_movements(org, user, movements):
+    """
+    Aplica un lote de Movement. Lanza ValueError (y no aplica nada) si alguna
+    salida o reserva no tiene stock suficiente en ese punto del lote.
+    Devuelve {(product_id, warehouse_id): InventoryItem} con los valores finales.
+    """
+    # ids tal como llegan de la petición ("5") -> valor del campo (5)
+    product_pk = InventoryItem._meta.get_field("product").target_field.to_python
+    warehouse_pk = InventoryItem._meta.get_field("warehouse").target_field.to_python
+    movements = [((product_pk(m.product_id), warehouse_pk(m.warehouse_id)), m) for m in movements]
+    if not movements:
+        return {}
+    items = _lock_items(org, list(dict.fromkeys(key for key, _ in movements)))
+    before = {key: (i.qty_on_hand, i.qty_reserved) for key, i in items.items()}
+
+    moves = []
+    for key, m in movements:
+        item = items[key]
+        if m.kind == IN:
+            item.qty_on_hand += m.qty
+            moves.append((key, m, m.qty, None, key[1]))
+        elif m.kind == OUT:
+            if m.consume is None:
+                if item.qty_on_hand < m.qty:
+                    raise ValueError(f"Stock insuficiente para salida (producto {key[0]}, almacén {key[1]})")
+                item.qty_reserved -= min(item.qty_reserved, m.qty)
+            else:
+                consumed = min(item.qty_reserved, m.consume)
+                if item.qty_on_hand - item.qty_reserved + consumed < m.qty:
+                    raise ValueError(f"Stock disponible insuficiente para salida (producto {key[0]}, almacén {key[1]})")
+                item.qty_reserved -= consumed
+            item.qty_on_hand -= m.qty
+            moves.append((key, m, -m.qty, key[1], None))
+        elif m.kind == RESERVE:
+            if item.qty_on_hand - item.qty_reserved < m.qty:
+                raise ValueError(f"Stock insuficiente para reservar (producto {key[0]}, almacén {key[1]})")
+            item.qty_reserved += m.qty
+        elif m.kind == RELEASE:
+            item.qty_reserved -= min(item.qty_reserved, m.qty)
+        else:
+            raise ValueError(f"Tipo de movimiento no válido: {m.kind}")
+
+    InventoryItem.objects.bulk_update(items.values(), ["qty_on_hand", "qty_reserved"], batch_size=1000)
+
+    deltas = {}
+    for key, item in items.items():
+        on_hand, reserved = deltas.get(key[0], (0, 0))
+        deltas[key[0]] = (
+            on_hand + item.qty_on_hand - before[key][0],
+            reserved + item.qty_reserved - before[key][1],
+        )
+    _update_product_stock(org, deltas)
+
+    if moves:
+        need_uom = {key[0] for key, m, *_ in moves if m.uom is None}
+        uoms = dict(Product.objects.filter(id__in=need_uom).values_list("id", "uom")) if need_uom else {}
+        StockMove.objects.bulk_create(
+            [
+                StockMove(
+                    org=org, product_id=key[0], qty=qty, uom=m.uom or uoms[key[0]],
+                    warehouse_from_id=wh_from, warehouse_to_id=wh_to, reason=m.reason,
+                    ref_type=m.ref_type, ref_id=m.ref_id, created_by=user,
+                )
+                for key, m, qty, wh_from, wh_to in moves
+            ],
+            batch_size=1000,
+        )
+    return items
+
+
+def _movements(kind, lines, **extra):
+    """(product_id, warehouse_id, qty[, uom]) -> Movement."""
+    for product_id, warehouse_id, qty, *uom in lines:
+        yield Movement(kind, product_id, warehouse_id, qty, uom=uom[0] if uom else None, **extra)
+
+
+def receive_many(org, user, lines, reason="purchase", ref_type="", ref_id=""):
+    """Entradas de stock; lines: iterable de (product_id, warehouse_id, qty[, uom])."""
+    return apply_movements(org, user, _movements(IN, lines, reason=reason, ref_type=ref_type, ref_id=ref_id))
+
+
+def confirm_outgoing_many(org, user, lines, reason="sale", ref_type="", ref_id=""):
+    """Salidas de stock (consumen reserva); lines: iterable de (product_id, warehouse_id, qty[, uom])."""
+    return apply_movements(org, user, _movements(OUT, lines, reason=reason, ref_type=ref_type, ref_id=ref_id))
+
+
+def transfer_many(org, user, lines, ref_type="", ref_id=""):
+    """Traspasos; lines: iterable de (product_id, wh_from_id, wh_to_id, qty)."""
+    movements = []
+    for product_id, wh_from_id, wh_to_id, qty in lines:
+        if wh_from_id == wh_to_id:
+            raise ValueError("El almacén de origen y destino no pueden ser el mismo")
+        movements += [
+            Movement(OUT, product_id, wh_from_id, qty, "transfer", ref_type, ref_id),
+            Movement(IN, product_id, wh_to_id, qty, "transfer", ref_type, ref_id),
+        ]
+    return apply_movements(org, user, movements)
+
+
+def _single(org, user, movement):
+    """Lote de un movimiento -> su InventoryItem."""
+    (item,) = apply_movements(org, user, [movement]).values()
     return item
 
-@transaction.atomic
+
+def receive_stock(org, user, product_id, warehouse_id, qty: Decimal, reason="purchase", ref_type="", ref_id=""):
+    return _single(org, user, Movement(IN, product_id, warehouse_id, qty, reason, ref_type, ref_id))
+
+
+def reserve_stock(org, user, product_id, warehouse_id, qty: Decimal):
+    return _single(org, user, Movement(RESERVE, product_id, warehouse_id, qty))
+
+
 def release_reservation(org, user, product_id, warehouse_id, qty: Decimal):
-    item = _get_item_for_update(org, product_id, warehouse_id)
-    item.refresh_from_db(fields=["qty_on_hand", "qty_reserved"])
-    if item.qty_reserved < qty:
-        qty = item.qty_reserved
-    item.qty_reserved = F("qty_reserved") - qty
-    item.save(update_fields=["qty_reserved"])
-    item.refresh_from_db(fields=["qty_on_hand", "qty_reserved"])
-    return item
+    return _single(org, user, Movement(RELEASE, product_id, warehouse_id, qty))
+
+
+def confirm_outgoing(org, user, product_id, warehouse_id, qty: Decimal, reason="sale", ref_type="", ref_id="",
+                     reservation=None):
+    """
+    Salida de stock. Con `reservation` (StockReservation activa del mismo
+    producto y almacén) consume esa reserva y el movimiento se registra con
+    su documento; sin ella es una salida sin dueño (p.ej. un ajuste), que
+    descuenta la reserva que haya.
+    """
+    if reservation is not None:
+        from .services_reservations import consume_reservation
+
+        return consume_reservation(org, user, reservation, product_id, warehouse_id, qty, reason=reason)
+    return _single(org, user, Movement(OUT, product_id, warehouse_id, qty, reason, ref_type, ref_id))
 
-@transaction.atomic
-def confirm_outgoing(org, user, product_id, warehouse_id, qty: Decimal, reason="sale", ref_type="", ref_id=""):
-    item = _get_item_for_update(org, product_id, warehouse_id)
-    item.refresh_from_db(fields=["qty_on_hand", "qty_reserved"])
-    if item.qty_on_hand < qty:
-        raise ValueError("Stock insuficiente para salida")
-    reserve_to_consume = min(item.qty_reserved, qty)
-    updates = []
-    if reserve_to_consume:
-        item.qty_reserved = F("qty_reserved") - reserve_to_consume
-        updates.append("qty_reserved")
-    item.qty_on_hand = F("qty_on_hand") - qty
-    updates.append("qty_on_hand")
-    item.save(update_fields=updates)
-    item.refresh_from_db(fields=["qty_on_hand", "qty_reserved"])
-    StockMove.objects.create(
-        org=org, product_id=product_id, qty=-qty, uom=item.product.uom,
-        warehouse_from_id=warehouse_id, reason=reason,
-        ref_type=ref_type, ref_id=ref_id, created_by=user
-    )
-    return item
 
-@transaction.atomic
 def transfer_stock(org, user, product_id, wh_from_id, wh_to_id, qty: Decimal, ref_type="", ref_id=""):
-    if wh_from_id == wh_to_id:
-        raise ValueError("El almacén de origen y destino no pueden ser el mismo")
-    confirm_outgoing(org, user, product_id, wh_from_id, qty, reason="transfer", ref_type=ref_type, ref_id=ref_id)
-    receive_stock(org, user, product_id, wh_to_id, qty, reason="transfer", ref_type=ref_type, ref_id=ref_id)
+    transfer_many(org, user, [(product_id, wh_from_id, wh_to_id, qty)], ref_type=ref_type, ref_id=ref_id)
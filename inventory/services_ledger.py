@@ -0,0 +1,249 @@
+# inventory/services_ledger.py
+"""
+Stock histórico a partir del libro de movimientos (StockMove).
+
+- build_stock_snapshots: cierres mensuales (StockSnapshot) incrementales:
+  saldo del último cierre + movimientos del mes siguiente, un GROUP BY por
+  mes.
+- stock_as_of: stock de cada (producto, almacén) al final de un día como
+  último cierre anterior + movimientos desde ese cierre (como mucho un mes
+  de libro, más el tramo aún sin cerrar).
+- stock_valuation: stock a fecha × Product.cost_price por producto.
+- reconcile_stock: compara InventoryItem.qty_on_hand con el saldo del libro
+  completo (y ProductStock con InventoryItem) y corrige las diferencias.
+
+Cada movimiento suma en warehouse_to y resta en warehouse_from (por valor
+absoluto: las entradas se guardan en positivo y las salidas en negativo).
+Los días se cortan en la zona horaria actual.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Min, Q, Sum
+from django.db.models.functions import Abs
+from django.utils import timezone
+
+from .models import InventoryItem, Product, ProductStock, StockMove, StockSnapshot
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def next_month(d: date) -> date:
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _day_start(d: date):
+    return timezone.make_aware(datetime.combine(d, time.min))
+
+
+def _ledger_deltas(org, start=None, end=None, *, warehouse_id=None, product_ids=None):
+    """
+    {(product_id, warehouse_id): variación} de los movimientos con created_at
+    en [start, end): un único GROUP BY por (producto, destino, origen).
+    """
+    moves = StockMove.objects.filter(org=org)
+    if start is not None:
+        moves = moves.filter(created_at__gte=start)
+    if end is not None:
+        moves = moves.filter(created_at__lt=end)
+    if warehouse_id is not None:
+        moves = moves.filter(Q(warehouse_to_id=warehouse_id) | Q(warehouse_from_id=warehouse_id))
+    if product_ids is not None:
+        moves = moves.filter(product_id__in=product_ids)
+
+    rows = (
+        moves.order_by()
+        .values_list("product_id", "warehouse_to_id", "warehouse_from_id")
+        .annotate(q=Sum(Abs("qty")))
+    )
+    deltas = defaultdict(Decimal)
+    for product_id, wh_to, wh_from, qty in rows:
+        if wh_to is not None and warehouse_id in (None, wh_to):
+            deltas[(product_id, wh_to)] += qty
+        if wh_from is not None and warehouse_id in (None, wh_from):
+            deltas[(product_id, wh_from)] -= qty
+    return deltas
+
+
+@transaction.atomic
+def build_stock_snapshots(org, until: date | None = None, rebuild_from: date | None = None) -> int:
+    """
+    Cierra los meses completos anteriores al mes de `until` (por defecto hoy)
+    que falten, partiendo del último cierre. Con rebuild_from se borran y
+    rehacen los cierres desde ese mes (p.ej. tras cargar movimientos con
+    fecha pasada). Devuelve el nº de meses cerrados.
+    """
+    limit = month_start(until or timezone.localdate())
+    snapshots = StockSnapshot.objects.filter(org=org)
+    if rebuild_from is not None:
+        snapshots.filter(period__gte=month_start(rebuild_from)).delete()
+
+    last = snapshots.aggregate(m=Max("period"))["m"]
+    if last is not None:
+        balances = {
+            (p, w): qty for p, w, qty in
+            snapshots.filter(period=last).values_list("product_id", "warehouse_id", "qty")
+        }
+        period = next_month(last)
+    else:
+        first = StockMove.objects.filter(org=org).aggregate(m=Min("created_at"))["m"]
+        if first is None:
+            return 0
+        balances = {}
+        period = month_start(timezone.localtime(first).date())
+
+    built = 0
+    while period < limit:
+        following = next_month(period)
+        for key, delta in _ledger_deltas(org, _day_start(period), _day_start(following)).items():
+            balances[key] = balances.get(key, Decimal("0")) + delta
+        StockSnapshot.objects.bulk_create(
+            [
+                StockSnapshot(org=org, period=period, product_id=p, warehouse_id=w, qty=qty)
+                for (p, w), qty in balances.items() if qty
+            ],
+            batch_size=2000,
+        )
+        built += 1
+        period = following
+    return built
+
+
+def stock_as_of(org, as_of: date, *, warehouse_id=None, product_ids=None) -> dict:
+    """
+    {(product_id, warehouse_id): qty} al final del día `as_of` (solo saldos no
+    nulos): último cierre mensual que termina antes + movimientos desde él.
+    """
+    end = as_of + timedelta(days=1)
+    snapshots = StockSnapshot.objects.filter(org=org, period__lt=month_start(end))
+    checkpoint = snapshots.aggregate(m=Max("period"))["m"]
+
+    balances = defaultdict(Decimal)
+    start = None
+    if checkpoint is not None:
+        rows = snapshots.filter(period=checkpoint)
+        if warehouse_id is not None:
+            rows = rows.filter(warehouse_id=warehouse_id)
+        if product_ids is not None:
+            rows = rows.filter(product_id__in=product_ids)
+        for p, w, qty in rows.values_list("product_id", "warehouse_id", "qty"):
+            balances[(p, w)] = qty
+        start = _day_start(next_month(checkpoint))
+
+    deltas = _ledger_deltas(org, start, _day_start(end), warehouse_id=warehouse_id, product_ids=product_ids)
+    for key, delta in deltas.items():
+        balances[key] += delta
+    return {key: qty for key, qty in balances.items() if qty}
+
+
+def stock_valuation(org, as_of: date, *, warehouse_id=None) -> dict:
+    """
+    Valoración del stock a fecha: qty (suma de almacenes, o del indicado) ×
+    Product.cost_price actual, por producto y ordenado por valor.
+    """
+    qty_by_product = defaultdict(Decimal)
+    for (product_id, _), qty in stock_as_of(org, as_of, warehouse_id=warehouse_id).items():
+        qty_by_product[product_id] += qty
+
+    products = Product.objects.filter(org=org, id__in=list(qty_by_product)).values_list("id", "sku", "name", "cost_price")
+    rows = []
+    for product_id, sku, name, cost_price in products:
+        qty = qty_by_product[product_id]
+        cost = cost_price or Decimal("0.00")
+        rows.append({
+            "product_id": product_id,
+            "sku": sku,
+            "name": name,
+            "qty": qty,
+            "cost_price": cost,
+            "value": (qty * cost).quantize(Decimal("0.01")),
+        })
+    rows.sort(key=lambda r: (-r["value"], r["sku"]))
+    return {
+        "as_of": as_of,
+        "warehouse_id": warehouse_id,
+        "total_value": sum((r["value"] for r in rows), Decimal("0.00")),
+        "rows": rows,
+    }
+
+
+@transaction.atomic
+def reconcile_stock(org, *, repair: bool = True) -> dict:
+    """
+    Recalcula el stock de cada (producto, almacén) desde todo el libro (un
+    GROUP BY) y lo compara con InventoryItem.qty_on_hand; después compara el
+    agregado por producto (ProductStock) con la suma de InventoryItem ya
+    cuadrados. Con repair=True corrige las diferencias con bulk_update (y
+    crea las filas que falten); el libro manda, no se generan movimientos.
+
+    Al reparar se bloquean antes los InventoryItem de la organización: las
+    entradas/salidas (inventory.services) esperan a que termine y el libro
+    leído es coherente con las filas que se corrigen.
+    Devuelve {"checked", "drift": [{product_id, warehouse_id, qty_on_hand, ledger}],
+    "product_drift": [product_id, ...], "repaired"}.
+    """
+    items = InventoryItem.objects.filter(org=org).order_by("id")
+    stocks = ProductStock.objects.filter(org=org).order_by("product_id")
+    if repair:
+        items, stocks = items.select_for_update(), stocks.select_for_update()
+    items = {
+        (i.product_id, i.warehouse_id): i
+        for i in items.only("id", "product_id", "warehouse_id", "qty_on_hand", "qty_reserved")
+    }
+    checked = len(items)
+    ledger = _ledger_deltas(org)
+
+    drift, changed, missing = [], [], []
+    for key in items.keys() | {k for k, qty in ledger.items() if qty}:
+        item, qty = items.get(key), ledger.get(key, Decimal("0"))
+        on_hand = item.qty_on_hand if item is not None else Decimal("0")
+        if on_hand == qty:
+            continue
+        drift.append({"product_id": key[0], "warehouse_id": key[1], "qty_on_hand": on_hand, "ledger": qty})
+        if item is None:
+            item = items[key] = InventoryItem(org=org, product_id=key[0], warehouse_id=key[1], qty_on_hand=qty)
+            missing.append(item)
+        else:
+            item.qty_on_hand = qty
+            changed.append(item)
+    drift.sort(key=lambda d: (d["product_id"], d["warehouse_id"]))
+
+    # agregado por producto a partir de las filas ya cuadradas
+    totals = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for (product_id, _), item in items.items():
+        totals[product_id][0] += item.qty_on_hand
+        totals[product_id][1] += item.qty_reserved
+    stocks = {s.product_id: s for s in stocks}
+    product_drift, stocks_changed, stocks_missing = [], [], []
+    for product_id in stocks.keys() | totals.keys():
+        on_hand, reserved = totals.get(product_id, (Decimal("0"), Decimal("0")))
+        expected = (on_hand, reserved, on_hand - reserved)
+        stock = stocks.get(product_id)
+        if stock is None:
+            if not any(expected):
+                continue
+            stock = ProductStock(org=org, product_id=product_id)
+            stocks_missing.append(stock)
+        elif (stock.qty_on_hand, stock.qty_reserved, stock.qty_available) == expected:
+            continue
+        else:
+            stocks_changed.append(stock)
+        stock.qty_on_hand, stock.qty_reserved, stock.qty_available = expected
+        product_drift.append(product_id)
+    product_drift.sort()
+
+    if repair:
+        InventoryItem.objects.bulk_update(changed, ["qty_on_hand"], batch_size=1000)
+        InventoryItem.objects.bulk_create(missing, batch_size=1000, ignore_conflicts=True)
+        ProductStock.objects.bulk_update(stocks_changed, ["qty_on_hand", "qty_reserved", "qty_available"], batch_size=1000)
+        ProductStock.objects.bulk_create(stocks_missing, batch_size=1000, ignore_conflicts=True)
+    return {
+        "checked": checked,
+        "drift": drift,
+        "product_drift": product_drift,
+        "repaired": len(drift) + len(product_drift) if repair else 0,
+    }
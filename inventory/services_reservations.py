@@ -0,0 +1,197 @@
+# inventory/services_reservations.py
+"""
+Reservas de stock con dueño y caducidad.
+
+Cada StockReservation activa es la parte de InventoryItem.qty_reserved que
+corresponde a una línea de documento (presupuesto o albarán). El disponible
+(qty_on_hand - qty_reserved) se lee de InventoryItem en O(1); las filas de
+reserva solo se tocan al reservar, liberar, consumir o caducar, siempre en
+lote y con transacciones cortas:
+
+- hold: reserva (o re-reserva) las líneas de un documento; falla si no hay
+  disponible.
+- release: libera las reservas activas de un documento (o de algunas líneas).
+- release_stale: libera las reservas de líneas borradas o modificadas.
+- consume: salida de stock de las líneas de un documento consumiendo su
+  reserva; lo no reservado solo puede salir del stock libre.
+- expire_reservations: barrido de las caducadas (jobs.expire_reservations_job).
+
+Orden de bloqueo: reservas -> InventoryItem -> ProductStock (apply_movements).
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import InventoryItem, StockReservation
+from .services import OUT, RELEASE, RESERVE, Movement, apply_movements
+
+# Caducidad por defecto de una reserva
+DEFAULT_TTL = timedelta(hours=48)
+# Reservas caducadas por transacción en el barrido
+EXPIRE_BATCH = 1000
+
+
+def available_to_promise(org, product_id, warehouse_id) -> Decimal:
+    """Disponible (existencias - reservado) de un producto en un almacén: una fila de InventoryItem."""
+    row = (
+        InventoryItem.objects.filter(org=org, product_id=product_id, warehouse_id=warehouse_id)
+        .values_list("qty_on_hand", "qty_reserved")
+        .first()
+    )
+    return row[0] - row[1] if row else Decimal("0")
+
+
+def _active(org, ref_type, ref_id, line_ids=None):
+    qs = StockReservation.objects.select_for_update().filter(
+        org=org, ref_type=ref_type, ref_id=str(ref_id), status=StockReservation.ACTIVE
+    ).order_by("id")
+    if line_ids is not None:
+        qs = qs.filter(line_id__in=list(line_ids))
+    return qs
+
+
+def _close(reservations, status, now=None):
+    ids = [r.id for r in reservations]
+    if ids:
+        StockReservation.objects.filter(id__in=ids).update(status=status, closed_at=now or timezone.now())
+
+
+def _release_movements(reservations):
+    return [Movement(RELEASE, r.product_id, r.warehouse_id, r.qty) for r in reservations]
+
+
+@transaction.atomic
+def hold(org, user, ref_type, ref_id, lines, ttl: timedelta | None = DEFAULT_TTL):
+    """
+    Reserva las líneas (line_id, product_id, warehouse_id, qty) del documento.
+    Si una línea ya tenía reserva activa se sustituye (nueva cantidad y nueva
+    caducidad). ttl=None: sin caducidad. Lanza ValueError (y no reserva nada)
+    si alguna línea no tiene disponible. Devuelve las reservas activas.
+    """
+    lines = [ln for ln in lines if ln[3] > 0]
+    previous = list(_active(org, ref_type, ref_id, [ln[0] for ln in lines]))
+    expires_at = timezone.now() + ttl if ttl is not None else None
+
+    # primero se libera lo que había para las mismas líneas y después se reserva
+    apply_movements(org, user, _release_movements(previous) + [
+        Movement(RESERVE, product_id, warehouse_id, qty) for _, product_id, warehouse_id, qty in lines
+    ])
+    _close(previous, StockReservation.RELEASED)
+    return StockReservation.objects.bulk_create([
+        StockReservation(
+            org=org, product_id=product_id, warehouse_id=warehouse_id, qty=qty, ref_type=ref_type,
+            ref_id=str(ref_id), line_id=line_id, expires_at=expires_at, created_by=user,
+        )
+        for line_id, product_id, warehouse_id, qty in lines
+    ])
+
+
+@transaction.atomic
+def release(org, user, ref_type, ref_id, line_ids=None, *, keep_line_ids=None) -> int:
+    """
+    Libera las reservas activas del documento (o solo de line_ids; o todas
+    menos las de keep_line_ids). Devuelve cuántas se liberaron.
+    """
+    reservations = list(_active(org, ref_type, ref_id, line_ids))
+    if keep_line_ids is not None:
+        keep = set(keep_line_ids)
+        reservations = [r for r in reservations if r.line_id not in keep]
+    if reservations:
+        apply_movements(org, user, _release_movements(reservations))
+        _close(reservations, StockReservation.RELEASED)
+    return len(reservations)
+
+
+@transaction.atomic
+def release_stale(org, user, ref_type, ref_id, lines) -> int:
+    """
+    Libera las reservas activas del documento cuya línea ya no existe o ha
+    cambiado de producto o cantidad (lines: {line_id: (product_id, qty)}).
+    Las líneas se reutilizan por posición al reemplazarlas: una reserva solo
+    sigue valiendo si la línea pide exactamente lo reservado.
+    Devuelve cuántas se liberaron.
+    """
+    reservations = [
+        r for r in _active(org, ref_type, ref_id)
+        if lines.get(r.line_id) != (r.product_id, r.qty)
+    ]
+    if reservations:
+        apply_movements(org, user, _release_movements(reservations))
+        _close(reservations, StockReservation.RELEASED)
+    return len(reservations)
+
+
+@transaction.atomic
+def consume(org, user, ref_type, ref_id, lines, reason="sale"):
+    """
+    Salida de stock de las líneas (line_id, product_id, warehouse_id, qty[, uom])
+    del documento en un solo lote. Cada línea consume entera su reserva activa
+    (si es del mismo producto y almacén); lo que no estaba reservado solo
+    puede salir del stock libre. Las reservas de otras líneas del documento
+    no se tocan; las que no casan con su línea se liberan.
+    Los movimientos se registran con ref_type / ref_id.
+    """
+    lines = list(lines)
+    reservations = {r.line_id: r for r in _active(org, ref_type, ref_id, [ln[0] for ln in lines])}
+    movements, consumed, mismatched = [], [], []
+    for line_id, product_id, warehouse_id, qty, *uom in lines:
+        reservation = reservations.pop(line_id, None)
+        if reservation is not None and (reservation.product_id, reservation.warehouse_id) != (product_id, warehouse_id):
+            movements += _release_movements([reservation])
+            mismatched.append(reservation)
+            reservation = None
+        if reservation is not None:
+            consumed.append(reservation)
+        movements.append(Movement(
+            OUT, product_id, warehouse_id, qty, reason, ref_type, str(ref_id),
+            uom=uom[0] if uom else None,
+            consume=reservation.qty if reservation is not None else Decimal("0"),
+        ))
+
+    items = apply_movements(org, user, movements)
+    _close(consumed, StockReservation.CONSUMED)
+    _close(mismatched, StockReservation.RELEASED)
+    return items
+
+
+def consume_reservation(org, user, reservation, product_id, warehouse_id, qty: Decimal, reason="sale"):
+    """Salida de `qty` que consume una reserva concreta (ver services.confirm_outgoing)."""
+    with transaction.atomic():
+        reservation = StockReservation.objects.select_for_update().get(pk=reservation.pk, org=org)
+        if reservation.status != StockReservation.ACTIVE:
+            raise ValueError(f"La reserva {reservation.pk} no está activa ({reservation.status})")
+        if (str(reservation.product_id), str(reservation.warehouse_id)) != (str(product_id), str(warehouse_id)):
+            raise ValueError(f"La reserva {reservation.pk} es de otro producto o almacén")
+        items = consume(
+            org, user, reservation.ref_type, reservation.ref_id,
+            [(reservation.line_id, reservation.product_id, reservation.warehouse_id, qty)], reason=reason,
+        )
+    (item,) = items.values()
+    return item
+
+
+@transaction.atomic
+def expire_reservations(now=None, batch_size: int = EXPIRE_BATCH) -> int:
+    """
+    Caduca hasta batch_size reservas activas vencidas (de todas las
+    organizaciones): libera su cantidad con un lote de movimientos por
+    organización y las marca como expired con un solo UPDATE. Salta las
+    filas bloqueadas por otra transacción (SKIP LOCKED): se recogen en la
+    siguiente pasada. Devuelve cuántas caducó.
+    """
+    now = now or timezone.now()
+    expired = list(
+        StockReservation.objects.select_for_update(skip_locked=True, of=("self",))
+        .filter(status=StockReservation.ACTIVE, expires_at__lte=now)
+        .select_related("org")
+        .order_by("expires_at", "id")[:batch_size]
+    )
+    by_org = {}
+    for r in expired:
+        by_org.setdefault(r.org_id, []).append(r)
+    for reservations in by_org.values():
+        apply_movements(reservations[0].org, None, _release_movements(reservations))
+    _close(expired, StockReservation.EXPIRED, now)
+    return len(expired)
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from django.http import JsonResponse
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet, WarehouseViewSet, WorksiteViewSet, StockViewSet, MoveActionsViewSet
+from .views import CategoryViewSet, ProductViewSet, WarehouseViewSet, WorksiteViewSet, StockViewSet, ReservationViewSet, MoveActionsViewSet
 
 def health(_request):
     return JsonResponse({"app": "inventory", "status": "ok"})
@@ -12,6 +12,7 @@ router.register(r'products', ProductViewSet, basename='inv-product')
 router.register(r'warehouses', WarehouseViewSet, basename='inv-warehouse')
 router.register(r'worksites', WorksiteViewSet, basename='inv-worksite')
 router.register(r'stock', StockViewSet, basename='inv-stock')
+router.register(r'reservations', ReservationViewSet, basename='inv-reservation')
 router.register(r'moves', MoveActionsViewSet, basename='inv-moves')
 
 urlpatterns = [
@@ -2,18 +2,27 @@
 from decimal import Decimal
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db.models import Q, Sum, F
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from .models import Category, Product, Warehouse, Worksite, InventoryItem, StockMove
+from .models import Category, Product, Warehouse, Worksite, InventoryItem, StockMove, StockReservation
 from .serializers import (
     CategorySerializer, ProductSerializer, WarehouseSerializer, WorksiteSerializer,
-    InventoryItemSerializer, StockMoveSerializer
+    InventoryItemSerializer, StockMoveSerializer, StockReservationSerializer
 )
 from . import services
+from .services_ledger import stock_as_of, stock_valuation
 
 from core.mixins import OrgScopedModelViewSet
 
+# Autocompletado de productos: nº de resultados por defecto / máximo
+LOOKUP_LIMIT = 20
+LOOKUP_MAX_LIMIT = 50
+
 class CategoryViewSet(OrgScopedModelViewSet, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
     queryset = Category.objects.all()
@@ -39,13 +48,52 @@ class ProductViewSet(OrgScopedModelViewSet, viewsets.ModelViewSet):
             qs = qs.filter(is_service=(is_service=="1"))
         if tax_rate:
             qs = qs.filter(tax_rate=tax_rate)
-        # filtro in_stock por warehouse (si no hay, considerar suma en todos)
+        # filtro in_stock por warehouse (si no hay, considerar suma en todos).
+        # Sin DISTINCT: como mucho una fila por producto (InventoryItem es único
+        # por producto y almacén; ProductStock, por producto).
         if in_stock in ("1","true","True"):
             if warehouse:
                 qs = qs.filter(inventory_items__warehouse_id=warehouse, inventory_items__qty_on_hand__gt=0)
             else:
-                qs = qs.filter(inventory_items__qty_on_hand__gt=0)
-        return qs.distinct()
+                qs = qs.filter(stock__qty_on_hand__gt=0)
+        return qs
+
+    @action(detail=False, methods=["get"])
+    def lookup(self, request, *args, **kwargs):
+        """
+        Autocompletado de productos (editor de líneas): ?q=&limit=&in_stock=&is_service=.
+        Solo activos, campos mínimos y sin paginar; primero coincidencias exactas
+        de SKU, luego los que empiezan por q, luego el resto por nombre.
+        """
+        params = request.query_params
+        q = (params.get("q") or "").strip()
+        try:
+            limit = max(1, min(int(params.get("limit", LOOKUP_LIMIT)), LOOKUP_MAX_LIMIT))
+        except ValueError:
+            raise ValidationError({"limit": "Debe ser un entero."})
+
+        qs = Product.objects.filter(org=self.org, is_active=True)
+        if q:
+            qs = qs.filter(Q(name__icontains=q) | Q(sku__icontains=q)).order_by(
+                Case(
+                    When(sku__iexact=q, then=Value(0)),
+                    When(Q(sku__istartswith=q) | Q(name__istartswith=q), then=Value(1)),
+                    default=Value(2),
+                ),
+                "name",
+            )
+        else:
+            qs = qs.order_by("name")
+        if params.get("in_stock") in ("1", "true", "True"):
+            qs = qs.filter(stock__qty_on_hand__gt=0)
+        if params.get("is_service") in ("0", "1"):
+            qs = qs.filter(is_service=(params["is_service"] == "1"))
+
+        rows = qs.values(
+            "id", "sku", "name", "uom", "price", "tax_rate", "is_service",
+            qty_available=Coalesce("stock__qty_available", Value(Decimal("0.000"))),
+        )[:limit]
+        return Response(list(rows))
 
 class WarehouseViewSet(OrgScopedModelViewSet, viewsets.ModelViewSet):
     serializer_class = WarehouseSerializer
@@ -77,6 +125,76 @@ class StockViewSet(OrgScopedModelViewSet, mixins.ListModelMixin, viewsets.Generi
             qs = qs.filter(warehouse_id=warehouse)
         return qs
 
+    @staticmethod
+    def _as_of(params):
+        value = params.get("date")
+        if not value:
+            return timezone.localdate()
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({"date": "Formato de fecha inválido. Usa YYYY-MM-DD."})
+        return parsed
+
+    @staticmethod
+    def _id(params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: "Debe ser un entero."})
+
+    @action(detail=False, methods=["get"], url_path="as-of")
+    def as_of(self, request, *args, **kwargs):
+        """Stock por producto y almacén al final de ?date= (por defecto hoy), desde el libro."""
+        params = request.query_params
+        as_of = self._as_of(params)
+        product = self._id(params, "product")
+        balances = stock_as_of(
+            self.org, as_of,
+            warehouse_id=self._id(params, "warehouse"),
+            product_ids=[product] if product is not None else None,
+        )
+        products = dict(Product.objects.filter(id__in={p for p, _ in balances}).values_list("id", "sku"))
+        warehouses = dict(Warehouse.objects.filter(id__in={w for _, w in balances}).values_list("id", "code"))
+        results = [
+            {
+                "product": p, "product_sku": products.get(p),
+                "warehouse": w, "warehouse_code": warehouses.get(w),
+                "qty": qty,
+            }
+            for (p, w), qty in sorted(balances.items(), key=lambda kv: (products.get(kv[0][0]) or "", warehouses.get(kv[0][1]) or ""))
+        ]
+        return Response({"date": as_of, "results": results})
+
+    @action(detail=False, methods=["get"])
+    def valuation(self, request, *args, **kwargs):
+        """Valoración del stock a ?date= (qty × coste actual del producto)."""
+        params = request.query_params
+        return Response(stock_valuation(self.org, self._as_of(params), warehouse_id=self._id(params, "warehouse")))
+
+class ReservationViewSet(OrgScopedModelViewSet, mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Reservas de stock (solo lectura): ?status= (por defecto active), ?product=, ?warehouse=, ?ref_type=&ref_id=."""
+    serializer_class = StockReservationSerializer
+    queryset = StockReservation.objects.all()
+    http_method_names = ["get", "head", "options"]
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        params = self.request.query_params
+        qs = qs.filter(status=params.get("status") or StockReservation.ACTIVE)
+        for name in ("product", "warehouse"):
+            if params.get(name):
+                qs = qs.filter(**{f"{name}_id": params[name]})
+        for name in ("ref_type", "ref_id"):
+            if params.get(name):
+                qs = qs.filter(**{name: params[name]})
+        return qs
+
 class MoveActionsViewSet(OrgScopedModelViewSet, viewsets.GenericViewSet):
     serializer_class = StockMoveSerializer
     queryset = StockMove.objects.all()
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:34
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY: no bloquea escrituras en tablas grandes
+    atomic = False
+
+    dependencies = [
+        ('contacts', '0003_alter_contact_unique_together_and_more'),
+        ('core', '0003_organizationemailsettings'),
+        ('inventory', '0002_product_cost_price'),
+        ('purchases', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='supplierinvoice',
+            index=models.Index(fields=['org', 'status', 'date'], name='purch_si_org_status_date'),
+        ),
+        AddIndexConcurrently(
+            model_name='supplierinvoice',
+            index=models.Index(condition=models.Q(('status', 'posted')), fields=['org', 'date'], include=('supplier', 'total_base', 'total_tax', 'total'), name='purch_si_posted_date_cov'),
+        ),
+        AddIndexConcurrently(
+            model_name='supplierinvoice',
+            index=models.Index(condition=models.Q(('status', 'posted')), fields=['org', 'due_date'], include=('total',), name='purch_si_posted_due_cov'),
+        ),
+        AddIndexConcurrently(
+            model_name='supplierinvoice',
+            index=django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['date'], name='purch_si_date_brin'),
+        ),
+        AddIndexConcurrently(
+            model_name='supplierpayment',
+            index=models.Index(fields=['invoice', 'date'], include=('amount',), name='purch_sp_inv_date_cov'),
+        ),
+        AddIndexConcurrently(
+            model_name='supplierpayment',
+            index=models.Index(fields=['org', 'date'], include=('amount',), name='purch_sp_org_date_cov'),
+        ),
+    ]
@@ -1,7 +1,9 @@
 # purchases/models.py
 from decimal import Decimal
 
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
 from core.models import Organization
@@ -228,6 +230,24 @@ class SupplierInvoice(OrgScopedModel):
     class Meta:
         unique_together = ("org", "number")
         ordering = ["-date", "-id"]
+        indexes = [
+            models.Index(fields=["org", "status", "date"], name="purch_si_org_status_date"),
+            # compras / ABC proveedores: posted por fecha con importes incluidos
+            models.Index(
+                fields=["org", "date"],
+                include=["supplier", "total_base", "total_tax", "total"],
+                condition=Q(status="posted"),
+                name="purch_si_posted_date_cov",
+            ),
+            # pagos pendientes / aging / cashflow
+            models.Index(
+                fields=["org", "due_date"],
+                include=["total"],
+                condition=Q(status="posted"),
+                name="purch_si_posted_due_cov",
+            ),
+            BrinIndex(fields=["date"], name="purch_si_date_brin", autosummarize=True),
+        ]
 
     def __str__(self):
         return f"SI {self.number} ({self.supplier_id})"
@@ -314,6 +334,10 @@ class SupplierPayment(OrgScopedModel):
 
     class Meta:
         ordering = ["-date", "-id"]
+        indexes = [
+            models.Index(fields=["invoice", "date"], include=["amount"], name="purch_sp_inv_date_cov"),
+            models.Index(fields=["org", "date"], include=["amount"], name="purch_sp_org_date_cov"),
+        ]
 
     def __str__(self):
         return f"Payment {self.amount} → {self.invoice_id}"
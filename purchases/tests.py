@@ -1,3 +1,121 @@
-from django.test import TestCase
+# purchases/tests.py
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from contacts.models import Contact
+from core.models import Membership, Organization
+from inventory.models import Category, InventoryItem, Product, StockMove, Warehouse
+from inventory.services_ledger import reconcile_stock
+
+from .models import SupplierInvoice, SupplierInvoiceLine, SupplierPayment
+from .views import SupplierInvoiceViewSet, SupplierPaymentViewSet
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class SupplierInvoicePostTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.user = User.objects.create(email="owner@example.com")
+        Membership.objects.create(organization=cls.org, user=cls.user, role="owner")
+        cls.supplier = Contact.objects.create(org=cls.org, tipo="supplier", razon_social="Proveedor")
+        cls.wh = Warehouse.objects.create(org=cls.org, code="A", name="Almacén A")
+        category = Category.objects.create(org=cls.org, name="General")
+        cls.p1, cls.p2 = Product.objects.bulk_create([
+            Product(org=cls.org, category=category, sku=f"P{i}", name=f"Producto {i}", uom="kg") for i in range(2)
+        ])
+
+    def post(self, inv):
+        request = APIRequestFactory().post("/")
+        request.org = self.org
+        force_authenticate(request, user=self.user)
+        response = SupplierInvoiceViewSet.as_view({"post": "post"})(request, org_slug=self.org.slug, pk=inv.pk)
+        response.render()
+        return response
+
+    def on_hand(self, product):
+        return InventoryItem.objects.get(org=self.org, product=product, warehouse=self.wh).qty_on_hand
+
+    def ledger(self, product):
+        return StockMove.objects.filter(org=self.org, product=product).aggregate(qty=Sum("qty"))["qty"]
+
+    def test_post_moves_stock_and_ledger_together(self):
+        inv = SupplierInvoice.objects.create(org=self.org, number="F1", supplier=self.supplier, warehouse=self.wh)
+        SupplierInvoiceLine.objects.create(invoice=inv, product=self.p1, qty=Decimal("4"), uom="kg", unit_price=Decimal("2.50"))
+        SupplierInvoiceLine.objects.create(invoice=inv, product=self.p1, qty=Decimal("1.5"), uom="kg")
+        SupplierInvoiceLine.objects.create(invoice=inv, product=self.p2, qty=Decimal("3"), uom="kg")
+        SupplierInvoiceLine.objects.create(invoice=inv, description="Portes", qty=Decimal("1"), unit_price=Decimal("9.00"))
+
+        response = self.post(inv)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], "posted")
+        self.assertEqual((self.on_hand(self.p1), self.ledger(self.p1)), (Decimal("5.5"), Decimal("5.5")))
+        self.assertEqual((self.on_hand(self.p2), self.ledger(self.p2)), (Decimal("3"), Decimal("3")))
+        moves = StockMove.objects.filter(org=self.org)
+        self.assertEqual(set(moves.values_list("reason", "ref_type", "ref_id")), {("purchase", "supplier_invoice", str(inv.id))})
+        self.assertEqual(reconcile_stock(self.org, repair=False)["drift"], [])
+
+        # un segundo "post" no vuelve a dar entrada
+        self.assertEqual(self.post(inv).status_code, 400)
+        self.assertEqual((self.on_hand(self.p1), self.ledger(self.p1)), (Decimal("5.5"), Decimal("5.5")))
+        self.assertEqual(moves.count(), 3)
+
+    def test_invoice_without_lines_moves_nothing(self):
+        inv = SupplierInvoice.objects.create(org=self.org, number="F2", supplier=self.supplier, warehouse=self.wh)
+        self.assertEqual(self.post(inv).status_code, 400)
+        inv.refresh_from_db()
+        self.assertEqual(inv.status, "draft")
+        self.assertFalse(StockMove.objects.filter(org=self.org).exists())
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class SupplierPaymentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.user = User.objects.create(email="owner@example.com")
+        Membership.objects.create(organization=cls.org, user=cls.user, role="owner")
+        supplier = Contact.objects.create(org=cls.org, tipo="supplier", razon_social="Proveedor")
+        wh = Warehouse.objects.create(org=cls.org, code="A", name="Almacén A")
+        cls.invoice = SupplierInvoice.objects.create(
+            org=cls.org, number="F1", supplier=supplier, warehouse=wh, status="posted", total=Decimal("10.00"),
+        )
+
+    def call(self, actions, method="post", data=None, **kwargs):
+        request = getattr(APIRequestFactory(), method)("/", data, format="json")
+        request.org = self.org
+        force_authenticate(request, user=self.user)
+        response = SupplierPaymentViewSet.as_view(actions)(request, org_slug=self.org.slug, **kwargs)
+        response.render()
+        return response
+
+    def test_failed_analytics_hook_rolls_back_payment_and_status(self):
+        data = {"invoice": self.invoice.id, "amount": "10.00", "date": "2026-03-10"}
+        with mock.patch("purchases.views.register_supplier_payment_created", side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.call({"post": "create"}, data=data)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.payment_status, "unpaid")
+        self.assertFalse(SupplierPayment.objects.exists())
+
+        response = self.call({"post": "create"}, data=data)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.payment_status, "paid")
+
+        with mock.patch("purchases.views.register_supplier_payment_deleted", side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.call({"delete": "destroy"}, method="delete", pk=response.data["id"])
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.payment_status, SupplierPayment.objects.count()), ("paid", 1))
+
+    def test_overpayment_is_rejected(self):
+        response = self.call({"post": "create"}, data={"invoice": self.invoice.id, "amount": "10.50", "date": "2026-03-10"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SupplierPayment.objects.exists())
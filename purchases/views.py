@@ -1,6 +1,7 @@
 # purchases/views.py
 from decimal import Decimal
 
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.decorators import action
@@ -13,8 +14,9 @@ from rest_framework.exceptions import NotFound
 from datetime import datetime, timedelta
 
 from core.mixins import OrgScopedModelViewSet
+from inventory import services as inv_services
 from inventory.models import Product
-from inventory.models import StockMove
+from sales.pricing import line_totals
 from .models import (
     PurchaseOrder,
     PurchaseOrderLine,
@@ -33,6 +35,7 @@ from .permissions import CanManagePurchases
 from analytics.hooks import (
     register_supplier_invoice_posted,
     register_supplier_payment_created,
+    register_supplier_payment_updated,
     register_supplier_payment_deleted,
 )
 
@@ -42,21 +45,12 @@ from analytics.hooks import (
 
 def _calc_line_amounts(qty, unit_price, tax_rate, discount_pct):
     """
-    Devuelve (base, tax, total) con dos decimales.
+    Devuelve (base, tax, total) con dos decimales (motor común sales.pricing).
     """
-    qty = Decimal(str(qty))
-    unit_price = Decimal(str(unit_price))
-    tax_rate = Decimal(str(tax_rate))
-    discount_pct = Decimal(str(discount_pct))
-
-    if qty <= 0:
-        base = Decimal("0.00")
-    else:
-        base = qty * unit_price * (Decimal("1") - (discount_pct / Decimal("100")))
-    base = base.quantize(Decimal("0.01"))
-    tax = (base * tax_rate / Decimal("100")).quantize(Decimal("0.01"))
-    total = base + tax
-    return base, tax, total
+    if Decimal(str(qty)) <= 0:
+        zero = Decimal("0.00")
+        return zero, zero, zero
+    return line_totals(qty, unit_price, tax_rate, discount_pct)
 
 
 def _recalc_order_totals(order: PurchaseOrder):
@@ -102,26 +96,22 @@ def _recalc_payment_status(inv: SupplierInvoice):
 
 def _create_stock_moves_for_invoice(inv: SupplierInvoice, user):
     """
-    Crea movimientos de stock de tipo 'purchase' para cada línea de producto
-    al contabilizar la factura. Idempotente respecto al estado: solo se llama
-    al pasar de draft -> posted.
+    Da entrada en stock (movimientos 'purchase' + InventoryItem) a las líneas
+    de producto al contabilizar la factura, en un solo lote de
+    inventory.services. Solo se llama al pasar de draft -> posted.
     """
-    for ln in inv.lines.all():
-        if not ln.product or ln.qty <= 0:
-            continue
-
-        StockMove.objects.create(
-            org=inv.org,
-            product=ln.product,
-            qty=ln.qty,  # positivo (entra stock)
-            uom=ln.uom,
-            warehouse_from=None,
-            warehouse_to=inv.warehouse,
-            reason="purchase",
-            ref_type="supplier_invoice",
-            ref_id=str(inv.id),
-            created_by=user,
-        )
+    inv_services.receive_many(
+        inv.org,
+        user,
+        [
+            (ln.product_id, inv.warehouse_id, ln.qty, ln.uom)
+            for ln in inv.lines.all()
+            if ln.product_id and ln.qty > 0
+        ],
+        reason="purchase",
+        ref_type="supplier_invoice",
+        ref_id=str(inv.id),
+    )
 
 
 # --------- VIEWSETS ---------
@@ -215,7 +205,7 @@ class SupplierInvoiceViewSet(OrgScopedModelViewSet):
     """
     Facturas de proveedor. Incluye:
     - add_line: añadir líneas
-    - post: contabilizar (calcula totales + crea StockMoves)
+    - post: contabilizar (calcula totales + entrada de stock)
     - cancel: marcar cancelada
     Escritura restringida a owner/admin/manager.
     """
@@ -236,6 +226,17 @@ class SupplierInvoiceViewSet(OrgScopedModelViewSet):
     def get_queryset(self):
         return super().get_queryset()
 
+    def perform_update(self, serializer):
+        # el stock y la analítica se registraron al contabilizar
+        if serializer.instance.status == "posted":
+            raise ValidationError("No se puede modificar una factura ya contabilizada (posted).")
+        super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        if instance.status == "posted":
+            raise ValidationError("No se puede borrar una factura ya contabilizada (posted).")
+        super().perform_destroy(instance)
+
     @action(detail=True, methods=["post"])
     def add_line(self, request, pk=None, *args, **kwargs):
         inv = self.get_object()
@@ -286,22 +287,29 @@ class SupplierInvoiceViewSet(OrgScopedModelViewSet):
         - crea movimientos de stock de compra
         """
         inv = self.get_object()
-        if inv.status == "posted":
-            raise ValidationError("La factura ya está contabilizada.")
-        if inv.status == "cancelled":
-            raise ValidationError("No se puede contabilizar una factura cancelada.")
+        with transaction.atomic():
+            # bloqueo + estado releído: dos "post" a la vez no duplican el stock
+            inv.status = (
+                SupplierInvoice.objects.select_for_update()
+                .values_list("status", flat=True)
+                .get(pk=inv.pk)
+            )
+            if inv.status == "posted":
+                raise ValidationError("La factura ya está contabilizada.")
+            if inv.status == "cancelled":
+                raise ValidationError("No se puede contabilizar una factura cancelada.")
 
-        if inv.lines.count() == 0:
-            raise ValidationError("No se puede contabilizar una factura sin líneas.")
+            if inv.lines.count() == 0:
+                raise ValidationError("No se puede contabilizar una factura sin líneas.")
 
-        _recalc_invoice_totals(inv)
-        inv.status = "posted"
-        inv.save(update_fields=["status", "total_base", "total_tax", "total"])
+            _recalc_invoice_totals(inv)
+            inv.status = "posted"
+            inv.save(update_fields=["status", "total_base", "total_tax", "total"])
 
-        _create_stock_moves_for_invoice(inv, request.user)
+            _create_stock_moves_for_invoice(inv, request.user)
 
-        # 🔹 gancho a analítica
-        register_supplier_invoice_posted(inv)
+            # 🔹 gancho a analítica (en la misma transacción que el stock)
+            register_supplier_invoice_posted(inv)
 
         ser = SupplierInvoiceSerializer(inv, context={"request": request})
         return Response(ser.data)
@@ -340,6 +348,7 @@ class SupplierPaymentViewSet(OrgScopedModelViewSet):
     def get_queryset(self):
         return super().get_queryset()
 
+    @transaction.atomic
     def perform_create(self, serializer):
         data = serializer.validated_data
         invoice = data["invoice"]
@@ -360,6 +369,7 @@ class SupplierPaymentViewSet(OrgScopedModelViewSet):
         # 💚 HOOK ANALYTICS
         register_supplier_payment_created(payment)
 
+    @transaction.atomic
     def perform_update(self, serializer):
         data = serializer.validated_data
         invoice = data.get("invoice") or serializer.instance.invoice
@@ -377,11 +387,15 @@ class SupplierPaymentViewSet(OrgScopedModelViewSet):
         if total_paid_others + amount - total > Decimal("0.01"):
             raise ValidationError("El pago supera el importe pendiente de la factura.")
 
+        previous_invoice = serializer.instance.invoice
+        previous_amount = serializer.instance.amount
         payment = serializer.save(org=self.org)
         _recalc_payment_status(payment.invoice)
 
+        # 💚 HOOK ANALYTICS
+        register_supplier_payment_updated(payment, previous_invoice, previous_amount)
 
-
+    @transaction.atomic
     def perform_destroy(self, instance):
         inv = instance.invoice
         super().perform_destroy(instance)
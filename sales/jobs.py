@@ -0,0 +1,32 @@
+# sales/jobs.py
+from rq import get_current_job
+
+from .services_quote import MAX_CONVERT_BATCH, convert_quotes
+
+# Presupuestos por transacción en el job de conversión
+CONVERT_CHUNK = 200
+
+
+def convert_quotes_job(org_id, quote_ids: list[int], chunk_size: int = CONVERT_CHUNK):
+    """
+    Job RQ: convierte a factura un conjunto (grande) de presupuestos aceptados,
+    en bloques de `chunk_size` con una transacción por bloque: si un bloque
+    falla, los anteriores quedan convertidos y relanzar el job los salta
+    (salen en "already").
+    El progreso se guarda en job.meta; el resultado es la suma de los bloques.
+    """
+    from core.models import Organization
+
+    org = Organization.objects.get(pk=org_id)
+    chunk_size = max(1, min(chunk_size, MAX_CONVERT_BATCH))
+    job = get_current_job()
+    result = {"converted": [], "already": [], "failed": []}
+    for start in range(0, len(quote_ids), chunk_size):
+        chunk = convert_quotes(org, quote_ids[start:start + chunk_size])
+        for key, items in chunk.items():
+            result[key].extend(items)
+        if job is not None:
+            job.meta["processed"] = min(start + chunk_size, len(quote_ids))
+            job.meta["total"] = len(quote_ids)
+            job.save_meta()
+    return result
@@ -0,0 +1,89 @@
+# sales/management/commands/bench_pricing_engine.py
+"""
+Micro-benchmark del motor de precios en céntimos enteros (sales.pricing):
+mide price_rows sobre un lote de documentos aleatorios frente al cálculo
+Decimal anterior (bases por IVA + totales, documento a documento).
+
+Antes de medir comprueba que ambos caminos dan lo mismo para el lote; la
+paridad completa (valor y exponente, API por documento, line_totals) está en
+sales.tests.PricingEngineTests. No toca la base de datos.
+"""
+import random
+import time
+from decimal import Decimal, ROUND_HALF_EVEN
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales import pricing
+
+_RATES = ("0.00", "4.00", "5.00", "10.00", "21.00")
+
+
+def _money(x):
+    return x.quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)
+
+
+def _decimal_document(lines):
+    """Camino anterior: bases por IVA y totales en Decimal."""
+    bases = {}
+    for ln in lines:
+        base = _money(ln["qty"] * ln["unit_price"] * (Decimal("1.00") - ln["discount_pct"] / Decimal("100")))
+        key = str(_money(ln["tax_rate"]))
+        bases[key] = bases.get(key, Decimal("0.00")) + base
+    total_base = _money(sum(bases.values(), Decimal("0.00")))
+    total_tax = _money(sum((b * Decimal(r) / Decimal("100") for r, b in bases.items()), Decimal("0.00")))
+    return ({r: str(b) for r, b in sorted(bases.items()) if b}, total_base, total_tax, _money(total_base + total_tax))
+
+
+def _random_line(rnd):
+    return {
+        "qty": Decimal(rnd.randint(1, 100000)).scaleb(-rnd.choice((0, 0, 1, 3))),
+        "unit_price": Decimal(rnd.randint(0, 10 ** 6)).scaleb(-2),
+        "discount_pct": rnd.choice((Decimal("0.00"), Decimal("0.00"), Decimal(rnd.randint(0, 10000)).scaleb(-2))),
+        "tax_rate": Decimal(rnd.choice(_RATES)),
+    }
+
+
+class Command(BaseCommand):
+    help = "Mide price_rows (céntimos enteros) frente al cálculo Decimal anterior."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--docs", type=int, default=2000)
+        parser.add_argument("--lines", type=int, default=10, help="Líneas por documento")
+        parser.add_argument("--repeat", type=int, default=3, help="Repeticiones (se toma la mejor)")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options["seed"])
+        documents = {
+            doc_id: [_random_line(rnd) for _ in range(options["lines"])]
+            for doc_id in range(1, options["docs"] + 1)
+        }
+        rows = [
+            (doc_id, ln["qty"], ln["unit_price"], ln["discount_pct"], ln["tax_rate"])
+            for doc_id, lines in documents.items() for ln in lines
+        ]
+        include = list(documents)
+
+        batch = pricing.price_rows(rows, include=include)
+        for doc_id, lines in documents.items():
+            if batch[doc_id] != _decimal_document(lines):
+                raise CommandError(f"Documento {doc_id}: {batch[doc_id]!r} != {_decimal_document(lines)!r}")
+
+        decimal_s = self._best(options["repeat"], lambda: [_decimal_document(lines) for lines in documents.values()])
+        batch_s = self._best(options["repeat"], lambda: pricing.price_rows(rows, include=include))
+
+        n = len(rows)
+        self.stdout.write(f"{len(documents)} documentos, {n} líneas (mejor de {options['repeat']})")
+        self.stdout.write(f"  Decimal por documento: {decimal_s * 1000:.1f} ms ({n / decimal_s:.0f} líneas/s)")
+        self.stdout.write(f"  price_rows (céntimos): {batch_s * 1000:.1f} ms ({n / batch_s:.0f} líneas/s)")
+        self.stdout.write(self.style.SUCCESS(f"  x{decimal_s / batch_s:.2f}"))
+
+    def _best(self, repeat, fn):
+        best = None
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
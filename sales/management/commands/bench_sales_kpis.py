@@ -0,0 +1,150 @@
+# sales/management/commands/bench_sales_kpis.py
+"""
+Benchmark de los KPIs de ventas (services_kpis.sales_kpis).
+
+Crea una organización temporal con un periodo consultado de tamaño fijo y va
+añadiendo histórico FUERA de ese periodo (años anteriores). Para cada tamaño
+de histórico mide la consulta (actual + periodo anterior, con y sin filtro
+de categoría) y cuenta las queries:
+
+- el nº de queries debe ser 2 siempre (cabeceras + líneas),
+- el tiempo debe mantenerse plano al crecer el histórico (los filtros de
+  fecha usan los índices por org/estado/fecha).
+
+Además compara el resultado con un cálculo en Python sobre las líneas del
+periodo. Todo se hace dentro de una transacción que se deshace al final.
+"""
+import random
+import statistics
+import time
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from contacts.models import Contact
+from core.models import Organization
+from inventory.models import Category, Product
+from sales.models import Invoice, InvoiceLine
+from sales.services_kpis import previous_period, sales_kpis
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Mide los KPIs de ventas por periodo con histórico creciente (nº de queries y tiempo)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--period-invoices", type=int, default=500, help="Facturas dentro del periodo consultado")
+        parser.add_argument("--history", default="0,5000,20000,50000", help="Tamaños de histórico (facturas), acumulados")
+        parser.add_argument("--lines", type=int, default=5, help="Líneas por factura")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(s) for s in options["history"].split(",") if s.strip())
+        self.rnd = random.Random(options["seed"])
+        try:
+            with transaction.atomic():
+                self._bench(sizes, options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def _bench(self, sizes, options):
+        org = Organization.objects.create(name="Bench KPIs", slug=f"bench-kpis-{uuid.uuid4().hex[:8]}")
+        self.customers = Contact.objects.bulk_create([
+            Contact(org=org, tipo="client", nombre=f"Cliente {i}") for i in range(20)
+        ])
+        categories = Category.objects.bulk_create([Category(org=org, name=f"Cat {i}") for i in range(5)])
+        self.products = Product.objects.bulk_create([
+            Product(
+                org=org, category=categories[i % len(categories)], sku=f"P{i}", name=f"Producto {i}",
+                price=Decimal(self.rnd.randint(500, 20000)) / 100,
+                cost_price=Decimal(self.rnd.randint(200, 10000)) / 100,
+            )
+            for i in range(50)
+        ])
+
+        date_to = date(date.today().year, 6, 30)
+        date_from = date(date_to.year, 4, 1)
+        prev_from, _ = previous_period(date_from, date_to)
+        # periodo consultado + anterior: tamaño fijo
+        self._create(org, options["period_invoices"], prev_from, date_to, options["lines"])
+
+        expected = self._expected(org, date_from, date_to)
+        category = categories[0].id
+        created = 0
+        self.stdout.write(f"{'histórico':>10} {'queries':>8} {'ms (med)':>9} {'ms cat.':>8}")
+        for size in sizes:
+            history_to = prev_from - timedelta(days=1)
+            self._create(org, size - created, history_to - timedelta(days=3 * 365), history_to, options["lines"])
+            created = size
+
+            with CaptureQueriesContext(connection) as ctx:
+                data = sales_kpis(org, date_from, date_to, compare=True)
+            if len(ctx.captured_queries) != 2:
+                raise CommandError(f"Se esperaban 2 queries, hubo {len(ctx.captured_queries)}")
+            got = (data["invoices"], data["total"], data["revenue"], data["cogs"])
+            if got != expected:
+                raise CommandError(f"Resultado distinto del cálculo en Python: {got} != {expected}")
+
+            plain = self._time(lambda: sales_kpis(org, date_from, date_to, compare=True), options["repeat"])
+            by_cat = self._time(
+                lambda: sales_kpis(org, date_from, date_to, category_id=category, compare=True), options["repeat"]
+            )
+            self.stdout.write(f"{size:>10} {len(ctx.captured_queries):>8} {plain:>9.1f} {by_cat:>8.1f}")
+
+        self.stdout.write(self.style.SUCCESS("OK: 2 queries por petición y mismo resultado que el cálculo en Python."))
+
+    def _create(self, org, count, dfrom, dto, lines_per_invoice):
+        if count <= 0:
+            return
+        days = (dto - dfrom).days
+        invoices = Invoice.objects.bulk_create([
+            Invoice(
+                org=org, customer=self.rnd.choice(self.customers), status="posted",
+                date_issue=dfrom + timedelta(days=self.rnd.randint(0, days)),
+            )
+            for _ in range(count)
+        ], batch_size=2000)
+        lines = []
+        for inv in invoices:
+            base = Decimal("0.00")
+            for _ in range(lines_per_invoice):
+                product = self.rnd.choice(self.products)
+                ln = InvoiceLine(
+                    invoice=inv, product=product, qty=Decimal(self.rnd.randint(1, 10)),
+                    unit_price=product.price, discount_pct=Decimal(self.rnd.choice((0, 0, 5, 10))),
+                    tax_rate=Decimal("21.00"),
+                    unit_cost=product.cost_price if self.rnd.random() < 0.8 else None,
+                )
+                base += (ln.qty * ln.unit_price * (100 - ln.discount_pct) / 100).quantize(Decimal("0.01"))
+                lines.append(ln)
+            inv.totals_base = base
+            inv.totals_tax = (base * Decimal("0.21")).quantize(Decimal("0.01"))
+            inv.total = inv.totals_base + inv.totals_tax
+        InvoiceLine.objects.bulk_create(lines, batch_size=5000)
+        Invoice.objects.bulk_update(invoices, ["totals_base", "totals_tax", "total"], batch_size=2000)
+
+    def _expected(self, org, date_from, date_to):
+        invoices = Invoice.objects.filter(org=org, status="posted", date_issue__range=(date_from, date_to))
+        revenue = cogs = Decimal("0")
+        for ln in InvoiceLine.objects.filter(invoice__in=invoices).select_related("product"):
+            revenue += ln.qty * ln.unit_price * (100 - ln.discount_pct) / 100
+            cogs += ln.qty * (ln.unit_cost if ln.unit_cost is not None else ln.product.cost_price)
+        total = sum((inv.total for inv in invoices), Decimal("0.00"))
+        return invoices.count(), total, revenue.quantize(Decimal("0.01")), cogs.quantize(Decimal("0.01"))
+
+    def _time(self, fn, repeat):
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
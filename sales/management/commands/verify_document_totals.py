@@ -0,0 +1,92 @@
+# sales/management/commands/verify_document_totals.py
+"""
+Comprueba las bases por IVA y los totales mantenidos incrementalmente en
+facturas y presupuestos: los recalcula desde las líneas (pricing) y avisa de
+cualquier desvío. Con --fix corrige los documentos no contabilizados.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import Organization
+from sales.models import Invoice, InvoiceLine, Quote, QuoteLine
+from sales.pricing import price_rows
+from sales.services_lines import TOTALS_FIELDS
+
+# nombre -> (modelo, modelo de línea, FK de la línea)
+DOCUMENTS = {
+    "invoices": (Invoice, InvoiceLine, "invoice_id"),
+    "quotes": (Quote, QuoteLine, "quote_id"),
+}
+
+
+def _expected(line_model, fk, parent_ids):
+    """{parent_id: (tax_bases, totals_base, totals_tax, total)} desde las líneas."""
+    rows = line_model.objects.filter(**{f"{fk}__in": parent_ids}).values_list(
+        fk, "qty", "unit_price", "discount_pct", "tax_rate"
+    )
+    return price_rows(rows, include=parent_ids)
+
+
+class Command(BaseCommand):
+    help = "Recalcula bases por IVA y totales de facturas/presupuestos desde las líneas y reporta desvíos."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", dest="org_slug", help="Slug de la organización (por defecto, todas)")
+        parser.add_argument("--only", choices=sorted(DOCUMENTS), help="Solo facturas o solo presupuestos")
+        parser.add_argument("--fix", action="store_true", help="Corregir los documentos no contabilizados con desvío")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        orgs = Organization.objects.all()
+        if options["org_slug"]:
+            orgs = orgs.filter(slug=options["org_slug"])
+            if not orgs.exists():
+                raise CommandError(f"Organización '{options['org_slug']}' no encontrada")
+
+        drift_total = 0
+        for name in [options["only"]] if options["only"] else sorted(DOCUMENTS):
+            model, line_model, fk = DOCUMENTS[name]
+            checked, drifted, fixed = self._verify(model, line_model, fk, orgs, options)
+            drift_total += drifted
+            self.stdout.write(f"{name}: revisados={checked} con_desvio={drifted} corregidos={fixed}")
+
+        if drift_total and not options["fix"]:
+            self.stdout.write(self.style.WARNING("Hay desvíos. Ejecuta con --fix para corregir los borradores."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Verificación de totales terminada."))
+
+    def _verify(self, model, line_model, fk, orgs, options):
+        qs = model.objects.filter(org__in=orgs).order_by("id").only("id", "status", *TOTALS_FIELDS)
+        checked = drifted = fixed = 0
+        batch_size = options["batch_size"]
+        last_id = 0
+        while True:
+            docs = list(qs.filter(id__gt=last_id)[:batch_size])
+            if not docs:
+                break
+            last_id = docs[-1].id
+            expected = _expected(line_model, fk, [d.id for d in docs])
+
+            to_fix = []
+            for doc in docs:
+                checked += 1
+                bases, base, tax, total = expected[doc.id]
+                stored = (doc.tax_bases or {}, doc.totals_base, doc.totals_tax, doc.total)
+                if stored == (bases, base, tax, total):
+                    continue
+                drifted += 1
+                self.stdout.write(
+                    f"  {model.__name__} #{doc.id} ({doc.status}): guardado base={doc.totals_base} "
+                    f"iva={doc.totals_tax} total={doc.total} bases={doc.tax_bases} | "
+                    f"esperado base={base} iva={tax} total={total} bases={bases}"
+                )
+                # Las facturas contabilizadas no se tocan: solo se reportan
+                if options["fix"] and doc.status != "posted":
+                    doc.tax_bases, doc.totals_base, doc.totals_tax, doc.total = bases, base, tax, total
+                    to_fix.append(doc)
+
+            if to_fix:
+                with transaction.atomic():
+                    model.objects.bulk_update(to_fix, TOTALS_FIELDS)
+                fixed += len(to_fix)
+        return checked, drifted, fixed
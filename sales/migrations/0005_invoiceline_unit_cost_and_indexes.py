@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:31
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def snapshot_posted_line_costs(apps, schema_editor):
+    """Foto de coste para las líneas ya contabilizadas (coste actual del producto)."""
+    InvoiceLine = apps.get_model("sales", "InvoiceLine")
+    Product = apps.get_model("inventory", "Product")
+    InvoiceLine.objects.filter(
+        invoice__status="posted", product__isnull=False, unit_cost__isnull=True
+    ).update(
+        unit_cost=Subquery(Product.objects.filter(pk=OuterRef("product_id")).values("cost_price")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0003_alter_contact_unique_together_and_more'),
+        ('core', '0003_organizationemailsettings'),
+        ('inventory', '0002_product_cost_price'),
+        ('sales', '0004_alter_invoice_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceline',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['org', 'status', 'date_issue'], name='sales_inv_org_status_date'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceline',
+            index=models.Index(fields=['invoice', 'product'], name='sales_invline_inv_product'),
+        ),
+        migrations.RunPython(snapshot_posted_line_costs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:34
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY: no bloquea escrituras en tablas grandes
+    atomic = False
+
+    dependencies = [
+        ('contacts', '0003_alter_contact_unique_together_and_more'),
+        ('core', '0003_organizationemailsettings'),
+        ('sales', '0005_invoiceline_unit_cost_and_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('status', 'posted')), fields=['org', 'date_issue'], include=('customer', 'totals_base', 'totals_tax', 'total'), name='sales_inv_posted_date_cov'),
+        ),
+        AddIndexConcurrently(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('status', 'posted')), fields=['org', 'due_date'], include=('total',), name='sales_inv_posted_due_cov'),
+        ),
+        AddIndexConcurrently(
+            model_name='invoice',
+            index=django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['date_issue'], name='sales_inv_date_brin'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['invoice', 'date'], include=('amount',), name='sales_pay_inv_date_cov'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['org', 'date'], include=('amount',), name='sales_pay_org_date_cov'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['date'], name='sales_pay_date_brin'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:38
+
+from decimal import ROUND_HALF_EVEN, Decimal
+from itertools import groupby
+
+from django.db import migrations, models
+
+
+# Copia congelada de sales.pricing (bases_por_iva + dump_bases) tal como era
+# al crear esta migración: no debe cambiar aunque cambie el motor de precios.
+def _money(x):
+    return Decimal(str(x)).quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)
+
+
+def _tax_bases(lines):
+    """{"21.00": "100.00", ...} de las líneas (qty, unit_price, discount_pct, tax_rate)."""
+    bases = {}
+    for ln in lines:
+        qty = Decimal(str(ln["qty"]))
+        unit = Decimal(str(ln["unit_price"]))
+        disc = Decimal(str(ln["discount_pct"] or 0))
+        key = str(_money(ln["tax_rate"]))
+        bases[key] = bases.get(key, Decimal("0.00")) + _money(qty * unit * (Decimal("1.00") - disc / Decimal("100")))
+    return {rate: str(base) for rate, base in sorted(bases.items()) if base}
+
+
+def _backfill(apps, model_name, line_model_name, fk):
+    Model = apps.get_model("sales", model_name)
+    Line = apps.get_model("sales", line_model_name)
+    lines = (
+        Line.objects.order_by(fk, "id")
+        .values(fk, "qty", "unit_price", "discount_pct", "tax_rate")
+        .iterator(chunk_size=5000)
+    )
+    batch = []
+    for parent_id, group in groupby(lines, key=lambda ln: ln[fk]):
+        batch.append(Model(pk=parent_id, tax_bases=_tax_bases(group)))
+        if len(batch) >= 1000:
+            Model.objects.bulk_update(batch, ["tax_bases"])
+            batch = []
+    if batch:
+        Model.objects.bulk_update(batch, ["tax_bases"])
+
+
+def backfill_tax_bases(apps, schema_editor):
+    """Bases por IVA de los documentos existentes, desde sus líneas."""
+    _backfill(apps, "Invoice", "InvoiceLine", "invoice_id")
+    _backfill(apps, "Quote", "QuoteLine", "quote_id")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0006_finance_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='tax_bases',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='quote',
+            name='tax_bases',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(backfill_tax_bases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:52
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0003_alter_contact_unique_together_and_more'),
+        ('core', '0003_organizationemailsettings'),
+        ('sales', '0007_document_tax_bases'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='invoice',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(models.F('org'), models.F('series'), django.db.models.functions.datetime.ExtractYear('date_issue'), models.F('number'), name='sales_inv_unique_series_year_number'),
+        ),
+    ]
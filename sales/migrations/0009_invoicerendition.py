@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_organizationemailsettings'),
+        ('sales', '0008_invoice_number_unique_per_year'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('html_sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('pdf_sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('rendered_at', models.DateTimeField(auto_now=True)),
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rendition', to='sales.invoice')),
+                ('org', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='%(class)ss', to='core.organization')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0003_alter_contact_unique_together_and_more'),
+        ('core', '0003_organizationemailsettings'),
+        ('sales', '0009_invoicerendition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['org', 'date_issue', 'id'], name='sales_inv_org_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='quote',
+            index=models.Index(fields=['org', 'date', 'id'], name='sales_quote_org_date_id'),
+        ),
+    ]
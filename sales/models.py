@@ -1,6 +1,9 @@
 # sales/models.py
 from decimal import Decimal
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
+from django.db.models import F, Q
+from django.db.models.functions import ExtractYear
 from django.utils import timezone
 
 from core.models import Organization
@@ -116,6 +119,9 @@ class Invoice(OrgScopedModel):
         decimal_places=2,
         default=Decimal("0.00"),
     )
+    # Bases por tipo de IVA {"21.00": "100.00", ...} (pricing.bases_por_iva),
+    # mantenidas al añadir/quitar líneas para no recalcular sobre todas
+    tax_bases = models.JSONField(default=dict, blank=True)
 
     # --- Verifactu (PREPARADO, no operativo aún) ---
     verifactu_status = models.CharField(
@@ -141,7 +147,36 @@ class Invoice(OrgScopedModel):
     # - implementar envío AEAT y logs.
 
     class Meta:
-        unique_together = ("org", "series", "number")
+        constraints = [
+            # La numeración es por serie y año de emisión (InvoiceSequence)
+            models.UniqueConstraint(
+                F("org"), F("series"), ExtractYear("date_issue"), F("number"),
+                name="sales_inv_unique_series_year_number",
+            ),
+        ]
+        indexes = [
+            # listados por estado y fecha
+            models.Index(fields=["org", "status", "date_issue"], name="sales_inv_org_status_date"),
+            # listado paginado por cursor (keyset_ordering = -date_issue, -id)
+            models.Index(fields=["org", "date_issue", "id"], name="sales_inv_org_date_id"),
+            # informes (ventas, IVA, top clientes): solo posted, con los importes
+            # dentro del índice para resolverlos con index-only scan
+            models.Index(
+                fields=["org", "date_issue"],
+                include=["customer", "totals_base", "totals_tax", "total"],
+                condition=Q(status="posted"),
+                name="sales_inv_posted_date_cov",
+            ),
+            # cobros pendientes / aging / cashflow: posted por vencimiento
+            models.Index(
+                fields=["org", "due_date"],
+                include=["total"],
+                condition=Q(status="posted"),
+                name="sales_inv_posted_due_cov",
+            ),
+            # tabla casi solo de inserciones: BRIN (diminuto) para rangos de fechas entre orgs
+            BrinIndex(fields=["date_issue"], name="sales_inv_date_brin", autosummarize=True),
+        ]
 
 
 class InvoiceLine(models.Model):
@@ -174,6 +209,38 @@ class InvoiceLine(models.Model):
         decimal_places=2,
         default=Decimal("0.00"),
     )
+    # Foto de Product.cost_price al contabilizar: el margen histórico no
+    # cambia aunque luego se actualice el coste del producto.
+    unit_cost = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["invoice", "product"], name="sales_invline_inv_product"),
+        ]
+
+
+class InvoiceRendition(OrgScopedModel):
+    """
+    Impresión ya generada (HTML / PDF) de una factura no borrador.
+    Los ficheros se guardan por contenido (sha256) en el storage de media;
+    aquí solo queda el hash de cada formato y con qué estado se generó.
+    Ver services_print.
+    """
+    invoice = models.OneToOneField(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name="rendition",
+    )
+    # versión de la plantilla + estado y estado de cobro (salen en el documento)
+    fingerprint = models.CharField(max_length=64)
+    html_sha256 = models.CharField(max_length=64, blank=True, default="")
+    pdf_sha256 = models.CharField(max_length=64, blank=True, default="")
+    rendered_at = models.DateTimeField(auto_now=True)
 
 
 class Payment(OrgScopedModel):
@@ -192,6 +259,15 @@ class Payment(OrgScopedModel):
     )
     notes = models.CharField(max_length=240, blank=True, default="")
 
+    class Meta:
+        indexes = [
+            # subquery "pagado a fecha" por factura: invoice + date, amount incluido
+            models.Index(fields=["invoice", "date"], include=["amount"], name="sales_pay_inv_date_cov"),
+            # también sirve al listado paginado por cursor (-date, -id)
+            models.Index(fields=["org", "date"], include=["amount"], name="sales_pay_org_date_cov"),
+            BrinIndex(fields=["date"], name="sales_pay_date_brin", autosummarize=True),
+        ]
+
 class Quote(OrgScopedModel):
     STATUS_CHOICES = (
         ("draft", "Draft"),
@@ -212,6 +288,8 @@ class Quote(OrgScopedModel):
     totals_base = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
     totals_tax = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
     total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    # Bases por tipo de IVA, igual que Invoice.tax_bases
+    tax_bases = models.JSONField(default=dict, blank=True)
 
     # vínculo opcional a la factura generada
     invoice = models.ForeignKey(
@@ -224,6 +302,10 @@ class Quote(OrgScopedModel):
 
     class Meta:
         unique_together = ("org", "number")
+        indexes = [
+            # listado paginado por cursor (keyset_ordering = -date, -id)
+            models.Index(fields=["org", "date", "id"], name="sales_quote_org_date_id"),
+        ]
 
     def __str__(self):
         return f"{self.number} ({self.customer_id})"
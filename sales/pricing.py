@@ -1,28 +1,190 @@
 # sales/pricing.py
+"""
+Motor de precios compartido (ventas, compras y scripts de datos).
+
+Todo se calcula en céntimos enteros, sin cuantizar Decimal línea a línea:
+
+- Cada valor se convierte a fracción exacta (Decimal.as_integer_ratio) y la
+  base de la línea en céntimos es qty * unit_price * (100 - discount_pct),
+  redondeada UNA vez a entero con ROUND_HALF_EVEN.
+- Las bases se acumulan por tipo de IVA (en centésimas: 21.00 -> 2100) y la
+  cuota sale de sum(base * tipo) / 10000, también redondeada una vez.
+
+Da exactamente los mismos importes que la aritmética Decimal anterior
+(sales.tests.PricingEngineTests lo comprueba con casos aleatorios); solo
+difiere si un producto intermedio supera las 28 cifras del contexto
+Decimal, donde el cálculo entero es el exacto.
+
+- price_documents / price_rows: API por lotes con columnas paralelas (una
+  posición por línea) o filas de un values_list, de muchos documentos a la vez.
+- line_base / bases_por_iva / add_to_bases / totals_from_bases: API por
+  documento sobre dicts de líneas (mismo motor).
+- line_totals: base, cuota y total de una línea (compras guarda la cuota
+  por línea).
+"""
 from decimal import Decimal, ROUND_HALF_EVEN
 
+_ZERO = Decimal("0.00")
+
 def money(x):
     if not isinstance(x, Decimal):
         x = Decimal(str(x))
     return x.quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)
 
-def compute_invoice_totals(lines):
+# --------------------------------------------------------------- céntimos
+
+def _ratio(x):
+    """Valor -> (numerador, denominador) exactos."""
+    if isinstance(x, int):
+        return x, 1
+    if not isinstance(x, Decimal):
+        x = Decimal(str(x))
+    return x.as_integer_ratio()
+
+def _div_half_even(n: int, d: int) -> int:
+    """n / d redondeado al entero más cercano, empates al par (d > 0)."""
+    q, r = divmod(n, d)
+    r2 = 2 * r
+    if r2 > d or (r2 == d and q & 1):
+        q += 1
+    return q
+
+def _line_cents(qty, unit_price, discount_pct) -> int:
+    qn, qd = _ratio(qty)
+    un, ud = _ratio(unit_price)
+    dn, dd = _ratio(discount_pct or 0)
+    return _div_half_even(qn * un * (100 * dd - dn), qd * ud * dd)
+
+def _rate_units(rate) -> int:
+    """Tipo de IVA en centésimas (21.00 -> 2100), redondeado como rate_key."""
+    rn, rd = _ratio(rate)
+    return _div_half_even(rn * 100, rd)
+
+def _tax_cents(bases: dict) -> int:
+    """bases {centésimas del tipo: céntimos} -> cuota total en céntimos."""
+    return _div_half_even(sum(cents * rate for rate, cents in bases.items()), 10000)
+
+def _text(units: int) -> str:
+    """Céntimos -> "12.34" (lo mismo que str(_decimal(units)), sin crear el Decimal)."""
+    sign = "-" if units < 0 else ""
+    whole, cents = divmod(abs(units), 100)
+    return f"{sign}{whole}.{cents:02d}"
+
+def _decimal(units: int) -> Decimal:
+    """Céntimos (o centésimas) -> Decimal con dos decimales."""
+    return Decimal(units).scaleb(-2)
+
+# -------------------------------------------------------------- por lotes
+
+def price_documents(doc_ids, qty, unit_price, discount_pct, tax_rate, *, include=()):
+    """
+    Precios de muchos documentos a la vez. Recibe columnas paralelas, una
+    posición por línea (p.ej. zip(*values_list("invoice_id", "qty", ...))).
+
+    Devuelve {doc_id: (tax_bases, totals_base, totals_tax, total)}, con
+    tax_bases ya en formato JSON (dump_bases). Los ids de `include` sin
+    líneas salen con totales a cero.
+    """
+    rates = {}
+    cents_by_doc = {doc_id: {} for doc_id in include}
+    for doc_id, q, u, d, r in zip(doc_ids, qty, unit_price, discount_pct, tax_rate, strict=True):
+        rate = rates.get(r)
+        if rate is None:
+            rate = rates[r] = _rate_units(r)
+        qn, qd = q.as_integer_ratio() if type(q) is Decimal else _ratio(q)
+        un, ud = u.as_integer_ratio() if type(u) is Decimal else _ratio(u)
+        if d:
+            dn, dd = _ratio(d)
+            n, den = qn * un * (100 * dd - dn), qd * ud * dd
+        else:
+            n, den = qn * un * 100, qd * ud
+        # _div_half_even en línea (bucle caliente)
+        cents, rem = divmod(n, den)
+        rem *= 2
+        if rem > den or (rem == den and cents & 1):
+            cents += 1
+
+        bases = cents_by_doc.get(doc_id)
+        if bases is None:
+            bases = cents_by_doc[doc_id] = {}
+        bases[rate] = bases.get(rate, 0) + cents
+
+    out = {}
+    for doc_id, bases in cents_by_doc.items():
+        base = sum(bases.values())
+        tax = _tax_cents(bases)
+        tax_bases = {_text(rate): _text(cents) for rate, cents in bases.items() if cents}
+        out[doc_id] = (dict(sorted(tax_bases.items())), _decimal(base), _decimal(tax), _decimal(base + tax))
+    return out
+
+def price_rows(rows, *, include=()):
+    """price_documents sobre filas (doc_id, qty, unit_price, discount_pct, tax_rate), p.ej. un values_list."""
+    columns = list(zip(*rows)) or [()] * 5
+    return price_documents(*columns, include=include)
+
+# ---------------------------------------------------------- por documento
+
+def line_base(ln):
+    """
+    Base imponible (redondeada) de una línea: qty * unit_price * (1 - discount_pct/100).
+    """
+    return _decimal(_line_cents(ln["qty"], ln["unit_price"], ln.get("discount_pct", 0)))
+
+def line_totals(qty, unit_price, tax_rate, discount_pct=0):
+    """(base, cuota, total) de una línea, con la cuota redondeada por línea."""
+    base = _line_cents(qty, unit_price, discount_pct)
+    tax = _tax_cents({_rate_units(tax_rate): base})
+    return _decimal(base), _decimal(tax), _decimal(base + tax)
+
+def rate_key(rate) -> str:
+    """Clave estable del tipo de IVA en bases_por_iva (p.ej. "21.00")."""
+    return str(_decimal(_rate_units(rate)))
+
+def bases_por_iva(lines):
     """
     lines: iterable de dicts con keys: qty, unit_price, discount_pct, tax_rate
+    Devuelve {"21.00": Decimal(base), ...}
     """
-    bases_por_iva = {}
+    cents = {}
     for ln in lines:
-        qty = Decimal(str(ln["qty"]))
-        unit = Decimal(str(ln["unit_price"]))
-        disc = Decimal(str(ln.get("discount_pct", 0)))
-        rate = Decimal(str(ln["tax_rate"]))
-        base_line = qty * unit * (Decimal("1.00") - disc / Decimal("100"))
-        base_line = money(base_line)
-        bases_por_iva[rate] = bases_por_iva.get(rate, Decimal("0.00")) + base_line
-
-    total_base = sum(bases_por_iva.values(), Decimal("0.00"))
-    total_tax = sum((b * r / Decimal("100") for r, b in bases_por_iva.items()), Decimal("0.00"))
-    total_base = money(total_base)
-    total_tax = money(total_tax)
-    total = money(total_base + total_tax)
-    return total_base, total_tax, total
+        rate = _rate_units(ln["tax_rate"])
+        cents[rate] = cents.get(rate, 0) + _line_cents(ln["qty"], ln["unit_price"], ln.get("discount_pct", 0))
+    return {str(_decimal(rate)): _decimal(value) for rate, value in cents.items()}
+
+def add_to_bases(bases, lines, sign=1):
+    """
+    Suma (sign=1) o resta (sign=-1) las bases de `lines` en `bases`, en sitio.
+    Los tipos que se quedan a 0 se eliminan.
+    """
+    for ln in lines:
+        key = rate_key(ln["tax_rate"])
+        value = bases.get(key, _ZERO) + sign * line_base(ln)
+        if value:
+            bases[key] = value
+        else:
+            bases.pop(key, None)
+    return bases
+
+def totals_from_bases(bases):
+    """bases_por_iva (importes de dos decimales) -> (base, cuota, total)."""
+    cents = {}
+    for rate, value in bases.items():
+        units = _rate_units(rate)
+        vn, vd = _ratio(value)
+        cents[units] = cents.get(units, 0) + _div_half_even(vn * 100, vd)
+    base = sum(cents.values())
+    tax = _tax_cents(cents)
+    return _decimal(base), _decimal(tax), _decimal(base + tax)
+
+def dump_bases(bases) -> dict:
+    """bases_por_iva -> JSON (Invoice.tax_bases / Quote.tax_bases)."""
+    return {r: str(b) for r, b in sorted(bases.items()) if b}
+
+def load_bases(data) -> dict:
+    return {r: Decimal(b) for r, b in (data or {}).items()}
+
+def compute_invoice_totals(lines):
+    """
+    lines: iterable de dicts con keys: qty, unit_price, discount_pct, tax_rate
+    """
+    return totals_from_bases(bases_por_iva(lines))
@@ -10,6 +10,24 @@ class ContactMiniSerializer(serializers.ModelSerializer):
         fields = ["id", "razon_social", "nombre", "apellidos"]
 
 
+class SparseFieldsMixin:
+    """
+    Serializers de listado: los campos de Meta.expandable (anidados) solo
+    salen si vienen en context["expand"], y con context["fields"] se limita
+    la salida a esos campos (más los expandidos).
+    La vista valida los nombres y hace prefetch solo de lo expandido.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand = self.context.get("expand") or ()
+        only = self.context.get("fields")
+        return {
+            name: field for name, field in fields.items()
+            if (name not in self.Meta.expandable or name in expand)
+            and (not only or name in only or name in expand)
+        }
+
 
 class DeliveryNoteLineSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
@@ -92,6 +110,7 @@ class InvoiceSerializer(serializers.ModelSerializer):
             "totals_base",
             "totals_tax",
             "total",
+            "tax_bases",
             "verifactu_status",
             "verifactu_hash",
             "verifactu_sent_at",
@@ -102,7 +121,8 @@ class InvoiceSerializer(serializers.ModelSerializer):
             "number": {
                 "required": False,
                 "allow_null": True,
-            }
+            },
+            "tax_bases": {"read_only": True},
         }
 
 
@@ -111,6 +131,35 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = ["id", "invoice", "amount", "date", "method", "notes"]
 
+
+class InvoiceListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Listado de facturas: cabecera; líneas y cobros con ?expand=lines,payments."""
+    customer_detail = ContactMiniSerializer(source="customer", read_only=True)
+    lines = InvoiceLineSerializer(many=True, read_only=True)
+    payments = PaymentSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Invoice
+        fields = [
+            "id",
+            "series",
+            "number",
+            "date_issue",
+            "due_date",
+            "customer",
+            "customer_detail",
+            "status",
+            "payment_status",
+            "currency",
+            "totals_base",
+            "totals_tax",
+            "total",
+            "verifactu_status",
+            "lines",
+            "payments",
+        ]
+        expandable = ("lines", "payments")
+
 class QuoteLineSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
 
@@ -132,7 +181,7 @@ class QuoteLineSerializer(serializers.ModelSerializer):
 class QuoteSerializer(serializers.ModelSerializer):
     customer_detail = ContactMiniSerializer(source="customer", read_only=True)
     lines = QuoteLineSerializer(many=True, read_only=True)
-    invoice_id = serializers.IntegerField(source="invoice.id", read_only=True)
+    invoice_id = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Quote
@@ -149,6 +198,7 @@ class QuoteSerializer(serializers.ModelSerializer):
             "totals_base",
             "totals_tax",
             "total",
+            "tax_bases",
             "invoice_id",
             "lines",
         ]
@@ -157,5 +207,32 @@ class QuoteSerializer(serializers.ModelSerializer):
                 "required": False,
                 "allow_blank": True,
                 "allow_null": True,
-            }
-        }
\ No newline at end of file
+            },
+            "tax_bases": {"read_only": True},
+        }
+
+
+class QuoteListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Listado de presupuestos: cabecera; líneas con ?expand=lines."""
+    customer_detail = ContactMiniSerializer(source="customer", read_only=True)
+    lines = QuoteLineSerializer(many=True, read_only=True)
+    invoice_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Quote
+        fields = [
+            "id",
+            "number",
+            "date",
+            "valid_until",
+            "customer",
+            "customer_detail",
+            "status",
+            "currency",
+            "totals_base",
+            "totals_tax",
+            "total",
+            "invoice_id",
+            "lines",
+        ]
+        expandable = ("lines",)
@@ -3,9 +3,12 @@ from decimal import Decimal
 from django.db import transaction
 from rest_framework.exceptions import ValidationError
 
-from inventory import services as inv_services
+from inventory import services_reservations as inv_reservations
 from .models import DeliveryNote, DeliveryNoteLine
 
+# ref_type de las reservas y movimientos de stock de albaranes
+RESERVATION_REF = "DN"
+
 
 @transaction.atomic
 def add_line(
@@ -33,23 +36,45 @@ def add_line(
     )
 
 
+def _stock_lines(dn: DeliveryNote):
+    """(line_id, product_id, warehouse_id, qty, uom) de las líneas con producto."""
+    return [
+        (ln.id, ln.product_id, dn.warehouse_id, ln.qty, ln.product.uom)
+        for ln in dn.lines.select_related("product").order_by("id")
+        if ln.product
+    ]
+
+
+@transaction.atomic
+def reserve(dn: DeliveryNote, *, user, ttl=inv_reservations.DEFAULT_TTL):
+    """Reserva en el almacén del albarán el stock de sus líneas (sustituye las reservas previas)."""
+    if dn.status != "draft":
+        raise ValidationError("El albarán ya está confirmado")
+    # las líneas sin cantidad no se reservan: su reserva previa se libera
+    lines = [line[:4] for line in _stock_lines(dn) if line[3] > 0]
+    try:
+        inv_reservations.release(dn.org, user, RESERVATION_REF, dn.id, keep_line_ids=[ln[0] for ln in lines])
+        return inv_reservations.hold(dn.org, user, RESERVATION_REF, dn.id, lines, ttl=ttl)
+    except ValueError as exc:
+        raise ValidationError(str(exc))
+
+
+def release_reservations(dn: DeliveryNote, *, user) -> int:
+    return inv_reservations.release(dn.org, user, RESERVATION_REF, dn.id)
+
+
 @transaction.atomic
 def confirm(dn: DeliveryNote, *, user):
     if dn.status != "draft":
         raise ValidationError("El albarán ya está confirmado")
-    # salida de stock por cada línea con producto
-    for ln in dn.lines.select_related("product"):
-        if ln.product:
-            inv_services.confirm_outgoing(
-                org=dn.org,
-                user=user,
-                product_id=ln.product_id,
-                warehouse_id=dn.warehouse_id,
-                qty=ln.qty,
-                reason="sale",
-                ref_type="DN",
-                ref_id=str(dn.id),
-            )
+    # salida de stock de todas las líneas con producto en un solo lote,
+    # consumiendo las reservas del albarán; las que queden (líneas borradas
+    # o sin producto) se liberan
+    try:
+        inv_reservations.consume(dn.org, user, RESERVATION_REF, dn.id, _stock_lines(dn), reason="sale")
+        inv_reservations.release(dn.org, user, RESERVATION_REF, dn.id)
+    except ValueError as exc:
+        raise ValidationError(str(exc))
     dn.status = "done"
     dn.save(update_fields=["status"])
     return dn
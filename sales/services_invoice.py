@@ -1,12 +1,16 @@
 # sales/services_invoice.py
 from decimal import Decimal
 from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from rest_framework.exceptions import ValidationError
 
 from .models import Invoice, InvoiceLine
-from .services_numbering import next_invoice_number
-from .pricing import compute_invoice_totals
-from integrations.utils import trigger_webhook_event
+from inventory.models import Product
+from .services_numbering import next_invoice_number, reserve_invoice_numbers
+from .pricing import price_rows
+from .services_lines import TOTALS_FIELDS, apply_line_changes, line_pricing, lock_bases, replace_document_lines
+from integrations.utils import trigger_webhook_event, trigger_webhook_events
+from analytics.hooks import register_invoice_posted, register_invoices_posted
 
 @transaction.atomic
 def add_line(
@@ -22,7 +26,8 @@ def add_line(
 ):
     if inv.status != "draft":
         raise ValidationError("La factura no está en borrador")
-    return InvoiceLine.objects.create(
+    bases = lock_bases(inv)
+    line = InvoiceLine.objects.create(
         invoice=inv,
         product=product,
         description=description or (product.name if product else ""),
@@ -32,50 +37,87 @@ def add_line(
         tax_rate=tax_rate,
         discount_pct=discount_pct,
     )
+    # Totales incrementales: solo suma la base de esta línea
+    apply_line_changes(inv, bases, added=[line_pricing(line)])
+    return line
+
+
+@transaction.atomic
+def remove_line(inv: Invoice, line_id):
+    if inv.status != "draft":
+        raise ValidationError("La factura no está en borrador")
+    bases = lock_bases(inv)
+    line = InvoiceLine.objects.filter(invoice=inv, pk=line_id).first()
+    if line is None:
+        raise ValidationError({"line": "Línea no encontrada en la factura."})
+    line.delete()
+    apply_line_changes(inv, bases, removed=[line_pricing(line)])
+    return inv
 
 
 @transaction.atomic
 def recompute_totals(inv: Invoice):
-    lines = inv.lines.all().values("qty", "unit_price", "discount_pct", "tax_rate")
-    total_base, total_tax, total = compute_invoice_totals(lines)
-    inv.totals_base = total_base
-    inv.totals_tax = total_tax
-    inv.total = total
-    inv.save(update_fields=["totals_base", "totals_tax", "total"])
+    """
+    Recalcula bases y totales desde todas las líneas (contabilizar,
+    verify_document_totals). El día a día va por apply_line_changes.
+    """
+    rows = inv.lines.values_list("invoice_id", "qty", "unit_price", "discount_pct", "tax_rate")
+    inv.tax_bases, inv.totals_base, inv.totals_tax, inv.total = price_rows(rows, include=[inv.id])[inv.id]
+    inv.save(update_fields=TOTALS_FIELDS)
     return inv
 
 
+def snapshot_line_costs(inv: Invoice):
+    """
+    Congela en cada línea el coste actual del producto (un único UPDATE),
+    para que el margen histórico no cambie si luego cambia cost_price.
+    """
+    _snapshot_costs(InvoiceLine.objects.filter(invoice=inv))
+
+
+def _snapshot_costs(lines_qs):
+    lines_qs.filter(product__isnull=False).update(
+        unit_cost=Subquery(Product.objects.filter(pk=OuterRef("product_id")).values("cost_price")[:1])
+    )
+
+
+def _invoice_created_payload(inv: Invoice) -> dict:
+    return {
+        "id": inv.id,
+        "org_slug": inv.org.slug,
+        "series": inv.series,
+        "number": inv.number,
+        "date_issue": inv.date_issue.isoformat() if inv.date_issue else None,
+        "customer_id": inv.customer_id,
+        "total": str(inv.total),
+        "status": inv.status,
+    }
+
+
 @transaction.atomic
 def post_invoice(inv: Invoice, *, series_default="A"):
+    # Releer bloqueada: dos peticiones con la misma factura en memoria no la contabilizan dos veces
+    inv = Invoice.objects.select_for_update().select_related("org").get(pk=inv.pk)
     if inv.status != "draft":
         raise ValidationError("La factura no está en borrador")
 
-    series = inv.series or series_default
-    year, number = next_invoice_number(inv.org, series)
-
-    inv.series = series
-    inv.number = number
+    inv.series = inv.series or series_default
     # Totales finales
     recompute_totals(inv)
     inv.status = "posted"
-    inv.save(update_fields=["series", "number", "status", "totals_base", "totals_tax", "total"])
+    inv.save(update_fields=["series", "status"])
+    snapshot_line_costs(inv)
+
+    # 🔹 gancho a analítica (hechos mensuales)
+    register_invoice_posted(inv)
+
+    # Número al final: la fila de InvoiceSequence queda bloqueada solo hasta el commit
+    _, inv.number = next_invoice_number(inv.org, inv.series, inv.date_issue.year)
+    inv.save(update_fields=["number"])
 
     # Disparar webhook: invoice.created
     try:
-        trigger_webhook_event(
-            inv.org,
-            "invoice.created",
-            {
-                "id": inv.id,
-                "org_slug": inv.org.slug,
-                "series": inv.series,
-                "number": inv.number,
-                "date_issue": inv.date_issue.isoformat() if inv.date_issue else None,
-                "customer_id": inv.customer_id,
-                "total": str(inv.total),
-                "status": inv.status,
-            },
-        )
+        trigger_webhook_event(inv.org, "invoice.created", _invoice_created_payload(inv))
     except Exception:
         # No rompemos la factura si el webhook falla
         pass
@@ -88,29 +130,112 @@ def post_invoice(inv: Invoice, *, series_default="A"):
 
     return inv
 
+MAX_POST_BATCH = 10000
+
+
+def _totals_by_invoice(invoice_ids):
+    """(tax_bases, base, cuota, total) de cada factura con una sola lectura de líneas."""
+    rows = InvoiceLine.objects.filter(invoice_id__in=invoice_ids).values_list(
+        "invoice_id", "qty", "unit_price", "discount_pct", "tax_rate"
+    )
+    return price_rows(rows.iterator(chunk_size=5000), include=invoice_ids)
+
+
+@transaction.atomic
+def post_invoices(org, invoice_ids, *, series_default="A"):
+    """
+    Contabiliza un lote de borradores de la org (facturación mensual).
+
+    - Bloquea las facturas y valida cada una; las que no se pueden
+      contabilizar se devuelven en "failed" sin abortar el lote.
+    - Un único UPDATE de InvoiceSequence por (org, serie, año de emisión) y un
+      bloque contiguo de números, asignados por fecha de emisión al final de
+      la transacción. Solo se reservan números para las válidas: sin huecos.
+    - Totales de todas con una sola lectura de líneas, bulk_update, foto de
+      costes en un UPDATE, hechos de analítica en lote y webhooks en bloque.
+
+    Devuelve {"posted": [{id, series, number, total}], "failed": [{id, error}]}.
+    """
+    ids = list(dict.fromkeys(invoice_ids))
+    if len(ids) > MAX_POST_BATCH:
+        raise ValidationError({"ids": f"Máximo {MAX_POST_BATCH} facturas por lote."})
+
+    invoices = list(
+        Invoice.objects.select_for_update()
+        .filter(org=org, id__in=ids)
+        .order_by("date_issue", "id")
+    )
+    found = {inv.id for inv in invoices}
+    failed = [{"id": inv_id, "error": "Factura no encontrada."} for inv_id in ids if inv_id not in found]
+
+    valid = []
+    for inv in invoices:
+        if inv.status != "draft":
+            failed.append({"id": inv.id, "error": "La factura no está en borrador"})
+        else:
+            valid.append(inv)
+    if not valid:
+        return {"posted": [], "failed": failed}
+
+    # (serie, año de emisión) -> facturas, en orden de fecha
+    by_sequence = {}
+    for inv in valid:
+        inv.series = inv.series or series_default
+        by_sequence.setdefault((inv.series, inv.date_issue.year), []).append(inv)
+
+    # Totales desde las líneas (una lectura). Los borradores ya los traen al
+    # día (apply_line_changes): solo se reescriben los que difieren.
+    expected = _totals_by_invoice([inv.id for inv in valid])
+    drifted = []
+    for inv in valid:
+        totals = expected[inv.id]
+        if (inv.tax_bases, inv.totals_base, inv.totals_tax, inv.total) != totals:
+            inv.tax_bases, inv.totals_base, inv.totals_tax, inv.total = totals
+            drifted.append(inv)
+        inv.status = "posted"
+
+    # bulk_update genera un CASE por fila y campo: los valores comunes van
+    # en un UPDATE por serie y el CASE se limita a number (y totales con desvío)
+    for (series, _), group in by_sequence.items():
+        Invoice.objects.filter(pk__in=[inv.pk for inv in group]).update(series=series, status="posted")
+    if drifted:
+        Invoice.objects.bulk_update(drifted, TOTALS_FIELDS, batch_size=2000)
+    _snapshot_costs(InvoiceLine.objects.filter(invoice_id__in=[inv.id for inv in valid]))
+
+    # 🔹 gancho a analítica (hechos mensuales y cohortes, en lote)
+    for inv in valid:
+        inv.org = org
+    register_invoices_posted(valid)
+
+    # Números al final, un bloque por secuencia: el bloqueo dura hasta el commit
+    for (series, year), group in by_sequence.items():
+        _, first = reserve_invoice_numbers(org, series, len(group), year=year)
+        for offset, inv in enumerate(group):
+            inv.number = first + offset
+    Invoice.objects.bulk_update(valid, ["number"], batch_size=2000)
+
+    try:
+        trigger_webhook_events(org, "invoice.created", [_invoice_created_payload(inv) for inv in valid])
+    except Exception:
+        # No rompemos el lote si el webhook falla
+        pass
+
+    return {
+        "posted": [{"id": inv.id, "series": inv.series, "number": inv.number, "total": inv.total} for inv in valid],
+        "failed": failed,
+    }
+
+
 @transaction.atomic
 def replace_lines(inv: Invoice, *, lines: list[dict]):
     """
     Reemplaza TODAS las líneas de una factura por las indicadas en `lines`.
+    Solo escribe las líneas que cambian (ver services_lines.sync_lines).
 
     Solo permitido si la factura NO está contabilizada (status != 'posted').
     """
     if inv.status == "posted":
         raise ValidationError("No se pueden modificar líneas de una factura contabilizada.")
 
-    InvoiceLine.objects.filter(invoice=inv).delete()
-
-    for ln in lines:
-        InvoiceLine.objects.create(
-            invoice=inv,
-            product=ln.get("product"),
-            description=ln.get("description", ""),
-            qty=ln.get("qty", Decimal("0")),
-            uom=ln.get("uom", "unidad"),
-            unit_price=ln.get("unit_price", Decimal("0.00")),
-            tax_rate=ln.get("tax_rate", Decimal("21.00")),
-            discount_pct=ln.get("discount_pct", Decimal("0.00")),
-        )
-
-    recompute_totals(inv)
+    replace_document_lines(inv, InvoiceLine, "invoice", lines)
     return inv
@@ -0,0 +1,146 @@
+# sales/services_kpis.py
+"""
+KPIs de ventas de un periodo (y del periodo anterior) en dos agregaciones:
+
+1) Facturas (cabeceras): nº de facturas, base, IVA y total facturado.
+2) Líneas: unidades, ingreso con descuento, coste (foto unit_cost o
+   cost_price) y margen, con las mismas expresiones que analytics.margins.
+
+Periodo actual y anterior salen de la misma query con agregados
+condicionales (SUM ... FILTER), filtrando por el rango que cubre ambos. Los
+filtros (estado, cliente, categoría) van en el WHERE y usan los índices de
+(org, status, date_issue) y (invoice, product).
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, Exists, OuterRef, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from analytics.margins import line_cogs, line_revenue
+from .models import Invoice, InvoiceLine
+
+_DEC = DecimalField(max_digits=24, decimal_places=6)
+_ZERO = Value(Decimal("0"), output_field=_DEC)
+
+STATUSES = ("draft", "posted", "cancelled")
+
+
+def previous_period(date_from, date_to):
+    """Periodo de la misma duración inmediatamente anterior."""
+    days = (date_to - date_from).days + 1
+    return date_from - timedelta(days=days), date_from - timedelta(days=1)
+
+
+def _periods(date_from, date_to, compare):
+    periods = {"current": (date_from, date_to)}
+    if compare:
+        periods["previous"] = previous_period(date_from, date_to)
+    return periods
+
+
+def _in_period(prefix, dfrom, dto):
+    q = Q()
+    if dfrom:
+        q &= Q(**{f"{prefix}date_issue__gte": dfrom})
+    if dto:
+        q &= Q(**{f"{prefix}date_issue__lte": dto})
+    return q
+
+
+def _invoice_filter(org, periods, status, customer_id, prefix=""):
+    """Filtro común de facturas (o de líneas con prefix="invoice__")."""
+    q = Q(**{f"{prefix}org": org})
+    if status:
+        q &= Q(**{f"{prefix}status": status})
+    if customer_id:
+        q &= Q(**{f"{prefix}customer_id": customer_id})
+    # rango que cubre todos los periodos pedidos
+    starts = [p[0] for p in periods.values()]
+    ends = [p[1] for p in periods.values()]
+    q &= _in_period(prefix, None if None in starts else min(starts), None if None in ends else max(ends))
+    return q
+
+
+def _metrics(invoice_row, line_row, name):
+    revenue = line_row[f"{name}_revenue"] or Decimal("0")
+    cogs = line_row[f"{name}_cogs"] or Decimal("0")
+    margin = revenue - cogs
+    return {
+        "invoices": invoice_row[f"{name}_invoices"],
+        "totals_base": invoice_row[f"{name}_base"] or Decimal("0.00"),
+        "totals_tax": invoice_row[f"{name}_tax"] or Decimal("0.00"),
+        "total": invoice_row[f"{name}_total"] or Decimal("0.00"),
+        "units": line_row[f"{name}_units"] or Decimal("0"),
+        "revenue": revenue.quantize(Decimal("0.01")),
+        "cogs": cogs.quantize(Decimal("0.01")),
+        "margin": margin.quantize(Decimal("0.01")),
+        "margin_pct": (margin / revenue).quantize(Decimal("0.0001")) if revenue else None,
+    }
+
+
+def _change(current, previous):
+    """Variación relativa (actual - anterior) / anterior de cada métrica."""
+    out = {}
+    for key, value in current.items():
+        prev = previous.get(key)
+        if key == "margin_pct" or value is None or not prev:
+            out[key] = None
+        else:
+            out[key] = ((Decimal(value) - Decimal(prev)) / abs(Decimal(prev))).quantize(Decimal("0.0001"))
+    return out
+
+
+def sales_kpis(org, date_from=None, date_to=None, *, status="posted", customer_id=None,
+               category_id=None, compare=False):
+    """
+    KPIs del periodo [date_from, date_to] y, con compare=True (requiere
+    ambas fechas), del periodo anterior de la misma duración.
+
+    Con category_id los importes de líneas (unidades, ingreso, coste, margen)
+    se limitan a esa categoría y las cabeceras (nº facturas, totales) a las
+    facturas que tienen alguna línea de ella.
+    """
+    periods = _periods(date_from, date_to, compare)
+
+    invoices = Invoice.objects.filter(_invoice_filter(org, periods, status, customer_id))
+    lines = InvoiceLine.objects.filter(
+        _invoice_filter(org, periods, status, customer_id, prefix="invoice__")
+    )
+    if category_id:
+        invoices = invoices.filter(
+            Exists(InvoiceLine.objects.filter(invoice=OuterRef("pk"), product__category_id=category_id))
+        )
+        lines = lines.filter(product__category_id=category_id)
+
+    invoice_aggs, line_aggs = {}, {}
+    for name, (dfrom, dto) in periods.items():
+        in_invoice = _in_period("", dfrom, dto)
+        in_line = _in_period("invoice__", dfrom, dto)
+        invoice_aggs.update({
+            f"{name}_invoices": Count("id", filter=in_invoice),
+            f"{name}_base": Sum("totals_base", filter=in_invoice),
+            f"{name}_tax": Sum("totals_tax", filter=in_invoice),
+            f"{name}_total": Sum("total", filter=in_invoice),
+        })
+        line_aggs.update({
+            f"{name}_units": Sum("qty", filter=in_line),
+            f"{name}_revenue": Coalesce(Sum(line_revenue(), filter=in_line), _ZERO),
+            f"{name}_cogs": Coalesce(Sum(line_cogs(), filter=in_line), _ZERO),
+        })
+
+    invoice_row = invoices.aggregate(**invoice_aggs)
+    line_row = lines.aggregate(**line_aggs)
+
+    current = _metrics(invoice_row, line_row, "current")
+    result = {
+        "period": {"from": date_from, "to": date_to},
+        "filters": {"status": status, "customer_id": customer_id, "category_id": category_id},
+        **current,
+    }
+    if compare:
+        previous = _metrics(invoice_row, line_row, "previous")
+        dfrom, dto = periods["previous"]
+        result["previous_period"] = {"from": dfrom, "to": dto, **previous}
+        result["change"] = _change(current, previous)
+    return result
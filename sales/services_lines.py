@@ -0,0 +1,189 @@
+# sales/services_lines.py
+"""
+Reemplazo de líneas en bloque para facturas y presupuestos.
+
+- parse_lines: valida el payload de la API de una vez y resuelve todos los
+  productos con una sola query (product_id IN (...)).
+- sync_lines: compara con las líneas actuales por posición y solo escribe lo
+  que cambia: bulk_update de las modificadas, bulk_create de las nuevas y un
+  DELETE de las sobrantes. Las líneas iguales no se tocan.
+- Totales incrementales: la cabecera guarda las bases por tipo de IVA
+  (tax_bases). Cada alta/baja/cambio de línea bloquea la cabecera
+  (SELECT ... FOR UPDATE) y suma/resta solo las líneas afectadas, sin releer
+  el resto. `verify_document_totals` recalcula desde cero y avisa de desvíos.
+"""
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+
+from inventory.models import Product
+from .pricing import add_to_bases, dump_bases, load_bases, totals_from_bases
+
+# Campos editables de InvoiceLine / QuoteLine (mismo esquema en ambos)
+LINE_FIELDS = ("product_id", "description", "qty", "uom", "unit_price", "tax_rate", "discount_pct")
+# Campos que afectan a las bases / totales
+PRICING_FIELDS = ("qty", "unit_price", "discount_pct", "tax_rate")
+TOTALS_FIELDS = ["tax_bases", "totals_base", "totals_tax", "total"]
+
+_DECIMAL_DEFAULTS = {
+    "qty": "0",
+    "unit_price": "0.00",
+    "tax_rate": "21.00",
+    "discount_pct": "0.00",
+}
+
+
+def parse_lines(org, raw_lines) -> list[dict]:
+    """
+    Payload de la API -> lista de dicts para sync_lines (product = objeto o None).
+    Acumula los errores de todas las líneas en un único ValidationError.
+    """
+    if not isinstance(raw_lines, list):
+        raise ValidationError("El campo 'lines' debe ser una lista.")
+
+    errors = {}
+    product_ids = set()
+    for idx, ln in enumerate(raw_lines):
+        if not isinstance(ln, dict):
+            errors[idx] = "Cada línea debe ser un objeto."
+        elif ln.get("product"):
+            try:
+                product_ids.add(int(ln["product"]))
+            except (TypeError, ValueError):
+                errors[idx] = {"product": "Id de producto inválido."}
+
+    products = Product.objects.filter(org=org, id__in=product_ids).in_bulk() if product_ids else {}
+
+    processed = []
+    for idx, ln in enumerate(raw_lines):
+        if idx in errors:
+            continue
+        line_errors = {}
+
+        product = None
+        if ln.get("product"):
+            product = products.get(int(ln["product"]))
+            if product is None:
+                line_errors["product"] = "Producto no encontrado en la organización."
+
+        values = {}
+        for name, default in _DECIMAL_DEFAULTS.items():
+            raw = ln.get(name)
+            try:
+                values[name] = Decimal(str(default if raw in (None, "") else raw))
+            except (InvalidOperation, ValueError):
+                line_errors[name] = "Debe ser un número."
+
+        if line_errors:
+            errors[idx] = line_errors
+            continue
+
+        processed.append({
+            "product": product,
+            "description": ln.get("description", "") or "",
+            "uom": ln.get("uom") or (product.uom if product else "unidad"),
+            **values,
+        })
+
+    if errors:
+        raise ValidationError({"lines": dict(sorted(errors.items()))})
+    return processed
+
+
+def _line_values(ln: dict) -> dict:
+    product = ln.get("product")
+    return {
+        "product_id": product.pk if product is not None else None,
+        "description": ln.get("description", ""),
+        "qty": ln.get("qty", Decimal("0")),
+        "uom": ln.get("uom", "unidad"),
+        "unit_price": ln.get("unit_price", Decimal("0.00")),
+        "tax_rate": ln.get("tax_rate", Decimal("21.00")),
+        "discount_pct": ln.get("discount_pct", Decimal("0.00")),
+    }
+
+
+def line_pricing(obj) -> dict:
+    """Valores de una línea (modelo) que entran en pricing.line_base."""
+    return {name: getattr(obj, name) for name in PRICING_FIELDS}
+
+
+def lock_bases(parent) -> dict:
+    """
+    Bloquea la fila de la cabecera (factura/presupuesto) y devuelve sus bases
+    por IVA actuales. Llamar dentro de la transacción, antes de tocar líneas.
+    """
+    locked = type(parent).objects.select_for_update().only("tax_bases").get(pk=parent.pk)
+    return load_bases(locked.tax_bases)
+
+
+def apply_line_changes(parent, bases: dict, *, added=(), removed=()):
+    """
+    Ajusta `bases` con las líneas añadidas/quitadas (dicts de pricing) y
+    guarda bases + totales en la cabecera. Coste O(líneas afectadas).
+    """
+    add_to_bases(bases, removed, sign=-1)
+    add_to_bases(bases, added)
+    parent.tax_bases = dump_bases(bases)
+    parent.totals_base, parent.totals_tax, parent.total = totals_from_bases(bases)
+    parent.save(update_fields=TOTALS_FIELDS)
+    return parent
+
+
+def sync_lines(parent, line_model, fk_name: str, lines: list[dict]):
+    """
+    Deja las líneas de `parent` (factura/presupuesto) iguales a `lines`.
+    La línea i del payload se compara con la i-ésima línea actual (por id).
+
+    Devuelve (añadidas, quitadas, stats): añadidas/quitadas son los valores de
+    pricing que entran/salen de las bases (una línea modificada sale con sus
+    valores viejos y entra con los nuevos).
+    """
+    existing = list(line_model.objects.filter(**{fk_name: parent}).order_by("id"))
+    wanted = [_line_values(ln) for ln in lines]
+
+    to_update, changed_fields, unchanged = [], set(), 0
+    added, removed = [], []
+    for obj, values in zip(existing, wanted):
+        diff = {name for name, value in values.items() if getattr(obj, name) != value}
+        if not diff:
+            unchanged += 1
+            continue
+        if diff.intersection(PRICING_FIELDS):
+            removed.append(line_pricing(obj))
+            added.append({name: values[name] for name in PRICING_FIELDS})
+        for name in diff:
+            setattr(obj, name, values[name])
+        changed_fields |= diff
+        to_update.append(obj)
+
+    to_create = [line_model(**{fk_name: parent}, **values) for values in wanted[len(existing):]]
+    to_delete = existing[len(wanted):]
+    added.extend({name: values[name] for name in PRICING_FIELDS} for values in wanted[len(existing):])
+    removed.extend(line_pricing(obj) for obj in to_delete)
+
+    if to_update:
+        line_model.objects.bulk_update(to_update, sorted(changed_fields))
+    if to_create:
+        line_model.objects.bulk_create(to_create)
+    if to_delete:
+        line_model.objects.filter(pk__in=[obj.pk for obj in to_delete]).delete()
+
+    # El prefetch de get_object() ya no es válido
+    getattr(parent, "_prefetched_objects_cache", {}).pop("lines", None)
+
+    stats = {
+        "created": len(to_create),
+        "updated": len(to_update),
+        "deleted": len(to_delete),
+        "unchanged": unchanged,
+    }
+    return added, removed, stats
+
+
+def replace_document_lines(parent, line_model, fk_name: str, lines: list[dict]):
+    """sync_lines + bases/totales incrementales, con la cabecera bloqueada."""
+    bases = lock_bases(parent)
+    added, removed, stats = sync_lines(parent, line_model, fk_name, lines)
+    apply_line_changes(parent, bases, added=added, removed=removed)
+    return stats
@@ -1,22 +1,59 @@
 # sales/services_numbering.py
-from django.db import transaction
+"""
+Numeración de facturas sin huecos.
+
+El número sale de InvoiceSequence (una fila por org + serie + año de la
+fecha de emisión) con un único UPDATE last_number = last_number + n. Ese
+UPDATE bloquea la fila hasta el commit, así que se llama como ÚLTIMO paso de
+la transacción de contabilizar: el bloqueo dura solo lo que tarda el commit
+y no todo el trabajo previo (totales, analítica...). Si la transacción se
+deshace, el incremento se deshace con ella: nunca quedan huecos.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.utils import timezone
 
 from .models import InvoiceSequence
 
 
+def _sequence_id(org, series: str, year: int) -> int:
+    """
+    Id de la secuencia, creándola si no existe. Sin bloqueo: la unicidad
+    (org, series, year) resuelve la carrera de dos primeras facturas.
+    """
+    seq_id = (
+        InvoiceSequence.objects.filter(org=org, series=series, year=year)
+        .values_list("id", flat=True)
+        .first()
+    )
+    if seq_id is not None:
+        return seq_id
+    try:
+        with transaction.atomic():
+            return InvoiceSequence.objects.create(org=org, series=series, year=year, last_number=0).id
+    except IntegrityError:
+        return InvoiceSequence.objects.get(org=org, series=series, year=year).id
+
+
 @transaction.atomic
-def next_invoice_number(org, series: str):
+def reserve_invoice_numbers(org, series: str, count: int, *, year: int | None = None):
+    """
+    Reserva un bloque contiguo de `count` números de la serie/año.
+    Devuelve (year, primer número del bloque).
+
+    Llamar dentro de la transacción que contabiliza y lo más tarde posible:
+    la fila de la secuencia queda bloqueada hasta el commit.
+    """
+    year = year or timezone.now().year
+    seq_id = _sequence_id(org, series, year)
+    InvoiceSequence.objects.filter(pk=seq_id).update(last_number=F("last_number") + count)
+    last = InvoiceSequence.objects.filter(pk=seq_id).values_list("last_number", flat=True).get()
+    return year, last - count + 1
+
+
+@transaction.atomic
+def next_invoice_number(org, series: str, year: int | None = None):
     """
     Devuelve (year, number) para la siguiente factura de esa serie.
     """
-    year = timezone.now().year
-    seq, _ = InvoiceSequence.objects.select_for_update().get_or_create(
-        org=org,
-        series=series,
-        year=year,
-        defaults={"last_number": 0},
-    )
-    seq.last_number += 1
-    seq.save(update_fields=["last_number"])
-    return year, seq.last_number
+    return reserve_invoice_numbers(org, series, 1, year=year)
@@ -6,6 +6,7 @@ from rest_framework.exceptions import ValidationError
 
 from .models import Payment, Invoice
 from integrations.utils import trigger_webhook_event
+from analytics.hooks import register_invoice_payment_created
 
 @transaction.atomic
 def register_payment(inv: Invoice, *, amount: Decimal, date, method: str, notes=""):
@@ -31,6 +32,9 @@ def register_payment(inv: Invoice, *, amount: Decimal, date, method: str, notes=
         inv.payment_status = "paid"
     inv.save(update_fields=["payment_status"])
 
+    # 🔹 gancho a analítica
+    register_invoice_payment_created(pay)
+
     # Disparar webhook solo cuando queda totalmente pagada
     if inv.payment_status == "paid":
         try:
@@ -0,0 +1,349 @@
+# sales/services_print.py
+"""
+Impresión de facturas: HTML (plantilla sales/invoice_print.html) y PDF
+(reportlab).
+
+Una factura que ya no es borrador no cambia, así que cada formato se genera
+una sola vez (en la primera petición) y se guarda por contenido en el storage
+de media: org/<org_id>/sales/invoices/<sha256[:2]>/<sha256>.<ext>.
+InvoiceRendition guarda los hashes (que sirven también de ETag) y una huella
+de lo que sí puede cambiar y sale en el documento: estado, estado de cobro y
+RENDER_VERSION. Si la huella no coincide se vuelve a generar.
+
+Los borradores se generan en cada petición y no se guardan.
+"""
+import hashlib
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from .models import Invoice, InvoiceRendition
+from .pricing import line_base
+
+# Subir al cambiar la plantilla o el PDF: invalida todo lo generado
+RENDER_VERSION = 1
+
+TEMPLATE_NAME = "sales/invoice_print.html"
+CONTENT_TYPES = {"html": "text/html; charset=utf-8", "pdf": "application/pdf"}
+
+# Por debajo de esto los PDFs que faltan se generan en el propio proceso
+_POOL_MIN_PENDING = 8
+_POOL_CHUNK = 25
+# Máximo de facturas por ZIP
+MAX_ZIP_INVOICES = 5000
+
+
+@dataclass
+class PrintedDocument:
+    """Documento listo para servir: `path` en el storage o `content` en memoria."""
+    fmt: str
+    sha256: str
+    path: str | None = None
+    content: bytes | None = None
+    last_modified: datetime | None = None
+
+
+def fingerprint(status: str, payment_status: str) -> str:
+    return f"{RENDER_VERSION}:{status}:{payment_status}"
+
+
+def storage_path(org_id, sha256: str, fmt: str) -> str:
+    return f"org/{org_id}/sales/invoices/{sha256[:2]}/{sha256}.{fmt}"
+
+# ----------------------------------------------------------------- render
+
+def _display_contact_name(c):
+    if not c:
+        return ""
+    if c.razon_social:
+        return c.razon_social
+    full = f"{(c.nombre or '').strip()} {(c.apellidos or '').strip()}".strip()
+    if full:
+        return full
+    if c.nombre_comercial:
+        return c.nombre_comercial
+    return ""
+
+
+def print_context(invoice: Invoice) -> dict:
+    """Contexto de la plantilla. `invoice` con org, customer y lines cargados."""
+    lines = [
+        {
+            "description": ln.description,
+            "uom": ln.uom,
+            "qty": ln.qty,
+            "unit_price": ln.unit_price,
+            "tax_rate": ln.tax_rate,
+            "discount_pct": ln.discount_pct,
+            # base de línea ya con descuento (motor común de pricing)
+            "base": line_base({"qty": ln.qty, "unit_price": ln.unit_price, "discount_pct": ln.discount_pct}),
+        }
+        for ln in invoice.lines.all()
+    ]
+    return {
+        "invoice": invoice,
+        "org": invoice.org,
+        "customer": invoice.customer,
+        "customer_display_name": _display_contact_name(invoice.customer),
+        "lines": lines,
+    }
+
+
+def render_html(invoice: Invoice) -> bytes:
+    return render_to_string(TEMPLATE_NAME, print_context(invoice)).encode("utf-8")
+
+
+def render_pdf(invoice: Invoice) -> bytes:
+    """Mismo contenido que la plantilla HTML, en A4 con reportlab."""
+    ctx = print_context(invoice)
+    currency = invoice.currency
+    buf = BytesIO()
+    # invariant: sin fecha ni id aleatorio -> mismo PDF, mismo hash
+    c = canvas.Canvas(buf, pagesize=A4, invariant=1)
+    c.setTitle(f"Factura {invoice.series}{invoice.number or ''}")
+    width, height = A4
+    left, right = 40, width - 40
+
+    def header():
+        y = height - 50
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(left, y, f"Factura {invoice.series}{invoice.number or ''}")
+        c.setFont("Helvetica", 9)
+        c.drawString(left, y - 16, f"Fecha de emisión: {invoice.date_issue:%d/%m/%Y}")
+        c.drawString(left, y - 28, f"Estado: {invoice.status}")
+
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(300, y, "Empresa")
+        c.drawString(440, y, "Cliente")
+        c.setFont("Helvetica", 9)
+        c.drawString(300, y - 14, ctx["org"].name[:28])
+        customer = ctx["customer"]
+        info = [ctx["customer_display_name"] or "(sin datos de cliente)"]
+        if customer is not None:
+            if customer.documento_id:
+                info.append(f"CIF/NIF: {customer.documento_id}")
+            if customer.email:
+                info.append(customer.email)
+            if customer.telefono:
+                info.append(f"Tel: {customer.telefono}")
+        for i, text in enumerate(info):
+            c.drawString(440, y - 14 - 12 * i, text[:26])
+        y -= 80
+        if invoice.billing_address:
+            c.drawString(left, y, f"Dirección de facturación: {invoice.billing_address}"[:110])
+            y -= 18
+        return y
+
+    columns = (
+        ("Descripción", left, "l"), ("Uds", 250, "l"), ("Cant.", 340, "r"), (f"Precio ({currency})", 410, "r"),
+        ("Dto. %", 455, "r"), ("IVA %", 500, "r"), (f"Importe ({currency})", right, "r"),
+    )
+
+    def row(y, values, bold=False):
+        c.setFont("Helvetica-Bold" if bold else "Helvetica", 8)
+        for (_, x, align), value in zip(columns, values):
+            (c.drawString if align == "l" else c.drawRightString)(x, y, value)
+
+    y = header()
+    row(y, [title for title, _, _ in columns], bold=True)
+    y -= 14
+    if not ctx["lines"]:
+        row(y, ["No hay líneas en esta factura."])
+        y -= 12
+    for ln in ctx["lines"]:
+        if y < 120:
+            c.showPage()
+            y = header()
+            row(y, [title for title, _, _ in columns], bold=True)
+            y -= 14
+        row(y, [
+            (ln["description"] or "")[:45], ln["uom"], str(ln["qty"]), f"{ln['unit_price']:.2f}",
+            f"{ln['discount_pct']:.2f}", f"{ln['tax_rate']:.2f}", f"{ln['base']:.2f}",
+        ])
+        y -= 12
+
+    y -= 10
+    for label, value, bold in (
+        ("Base imponible", invoice.totals_base, False),
+        ("IVA", invoice.totals_tax, False),
+        ("Total factura", invoice.total, True),
+    ):
+        c.setFont("Helvetica-Bold" if bold else "Helvetica", 9)
+        c.drawRightString(440, y, label)
+        c.drawRightString(right, y, f"{value:.2f} {currency}")
+        y -= 14
+
+    c.setFont("Helvetica", 8)
+    c.drawString(left, 50, f"Estado de cobro: {invoice.payment_status}")
+    c.drawString(left, 38, "Documento generado desde el ERP.")
+    c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+RENDERERS = {"html": render_html, "pdf": render_pdf}
+
+# ---------------------------------------------------------------- caché
+
+def _store(org_id, fmt: str, content: bytes) -> str:
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = storage_path(org_id, sha256, fmt)
+    if not default_storage.exists(path):
+        default_storage.save(path, ContentFile(content))
+    return sha256
+
+
+def _save_rendition(invoice_id, org_id, fp: str, hashes: dict):
+    """Guarda/actualiza los hashes; una huella distinta descarta los anteriores."""
+    values = {f"{fmt}_sha256": sha256 for fmt, sha256 in hashes.items()}
+    now = timezone.now()  # update() no aplica auto_now
+    updated = (
+        InvoiceRendition.objects.filter(invoice_id=invoice_id, fingerprint=fp).update(rendered_at=now, **values)
+        or InvoiceRendition.objects.filter(invoice_id=invoice_id).update(
+            fingerprint=fp, rendered_at=now, **{"html_sha256": "", "pdf_sha256": "", **values}
+        )
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                InvoiceRendition.objects.create(invoice_id=invoice_id, org_id=org_id, fingerprint=fp, **values)
+        except IntegrityError:
+            # otra petición la creó a la vez: nos quedamos con la suya
+            pass
+
+
+def _load_invoice(org, pk) -> Invoice:
+    return (
+        Invoice.objects.select_related("org", "customer")
+        .prefetch_related("lines")
+        .get(org=org, pk=pk)
+    )
+
+
+def get_document(org, pk, fmt: str) -> PrintedDocument:
+    """
+    Documento `fmt` ("html" / "pdf") de la factura `pk` de `org`.
+    Con la impresión ya generada cuesta una query y no lee el fichero
+    (la vista decide si basta con un 304). Lanza Invoice.DoesNotExist.
+    """
+    meta = (
+        Invoice.objects.filter(org=org, pk=pk)
+        .values("status", "payment_status", "rendition__fingerprint", f"rendition__{fmt}_sha256", "rendition__rendered_at")
+        .get()
+    )
+    fp = fingerprint(meta["status"], meta["payment_status"])
+    sha256 = meta[f"rendition__{fmt}_sha256"]
+    if meta["status"] != "draft" and meta["rendition__fingerprint"] == fp and sha256:
+        path = storage_path(org.id, sha256, fmt)
+        if default_storage.exists(path):
+            return PrintedDocument(fmt, sha256, path=path, last_modified=meta["rendition__rendered_at"])
+
+    invoice = _load_invoice(org, pk)
+    content = RENDERERS[fmt](invoice)
+    if invoice.status == "draft":
+        return PrintedDocument(fmt, hashlib.sha256(content).hexdigest(), content=content)
+
+    sha256 = _store(org.id, fmt, content)
+    _save_rendition(invoice.id, org.id, fp, {fmt: sha256})
+    return PrintedDocument(fmt, sha256, path=storage_path(org.id, sha256, fmt), last_modified=timezone.now())
+
+# --------------------------------------------------------------- en lote
+
+def _render_pdf_chunk(org_id, invoice_ids):
+    """Genera y guarda los PDFs de `invoice_ids` (proceso del pool)."""
+    invoices = (
+        Invoice.objects.select_related("org", "customer")
+        .prefetch_related("lines")
+        .filter(org_id=org_id, id__in=invoice_ids)
+    )
+    return [
+        (inv.id, fingerprint(inv.status, inv.payment_status), _store(org_id, "pdf", render_pdf(inv)))
+        for inv in invoices
+    ]
+
+
+def ensure_pdfs(org, invoices) -> dict:
+    """
+    {invoice_id: (ruta del PDF, nombre de fichero)} de las facturas no borrador
+    del queryset `invoices` (de `org`), por fecha y número. Las que no tienen
+    PDF al día se generan en un pool de procesos (SALES_PRINT_WORKERS) si son
+    bastantes.
+    """
+    rows = list(
+        invoices.filter(org=org).exclude(status="draft")
+        .order_by("date_issue", "series", "number")
+        .values("id", "series", "number", "status", "payment_status", "rendition__fingerprint", "rendition__pdf_sha256")
+    )
+    pending = [
+        r["id"] for r in rows
+        if r["rendition__fingerprint"] != fingerprint(r["status"], r["payment_status"]) or not r["rendition__pdf_sha256"]
+    ]
+
+    rendered = []
+    chunks = [pending[i:i + _POOL_CHUNK] for i in range(0, len(pending), _POOL_CHUNK)]
+    workers = min(settings.SALES_PRINT_WORKERS, len(chunks))
+    if len(pending) >= _POOL_MIN_PENDING and workers > 1:
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=django.setup) as pool:
+            for result in pool.map(_render_pdf_chunk, [org.id] * len(chunks), chunks):
+                rendered.extend(result)
+    else:
+        for chunk in chunks:
+            rendered.extend(_render_pdf_chunk(org.id, chunk))
+
+    hashes = {r["id"]: r["rendition__pdf_sha256"] for r in rows}
+    for invoice_id, fp, sha256 in rendered:
+        _save_rendition(invoice_id, org.id, fp, {"pdf": sha256})
+        hashes[invoice_id] = sha256
+
+    return {
+        r["id"]: (storage_path(org.id, hashes[r["id"]], "pdf"), f"factura_{r['series']}{r['number']}.pdf")
+        for r in rows
+    }
+
+
+class _ZipSink:
+    """Destino no 'seekable' para zipfile: acumula lo escrito hasta el siguiente yield."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_zip(files):
+    """
+    ZIP en streaming de `files` [(ruta en el storage, nombre en el ZIP)]:
+    se emite fichero a fichero, sin montar el ZIP entero en memoria.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for path, name in files:
+            with default_storage.open(path, "rb") as src, zf.open(name, "w") as dst:
+                for chunk in iter(lambda: src.read(64 * 1024), b""):
+                    dst.write(chunk)
+            yield sink.take()
+    yield sink.take()
@@ -3,8 +3,13 @@ from decimal import Decimal
 from django.db import transaction
 from rest_framework.exceptions import ValidationError
 
+from inventory import services_reservations as inv_reservations
 from .models import Quote, QuoteLine, Invoice, InvoiceLine
-from .pricing import compute_invoice_totals
+from .pricing import price_rows
+from .services_lines import TOTALS_FIELDS, apply_line_changes, line_pricing, lock_bases, replace_document_lines
+
+# ref_type de las reservas de stock de presupuestos
+RESERVATION_REF = "quote"
 
 
 @transaction.atomic
@@ -22,7 +27,8 @@ def add_line(
     if quote.status not in ("draft", "sent"):
         raise ValidationError("Solo se pueden modificar presupuestos en borrador o enviados")
 
-    return QuoteLine.objects.create(
+    bases = lock_bases(quote)
+    line = QuoteLine.objects.create(
         quote=quote,
         product=product,
         description=description or (product.name if product else ""),
@@ -32,47 +38,54 @@ def add_line(
         tax_rate=tax_rate,
         discount_pct=discount_pct,
     )
+    # Totales incrementales: solo suma la base de esta línea
+    apply_line_changes(quote, bases, added=[line_pricing(line)])
+    return line
+
+
+@transaction.atomic
+def remove_line(quote: Quote, line_id):
+    if quote.status not in ("draft", "sent"):
+        raise ValidationError("Solo se pueden modificar presupuestos en borrador o enviados")
+    bases = lock_bases(quote)
+    line = QuoteLine.objects.filter(quote=quote, pk=line_id).first()
+    if line is None:
+        raise ValidationError({"line": "Línea no encontrada en el presupuesto."})
+    line_id = line.pk
+    line.delete()
+    apply_line_changes(quote, bases, removed=[line_pricing(line)])
+    inv_reservations.release(quote.org, None, RESERVATION_REF, quote.id, [line_id])
+    return quote
 
 @transaction.atomic
 def replace_lines(quote: Quote, *, lines: list[dict]):
     """
     Reemplaza TODAS las líneas de un presupuesto por las indicadas en `lines`.
+    Solo escribe las líneas que cambian (ver services_lines.sync_lines).
 
-    Cada elemento de `lines` debe ser un dict con las claves compatibles con
-    add_line(...): product, description, qty, uom, unit_price, tax_rate, discount_pct.
+    Cada elemento de `lines` debe ser un dict con:
+      product (objeto Product o None)
+      description, qty, uom, unit_price, tax_rate, discount_pct
     """
     if quote.status not in ("draft", "sent"):
-        raise ValidationError("Solo se pueden modificar presupuestos en borrador o enviados")
-
-    # Borramos las líneas actuales
-    QuoteLine.objects.filter(quote=quote).delete()
-
-    # Volvemos a crearlas usando el servicio add_line (valida estados, etc.)
-    for ln in lines:
-        add_line(
-            quote,
-            product=ln.get("product"),
-            description=ln.get("description", ""),
-            qty=ln.get("qty", Decimal("0")),
-            uom=ln.get("uom", "unidad"),
-            unit_price=ln.get("unit_price", Decimal("0.00")),
-            tax_rate=ln.get("tax_rate", Decimal("21.00")),
-            discount_pct=ln.get("discount_pct", Decimal("0.00")),
-        )
+        raise ValidationError("Solo se pueden modificar presupuestos en borrador o enviados.")
 
-    # Recalcular totales del presupuesto
-    recompute_totals(quote)
+    replace_document_lines(quote, QuoteLine, "quote", lines)
+    # las líneas se reutilizan por posición: se liberan las reservas de las
+    # que ya no existen y de las que cambian de producto o cantidad
+    inv_reservations.release_stale(quote.org, None, RESERVATION_REF, quote.id, {
+        line_id: (product_id, qty)
+        for line_id, product_id, qty in quote.lines.filter(product__isnull=False).values_list("id", "product_id", "qty")
+    })
     return quote
 
 
 @transaction.atomic
 def recompute_totals(quote: Quote):
-    lines = quote.lines.all().values("qty", "unit_price", "discount_pct", "tax_rate")
-    total_base, total_tax, total = compute_invoice_totals(lines)
-    quote.totals_base = total_base
-    quote.totals_tax = total_tax
-    quote.total = total
-    quote.save(update_fields=["totals_base", "totals_tax", "total"])
+    """Recalcula bases y totales desde todas las líneas."""
+    rows = quote.lines.values_list("quote_id", "qty", "unit_price", "discount_pct", "tax_rate")
+    quote.tax_bases, quote.totals_base, quote.totals_tax, quote.total = price_rows(rows, include=[quote.id])[quote.id]
+    quote.save(update_fields=TOTALS_FIELDS)
     return quote
 
 
@@ -83,9 +96,42 @@ def change_status(quote: Quote, new_status: str):
         raise ValidationError("Estado de presupuesto no válido")
     quote.status = new_status
     quote.save(update_fields=["status"])
+    if new_status in ("rejected", "expired"):
+        release_reservations(quote, user=None)
     return quote
 
 
+@transaction.atomic
+def reserve(quote: Quote, *, user, warehouse_id, ttl=inv_reservations.DEFAULT_TTL):
+    """
+    Reserva en `warehouse_id` el stock de las líneas con producto y cantidad
+    positiva del presupuesto (sustituye las reservas previas; las de las
+    demás líneas se liberan). Caducan a los `ttl`.
+    """
+    if quote.status not in ("draft", "sent", "accepted"):
+        raise ValidationError("Solo se puede reservar stock de presupuestos en borrador, enviados o aceptados.")
+    lines = [
+        (line_id, product_id, warehouse_id, qty)
+        for line_id, product_id, qty in quote.lines.filter(product__isnull=False, qty__gt=0).order_by("id")
+        .values_list("id", "product_id", "qty")
+    ]
+    try:
+        inv_reservations.release(quote.org, user, RESERVATION_REF, quote.id, keep_line_ids=[ln[0] for ln in lines])
+        return inv_reservations.hold(quote.org, user, RESERVATION_REF, quote.id, lines, ttl=ttl)
+    except ValueError as exc:
+        raise ValidationError(str(exc))
+
+
+def release_reservations(quote: Quote, *, user) -> int:
+    return inv_reservations.release(quote.org, user, RESERVATION_REF, quote.id)
+
+
+# Presupuestos por transacción en la conversión masiva (ver jobs.convert_quotes_job)
+MAX_CONVERT_BATCH = 500
+
+_LINE_FIELDS = ("product_id", "description", "qty", "uom", "unit_price", "tax_rate", "discount_pct")
+
+
 @transaction.atomic
 def convert_to_invoice(quote: Quote):
     """
@@ -99,67 +145,80 @@ def convert_to_invoice(quote: Quote):
         # ya convertido antes
         return quote.invoice
 
-    inv = Invoice.objects.create(
-        org=quote.org,
-        series="A",          # se reenumerará en post_invoice
-        date_issue=quote.date,
-        customer=quote.customer,
-        billing_address=quote.billing_address,
-        status="draft",
-        payment_status="unpaid",
-        currency=quote.currency,
-    )
-
-    for ln in quote.lines.all():
-        InvoiceLine.objects.create(
-            invoice=inv,
-            product=ln.product,
-            description=ln.description,
-            qty=ln.qty,
-            uom=ln.uom,
-            unit_price=ln.unit_price,
-            tax_rate=ln.tax_rate,
-            discount_pct=ln.discount_pct,
-        )
-
-    # recalculamos totales de la factura
-    # (usando el servicio de invoice)
-    from .services_invoice import recompute_totals as invoice_recompute
+    result = convert_quotes(quote.org, [quote.id])
+    if result["failed"]:
+        raise ValidationError(result["failed"][0]["error"])
+    invoice_id = (result["converted"] or result["already"])[0]["invoice"]
+    quote.invoice = Invoice.objects.get(pk=invoice_id)
+    return quote.invoice
 
-    invoice_recompute(inv)
-
-    quote.invoice = inv
-    quote.save(update_fields=["invoice"])
-
-    return inv
 
 @transaction.atomic
-def replace_lines(quote: Quote, *, lines: list[dict]):
+def convert_quotes(org, quote_ids):
     """
-    Reemplaza TODAS las líneas de un presupuesto por las indicadas en `lines`.
+    Convierte a factura (borrador) un lote de presupuestos aceptados de la org.
 
-    Cada elemento de `lines` debe ser un dict con:
-      product (objeto Product o None)
-      description, qty, uom, unit_price, tax_rate, discount_pct
-    """
-    if quote.status not in ("draft", "sent"):
-        raise ValidationError("Solo se pueden modificar presupuestos en borrador o enviados.")
+    - Bloquea los presupuestos; los ya convertidos se devuelven en "already"
+      y los que no se pueden convertir en "failed", sin abortar el lote.
+    - Facturas y líneas con bulk_create; las líneas se copian tal cual, así
+      que bases por IVA y totales se copian del presupuesto sin recalcular.
 
-    # Borramos las líneas actuales
-    QuoteLine.objects.filter(quote=quote).delete()
-
-    # Creamos las nuevas
-    for ln in lines:
-        QuoteLine.objects.create(
-            quote=quote,
-            product=ln.get("product"),
-            description=ln.get("description", ""),
-            qty=ln.get("qty", Decimal("0")),
-            uom=ln.get("uom", "unidad"),
-            unit_price=ln.get("unit_price", Decimal("0.00")),
-            tax_rate=ln.get("tax_rate", Decimal("21.00")),
-            discount_pct=ln.get("discount_pct", Decimal("0.00")),
+    Devuelve {"converted": [{quote, invoice}], "already": [...], "failed": [{id, error}]}.
+    """
+    ids = list(dict.fromkeys(quote_ids))
+    if len(ids) > MAX_CONVERT_BATCH:
+        raise ValidationError({"ids": f"Máximo {MAX_CONVERT_BATCH} presupuestos por lote."})
+
+    quotes = list(
+        Quote.objects.select_for_update()
+        .filter(org=org, id__in=ids)
+        .order_by("date", "id")
+    )
+    found = {q.id for q in quotes}
+    failed = [{"id": quote_id, "error": "Presupuesto no encontrado."} for quote_id in ids if quote_id not in found]
+    already, pending = [], []
+    for quote in quotes:
+        if quote.status != "accepted":
+            failed.append({"id": quote.id, "error": "Solo se pueden convertir presupuestos aceptados"})
+        elif quote.invoice_id:
+            already.append({"quote": quote.id, "invoice": quote.invoice_id})
+        else:
+            pending.append(quote)
+
+    invoices = Invoice.objects.bulk_create([
+        Invoice(
+            org_id=quote.org_id,
+            series="A",          # se reenumerará en post_invoice
+            date_issue=quote.date,
+            customer_id=quote.customer_id,
+            billing_address=quote.billing_address,
+            status="draft",
+            payment_status="unpaid",
+            currency=quote.currency,
+            tax_bases=quote.tax_bases,
+            totals_base=quote.totals_base,
+            totals_tax=quote.totals_tax,
+            total=quote.total,
         )
+        for quote in pending
+    ])
+    invoice_by_quote = {quote.id: inv.id for quote, inv in zip(pending, invoices)}
+
+    lines = QuoteLine.objects.filter(quote_id__in=invoice_by_quote).order_by("quote_id", "id")
+    InvoiceLine.objects.bulk_create(
+        (
+            InvoiceLine(invoice_id=invoice_by_quote[row["quote_id"]], **{f: row[f] for f in _LINE_FIELDS})
+            for row in lines.values("quote_id", *_LINE_FIELDS).iterator(chunk_size=2000)
+        ),
+        batch_size=2000,
+    )
 
-    recompute_totals(quote)
-    return quote
+    for quote in pending:
+        quote.invoice_id = invoice_by_quote[quote.id]
+    Quote.objects.bulk_update(pending, ["invoice"])
+
+    return {
+        "converted": [{"quote": quote.id, "invoice": quote.invoice_id} for quote in pending],
+        "already": already,
+        "failed": failed,
+    }
@@ -1,3 +1,795 @@
-from django.test import TestCase
+# sales/tests.py
+import base64
+import io
+import multiprocessing
+import random
+import tempfile
+import unittest
+import zipfile
+from datetime import date
+from decimal import ROUND_HALF_EVEN, Decimal
+from unittest import mock
 
-# Create your tests here.
+import django
+from django.db import connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from config.pagination import KeysetPagination
+from contacts.models import Contact
+from core.models import Organization
+from inventory.models import Category, Product
+
+from . import pricing, services_print
+from .jobs import convert_quotes_job
+from .models import Invoice, InvoiceLine, InvoiceRendition, InvoiceSequence, Payment, Quote, QuoteLine
+from .services_invoice import post_invoice, post_invoices
+from .services_kpis import sales_kpis
+from .services_quote import convert_quotes, recompute_totals
+from .services_numbering import next_invoice_number, reserve_invoice_numbers
+from .views import InvoicePdfView, InvoicePrintView, InvoiceViewSet, PaymentViewSet, QuoteViewSet
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _draft(org, customer, issued, series="A"):
+    inv = Invoice.objects.create(org=org, customer=customer, series=series, date_issue=issued)
+    InvoiceLine.objects.create(invoice=inv, description="Línea", qty=Decimal("1"), unit_price=Decimal("10.00"))
+    return inv
+
+
+def _numbers(org):
+    """{(serie, año): [números]} de las facturas contabilizadas."""
+    numbers = {}
+    rows = Invoice.objects.filter(org=org, status="posted").values_list("series", "date_issue", "number")
+    for series, issued, number in rows:
+        numbers.setdefault((series, issued.year), []).append(number)
+    return {key: sorted(values) for key, values in numbers.items()}
+
+
+class InvoiceNumberingTests(TestCase):
+    def setUp(self):
+        self.org = Organization.objects.create(name="Org", slug="org")
+        self.customer = Contact.objects.create(org=self.org, tipo="client", razon_social="Cliente")
+
+    def test_blocks_are_contiguous(self):
+        self.assertEqual(reserve_invoice_numbers(self.org, "A", 3, year=2026), (2026, 1))
+        self.assertEqual(reserve_invoice_numbers(self.org, "A", 2, year=2026), (2026, 4))
+        self.assertEqual(next_invoice_number(self.org, "A", 2026), (2026, 6))
+        self.assertEqual(InvoiceSequence.objects.get(org=self.org, series="A", year=2026).last_number, 6)
+
+    def test_one_sequence_per_org_series_and_year(self):
+        other = Organization.objects.create(name="Otra", slug="otra")
+        reserve_invoice_numbers(self.org, "A", 5, year=2026)
+        self.assertEqual(next_invoice_number(self.org, "A", 2025), (2025, 1))
+        self.assertEqual(next_invoice_number(self.org, "B", 2026), (2026, 1))
+        self.assertEqual(next_invoice_number(other, "A", 2026), (2026, 1))
+        self.assertEqual(next_invoice_number(self.org, "A", 2026), (2026, 6))
+
+    def test_rollback_leaves_no_gap(self):
+        next_invoice_number(self.org, "A", 2026)
+        with self.assertRaises(_Rollback), transaction.atomic():
+            reserve_invoice_numbers(self.org, "A", 10, year=2026)
+            raise _Rollback()
+        self.assertEqual(next_invoice_number(self.org, "A", 2026), (2026, 2))
+
+    def test_batch_numbers_by_issue_year_without_gaps(self):
+        drafts = [
+            _draft(self.org, self.customer, date(year, month, 1), series)
+            for year in (2025, 2026) for month in (3, 1, 2) for series in ("A", "B")
+        ]
+        posted = _draft(self.org, self.customer, date(2026, 1, 15))
+        post_invoice(posted)
+
+        result = post_invoices(self.org, [inv.id for inv in drafts] + [posted.id, 0])
+
+        self.assertEqual(len(result["posted"]), len(drafts))
+        self.assertEqual({f["id"] for f in result["failed"]}, {posted.id, 0})
+        self.assertEqual(_numbers(self.org), {
+            ("A", 2025): [1, 2, 3],
+            ("B", 2025): [1, 2, 3],
+            ("A", 2026): [1, 2, 3, 4],
+            ("B", 2026): [1, 2, 3],
+        })
+        # dentro de cada serie/año, por fecha de emisión
+        numbers = Invoice.objects.filter(org=self.org, series="B", date_issue__year=2025).order_by("date_issue")
+        self.assertEqual(list(numbers.values_list("number", flat=True)), [1, 2, 3])
+
+    def test_stale_draft_is_not_posted_twice(self):
+        draft = _draft(self.org, self.customer, date(2026, 5, 1))
+        stale = Invoice.objects.get(pk=draft.pk)
+        post_invoice(draft)
+        with self.assertRaises(ValidationError):
+            post_invoice(stale)
+        self.assertEqual(_numbers(self.org), {("A", 2026): [1]})
+
+    def test_failed_batch_does_not_consume_numbers(self):
+        draft = _draft(self.org, self.customer, date(2026, 5, 1))
+        with self.assertRaises(_Rollback), transaction.atomic():
+            post_invoices(self.org, [draft.id])
+            raise _Rollback()
+        draft.refresh_from_db()
+        self.assertEqual((draft.status, draft.number), ("draft", None))
+        self.assertEqual(post_invoices(self.org, [draft.id])["posted"][0]["number"], 1)
+
+
+def _post_worker(args):
+    """
+    Proceso hijo (spawn + django.setup()): contabiliza sus borradores, uno por
+    transacción, contra la base de datos del test. Alterna post_invoice y
+    post_invoices; con rollback_every deshace parte DESPUÉS de numerar.
+    """
+    db_name, invoice_ids, rollback_every = args
+    conn = connections["default"]
+    if conn.settings_dict["NAME"] != db_name:
+        conn.close()
+        conn.settings_dict["NAME"] = db_name
+    posted = rolled_back = 0
+    try:
+        for i, inv_id in enumerate(invoice_ids):
+            try:
+                with transaction.atomic():
+                    inv = Invoice.objects.select_related("org").get(pk=inv_id)
+                    if i % 2:
+                        post_invoices(inv.org, [inv.id])
+                    else:
+                        post_invoice(inv)
+                    if rollback_every and i % rollback_every == 0:
+                        raise _Rollback()
+                posted += 1
+            except _Rollback:
+                rolled_back += 1
+    finally:
+        connections.close_all()
+    return posted, rolled_back
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "Necesita PostgreSQL (bloqueos de fila entre procesos)")
+class InvoiceNumberingConcurrencyTests(TransactionTestCase):
+    """Varios procesos contabilizando a la vez, cada uno con su conexión a la BD del test."""
+
+    PROCESSES = 6
+    PER_PROCESS = 15
+
+    def test_concurrent_posting_has_no_gaps_or_collisions(self):
+        org = Organization.objects.create(name="Org", slug="org")
+        customer = Contact.objects.create(org=org, tipo="client", razon_social="Cliente")
+        drafts = [
+            _draft(org, customer, date(2025 + i % 2, 1 + i % 12, 1), "AB"[i // 2 % 2])
+            for i in range(self.PROCESSES * self.PER_PROCESS)
+        ]
+        db_name = connection.settings_dict["NAME"]
+        chunks = [
+            (db_name, [inv.id for inv in drafts[n::self.PROCESSES]], 4 if n % 2 else 0)
+            for n in range(self.PROCESSES)
+        ]
+
+        with multiprocessing.get_context("spawn").Pool(self.PROCESSES, initializer=django.setup) as pool:
+            results = pool.map(_post_worker, chunks)
+
+        numbers = _numbers(org)
+        posted = Invoice.objects.filter(org=org, status="posted").count()
+        self.assertEqual(sum(p for p, _ in results), posted)
+        self.assertGreater(sum(r for _, r in results), 0)
+        self.assertEqual(posted + sum(r for _, r in results), len(drafts))
+        self.assertEqual(sum(len(values) for values in numbers.values()), posted)
+        sequences = dict(
+            ((series, year), last) for series, year, last in
+            InvoiceSequence.objects.filter(org=org).values_list("series", "year", "last_number")
+        )
+        for key, values in numbers.items():
+            self.assertEqual(sorted(values), list(range(1, len(values) + 1)), key)
+            self.assertEqual(sequences[key], len(values), key)
+
+
+# ----------------------------------------- motor de precios vs. Decimal
+
+def _ref_money(x):
+    return x.quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)
+
+
+def _ref_bases(lines):
+    """bases_por_iva con la aritmética Decimal anterior al motor en céntimos."""
+    bases = {}
+    for ln in lines:
+        base = _ref_money(ln["qty"] * ln["unit_price"] * (Decimal("1.00") - ln["discount_pct"] / Decimal("100")))
+        key = str(_ref_money(ln["tax_rate"]))
+        bases[key] = bases.get(key, Decimal("0.00")) + base
+    return bases
+
+
+def _ref_totals(bases):
+    total_base = _ref_money(sum(bases.values(), Decimal("0.00")))
+    total_tax = _ref_money(sum((b * Decimal(r) / Decimal("100") for r, b in bases.items()), Decimal("0.00")))
+    return total_base, total_tax, _ref_money(total_base + total_tax)
+
+
+def _ref_document(lines):
+    bases = _ref_bases(lines)
+    return ({r: str(b) for r, b in sorted(bases.items()) if b}, *_ref_totals(bases))
+
+
+def _ref_line_totals(qty, unit_price, tax_rate, discount_pct):
+    """Cálculo por línea de compras (cuota redondeada por línea)."""
+    base = (qty * unit_price * (Decimal("1") - (discount_pct / Decimal("100")))).quantize(Decimal("0.01"))
+    tax = (base * tax_rate / Decimal("100")).quantize(Decimal("0.01"))
+    return base, tax, base + tax
+
+
+def _random_decimal(rnd, places, max_int):
+    return Decimal(rnd.randint(0, max_int * 10 ** places)).scaleb(-places)
+
+
+def _random_line(rnd):
+    qty = _random_decimal(rnd, rnd.choice((0, 0, 1, 3)), rnd.choice((5, 100, 100000)))
+    if rnd.random() < 0.1:
+        qty = -qty  # rectificativas
+    return {
+        "qty": qty,
+        "unit_price": _random_decimal(rnd, 2, rnd.choice((1, 50, 10000, 10 ** 8))),
+        "discount_pct": rnd.choice((Decimal("0.00"), Decimal("0.00"), _random_decimal(rnd, 2, 100))),
+        "tax_rate": (
+            Decimal(rnd.choice(("0.00", "4.00", "5.00", "10.00", "21.00")))
+            if rnd.random() < 0.9 else _random_decimal(rnd, 2, 30)
+        ),
+    }
+
+
+class PricingEngineTests(SimpleTestCase):
+    """
+    El motor en céntimos enteros (sales.pricing) da los mismos importes que
+    la aritmética Decimal anterior: mismo valor y mismos dos decimales.
+    """
+
+    SEED = 20251018
+    DOCUMENTS = 1500
+    MAX_LINES = 12
+
+    def assertSame(self, got, expected, lines):
+        self.assertEqual(got, expected, lines)
+        exponents = lambda values: [v.as_tuple().exponent for v in values if isinstance(v, Decimal)]
+        self.assertEqual(exponents(got), exponents(expected), lines)
+
+    def documents(self):
+        rnd = random.Random(self.SEED)
+        return {
+            doc_id: [_random_line(rnd) for _ in range(rnd.randint(0, self.MAX_LINES))]
+            for doc_id in range(1, self.DOCUMENTS + 1)
+        }
+
+    def test_price_rows_matches_decimal(self):
+        documents = self.documents()
+        rows = [
+            (doc_id, ln["qty"], ln["unit_price"], ln["discount_pct"], ln["tax_rate"])
+            for doc_id, lines in documents.items() for ln in lines
+        ]
+        priced = pricing.price_rows(rows, include=list(documents))
+        self.assertEqual(priced.keys(), documents.keys())
+        for doc_id, lines in documents.items():
+            self.assertSame(priced[doc_id], _ref_document(lines), lines)
+
+    def test_per_document_api_matches_decimal(self):
+        for lines in self.documents().values():
+            bases = pricing.bases_por_iva(lines)
+            self.assertSame((pricing.dump_bases(bases), *pricing.totals_from_bases(bases)), _ref_document(lines), lines)
+
+            half = len(lines) // 2
+            incremental = pricing.add_to_bases(pricing.add_to_bases({}, lines), lines[:half], sign=-1)
+            self.assertSame(pricing.totals_from_bases(incremental), _ref_totals(_ref_bases(lines[half:])), lines)
+
+    def test_line_totals_matches_purchases(self):
+        for lines in self.documents().values():
+            for ln in lines:
+                if ln["qty"] > 0 and ln["tax_rate"] == _ref_money(ln["tax_rate"]):
+                    args = (ln["qty"], ln["unit_price"], ln["tax_rate"], ln["discount_pct"])
+                    self.assertSame(pricing.line_totals(*args), _ref_line_totals(*args), ln)
+
+    def test_half_even_ties(self):
+        # 0.125 -> 0.12 y 0.135 -> 0.14 (empates al par), también con descuento
+        lines = [
+            {"qty": Decimal("1"), "unit_price": Decimal("0.125"), "discount_pct": Decimal("0"), "tax_rate": Decimal("21")},
+            {"qty": Decimal("1"), "unit_price": Decimal("0.135"), "discount_pct": Decimal("0"), "tax_rate": Decimal("10")},
+            {"qty": Decimal("3"), "unit_price": Decimal("0.25"), "discount_pct": Decimal("50"), "tax_rate": Decimal("21")},
+        ]
+        rows = [(1, ln["qty"], ln["unit_price"], ln["discount_pct"], ln["tax_rate"]) for ln in lines]
+        self.assertSame(pricing.price_rows(rows)[1], _ref_document(lines), lines)
+        self.assertEqual(pricing.line_base(lines[0]), Decimal("0.12"))
+        self.assertEqual(pricing.line_base(lines[1]), Decimal("0.14"))
+
+    def test_documents_without_lines(self):
+        zero = Decimal("0.00")
+        self.assertEqual(pricing.price_rows([], include=[7]), {7: ({}, zero, zero, zero)})
+        self.assertEqual(pricing.totals_from_bases({}), (zero, zero, zero))
+
+
+# ------------------------------------------------ queries de los listados
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class SalesListQueriesTests(TestCase):
+    """
+    Listados y detalles de facturas y presupuestos con un nº fijo de
+    queries, sin depender del tamaño de página ni del nº de líneas:
+    listado = count + página (+ 1 por cada anidado expandido).
+    """
+
+    DOCUMENTS = 12
+    LINES = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.user = User.objects.create(email="user@example.com")
+        customer = Contact.objects.create(org=cls.org, tipo="client", razon_social="Cliente")
+        category = Category.objects.create(org=cls.org, name="General")
+        products = Product.objects.bulk_create([
+            Product(org=cls.org, category=category, sku=f"P{i}", name=f"Producto {i}", price=Decimal("10.00"))
+            for i in range(cls.LINES)
+        ])
+        invoices = Invoice.objects.bulk_create([Invoice(org=cls.org, customer=customer) for _ in range(cls.DOCUMENTS)])
+        InvoiceLine.objects.bulk_create([
+            InvoiceLine(invoice=inv, product=p, qty=Decimal("1"), unit_price=p.price) for inv in invoices for p in products
+        ])
+        Payment.objects.bulk_create([
+            Payment(org=cls.org, invoice=inv, amount=Decimal("1.00")) for inv in invoices for _ in range(2)
+        ])
+        quotes = Quote.objects.bulk_create([
+            Quote(org=cls.org, customer=customer, number=f"Q-{i}", invoice=inv) for i, inv in enumerate(invoices)
+        ])
+        QuoteLine.objects.bulk_create([
+            QuoteLine(quote=q, product=p, qty=Decimal("1"), unit_price=p.price) for q in quotes for p in products
+        ])
+        cls.invoice, cls.quote = invoices[0], quotes[0]
+
+    def call(self, viewset, actions, params=None, **kwargs):
+        request = APIRequestFactory().get("/", params or {})
+        request.org = self.org
+        force_authenticate(request, user=self.user)
+        response = viewset.as_view(actions)(request, org_slug=self.org.slug, **kwargs)
+        response.render()
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        return response
+
+    def test_list_queries(self):
+        cases = [
+            (InvoiceViewSet, {}, 2),
+            (InvoiceViewSet, {"fields": "id,number,total"}, 2),
+            (InvoiceViewSet, {"expand": "lines"}, 3),
+            (InvoiceViewSet, {"expand": "lines,payments"}, 4),
+            (InvoiceViewSet, {"fields": "id,total", "expand": "payments"}, 3),
+            (QuoteViewSet, {}, 2),
+            (QuoteViewSet, {"expand": "lines"}, 3),
+        ]
+        for viewset, params, expected in cases:
+            for page_size in (5, self.DOCUMENTS):
+                with self.subTest(viewset=viewset.__name__, params=params, page_size=page_size):
+                    with self.assertNumQueries(expected):
+                        self.call(viewset, {"get": "list"}, {**params, "page_size": page_size})
+
+    def test_list_fields_and_expand(self):
+        data = self.call(InvoiceViewSet, {"get": "list"}, {"fields": "id,total", "expand": "payments"}).data
+        row = data["results"][0]
+        self.assertEqual(set(row), {"id", "total", "payments"})
+        self.assertEqual(len(row["payments"]), 2)
+
+    def test_detail_queries(self):
+        for viewset, pk in ((InvoiceViewSet, self.invoice.pk), (QuoteViewSet, self.quote.pk)):
+            with self.subTest(viewset=viewset.__name__), self.assertNumQueries(2):
+                response = self.call(viewset, {"get": "retrieve"}, pk=pk)
+            self.assertEqual(len(response.data["lines"]), self.LINES)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class PaymentCreateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.user = User.objects.create(email="user@example.com")
+        customer = Contact.objects.create(org=cls.org, tipo="client", razon_social="Cliente")
+        cls.invoice = post_invoice(_draft(cls.org, customer, date(2026, 3, 1)))
+
+    def create(self):
+        request = APIRequestFactory().post("/", {"invoice": self.invoice.id, "amount": "5.00", "date": "2026-03-10"}, format="json")
+        request.org = self.org
+        force_authenticate(request, user=self.user)
+        response = PaymentViewSet.as_view({"post": "create"})(request, org_slug=self.org.slug)
+        response.render()
+        return response
+
+    def test_failed_analytics_hook_rolls_back_the_payment(self):
+        with mock.patch("sales.views.register_invoice_payment_created", side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.create()
+        self.assertFalse(Payment.objects.filter(invoice=self.invoice).exists())
+
+        self.assertEqual(self.create().status_code, 201)
+        self.assertEqual(Payment.objects.filter(invoice=self.invoice).count(), 1)
+
+
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class KeysetPaginationTests(TestCase):
+    """Listado de facturas con ?pagination=cursor (keyset sobre -date_issue, -id)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.user = User.objects.create(email="user@example.com")
+        customer = Contact.objects.create(org=cls.org, tipo="client", razon_social="Cliente")
+        # fechas repetidas: el desempate va por id
+        Invoice.objects.bulk_create([
+            Invoice(org=cls.org, customer=customer, date_issue=date(2026, 1, 1 + i % 4)) for i in range(11)
+        ])
+        cls.expected = list(
+            Invoice.objects.filter(org=cls.org).order_by("-date_issue", "-id").values_list("id", flat=True)
+        )
+
+    def list(self, url="/", params=None):
+        request = APIRequestFactory().get(url, params)
+        request.org = self.org
+        force_authenticate(request, user=self.user)
+        response = InvoiceViewSet.as_view({"get": "list"})(request, org_slug=self.org.slug)
+        response.render()
+        return response
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200, response.data)
+        return [row["id"] for row in response.data["results"]]
+
+    def test_next_and_previous_round_trip(self):
+        response = self.list(params={"pagination": "cursor", "page_size": 3, "fields": "id"})
+        self.assertIsNone(response.data["previous"])
+        pages = [response]
+        while pages[-1].data["next"]:
+            pages.append(self.list(pages[-1].data["next"]))
+        self.assertEqual([rid for page in pages for rid in self.ids(page)], self.expected)
+        self.assertEqual([len(self.ids(page)) for page in pages], [3, 3, 3, 2])
+
+        # hacia atrás desde la última página se recorren las mismas páginas
+        back = [pages[-1]]
+        while back[-1].data["previous"]:
+            back.append(self.list(back[-1].data["previous"]))
+        self.assertEqual([self.ids(page) for page in reversed(back)], [self.ids(page) for page in pages])
+        self.assertIsNotNone(back[-1].data["next"])
+
+    def test_estimate_header(self):
+        response = self.list(params={"pagination": "cursor"})
+        if connection.vendor == "postgresql":
+            self.assertGreaterEqual(int(response["X-Total-Count-Estimate"]), 0)
+        else:
+            self.assertFalse(response.has_header("X-Total-Count-Estimate"))
+        with mock.patch("config.pagination.estimated_count", return_value=11):
+            response = self.list(params={"pagination": "cursor", "page_size": 5})
+        self.assertEqual(response["X-Total-Count-Estimate"], "11")
+        self.assertNotIn("count", response.data)
+
+    def test_crafted_cursor_is_a_validation_error(self):
+        encode = KeysetPagination._encode
+        crafted = [
+            "no-es-base64$",
+            encode(["2026-01-01"], False),
+            encode(["2026-01-01", None], False),
+            encode(["ayer", 1], False),
+            encode(["2026-13-01", 1], False),
+            encode(["2026-01-01", "uno"], True),
+            encode(["2026-01-01", [1]], False),
+            base64.urlsafe_b64encode(b'["2026-01-01", 1]').decode(),
+        ]
+        for cursor in crafted:
+            with self.subTest(cursor=cursor):
+                response = self.list(params={"cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data, {"cursor": "Cursor inválido."})
+
+
+# ------------------------------------------------- impresión (HTML / PDF)
+
+@override_settings(ALLOWED_HOSTS=["testserver"], SALES_PRINT_WORKERS=1)
+class InvoicePrintTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.user = User.objects.create(email="user@example.com")
+        cls.customer = Contact.objects.create(org=cls.org, tipo="client", razon_social="Cliente")
+
+    def setUp(self):
+        self.enterContext(self.settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.invoice = post_invoice(_draft(self.org, self.customer, date(2026, 3, 1)))
+
+    def get(self, view, pk, **headers):
+        request = APIRequestFactory().get("/", **headers)
+        request.org = self.org
+        force_authenticate(request, user=self.user)
+        response = view.as_view()(request, org_slug=self.org.slug, pk=pk)
+        if response.streaming:
+            # response.close() lanzaría request_finished y cerraría la conexión del test
+            response.content_bytes = b"".join(response.streaming_content)
+            response.file_to_stream.close()
+        return response
+
+    def test_second_request_with_matching_etag_is_a_304(self):
+        for view, fmt in ((InvoicePrintView, "html"), (InvoicePdfView, "pdf")):
+            with self.subTest(fmt=fmt):
+                first = self.get(view, self.invoice.pk)
+                self.assertEqual(first.status_code, 200)
+                self.assertEqual(first["Content-Type"], services_print.CONTENT_TYPES[fmt])
+                etag = first["ETag"]
+
+                # ya generado: ni se vuelve a renderizar ni se lee el fichero
+                render = mock.Mock()
+                with mock.patch.dict(services_print.RENDERERS, {fmt: render}), self.assertNumQueries(1):
+                    second = self.get(view, self.invoice.pk, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(second.status_code, 304)
+                self.assertEqual(second["ETag"], etag)
+                render.assert_not_called()
+
+                # sin ETag se sirve el fichero guardado, idéntico
+                third = self.get(view, self.invoice.pk)
+                self.assertEqual((third.status_code, third["ETag"]), (200, etag))
+                self.assertEqual(third.content_bytes, first.content_bytes)
+
+    def test_fingerprint_change_regenerates(self):
+        first = self.get(InvoicePdfView, self.invoice.pk)
+        rendition = InvoiceRendition.objects.get(invoice=self.invoice)
+        self.assertEqual(rendition.fingerprint, services_print.fingerprint("posted", "unpaid"))
+
+        # el estado de cobro sale en el documento
+        Invoice.objects.filter(pk=self.invoice.pk).update(payment_status="paid")
+        second = self.get(InvoicePdfView, self.invoice.pk, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+        rendition.refresh_from_db()
+        self.assertEqual(rendition.fingerprint, services_print.fingerprint("posted", "paid"))
+        self.assertEqual(f'"{rendition.pdf_sha256}"', second["ETag"])
+
+        # también al cambiar la versión de la plantilla (mismo contenido: sigue valiendo el ETag)
+        render = mock.Mock(wraps=services_print.render_pdf)
+        with mock.patch.object(services_print, "RENDER_VERSION", services_print.RENDER_VERSION + 1), \
+                mock.patch.dict(services_print.RENDERERS, {"pdf": render}):
+            third = self.get(InvoicePdfView, self.invoice.pk, HTTP_IF_NONE_MATCH=second["ETag"])
+        self.assertEqual(third.status_code, 304)
+        render.assert_called_once()
+        rendition.refresh_from_db()
+        self.assertTrue(rendition.fingerprint.startswith(f"{services_print.RENDER_VERSION + 1}:"))
+
+    def test_drafts_are_rendered_on_every_request(self):
+        draft = _draft(self.org, self.customer, date(2026, 3, 2))
+        first = self.get(InvoicePrintView, draft.pk)
+        InvoiceLine.objects.filter(invoice=draft).update(description="Otra línea")
+        second = self.get(InvoicePrintView, draft.pk)
+        self.assertNotEqual(first["ETag"], second["ETag"])
+        self.assertFalse(InvoiceRendition.objects.filter(invoice=draft).exists())
+
+    def test_pdf_zip_reuses_stored_pdfs(self):
+        other = post_invoice(_draft(self.org, self.customer, date(2026, 3, 5)))
+        draft = _draft(self.org, self.customer, date(2026, 3, 6))
+        self.get(InvoicePdfView, self.invoice.pk)
+        ids = [self.invoice.pk, other.pk, draft.pk]
+
+        with mock.patch.object(services_print, "render_pdf", wraps=services_print.render_pdf) as render:
+            files = services_print.ensure_pdfs(self.org, Invoice.objects.filter(id__in=ids))
+        # solo falta el de `other`; el borrador no entra
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(
+            [name for _, name in files.values()],
+            [f"factura_A{self.invoice.number}.pdf", f"factura_A{other.number}.pdf"],
+        )
+
+        request = APIRequestFactory().get("/", {"ids": ",".join(map(str, ids))})
+        request.org = self.org
+        force_authenticate(request, user=self.user)
+        with mock.patch.object(services_print, "render_pdf") as render:
+            response = InvoiceViewSet.as_view({"get": "pdf_zip"})(request, org_slug=self.org.slug)
+            archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        render.assert_not_called()
+        self.assertEqual(archive.namelist(), [name for _, name in files.values()])
+        for path, name in files.values():
+            with services_print.default_storage.open(path, "rb") as f:
+                self.assertEqual(archive.read(name), f.read())
+
+
+# --------------------------------------------------------- KPIs de ventas
+
+class SalesKPIsTests(TestCase):
+    """
+    KPIs contra un fixture calculado a mano. Marzo de 2026 (31 días) se
+    compara con 29/01 - 28/02; IVA 21 % en todas las líneas.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.c1, cls.c2 = (
+            Contact.objects.create(org=cls.org, tipo="client", razon_social=f"Cliente {i}") for i in (1, 2)
+        )
+        cls.food = Category.objects.create(org=cls.org, name="Alimentación")
+        tools = Category.objects.create(org=cls.org, name="Herramientas")
+        cls.f1 = Product.objects.create(org=cls.org, category=cls.food, sku="F1", name="F1", cost_price=Decimal("4.00"))
+        cls.f2 = Product.objects.create(org=cls.org, category=cls.food, sku="F2", name="F2", cost_price=Decimal("2.50"))
+        cls.t1 = Product.objects.create(org=cls.org, category=tools, sku="T1", name="T1", cost_price=Decimal("10.00"))
+
+        # periodo actual
+        cls.invoice(cls.c1, date(2026, 3, 5), [(cls.f1, "3", "10.00"), (cls.t1, "1", "50.00")])
+        cls.invoice(cls.c2, date(2026, 3, 31), [(cls.f2, "4", "5.00", "10.00")])
+        cls.invoice(cls.c1, date(2026, 3, 20), [(cls.t1, "2", "40.00")])
+        cls.invoice(cls.c1, date(2026, 3, 10), [(cls.f1, "9", "10.00")], post=False)
+        cls.invoice(cls.c1, date(2026, 4, 1), [(cls.f1, "9", "10.00")])
+        # periodo anterior
+        cls.invoice(cls.c1, date(2026, 2, 28), [(cls.f1, "2", "10.00")])
+        cls.invoice(cls.c2, date(2026, 1, 29), [(cls.f2, "1", "6.00")])
+        cls.invoice(cls.c2, date(2026, 1, 28), [(cls.f2, "9", "6.00")])
+
+        # el coste va en la foto de la línea al contabilizar
+        Product.objects.filter(pk=cls.f1.pk).update(cost_price=Decimal("100.00"))
+
+    @classmethod
+    def invoice(cls, customer, issued, lines, post=True):
+        inv = Invoice.objects.create(org=cls.org, customer=customer, series="A", date_issue=issued)
+        for product, qty, price, *discount in lines:
+            InvoiceLine.objects.create(
+                invoice=inv, product=product, qty=Decimal(qty), unit_price=Decimal(price),
+                discount_pct=Decimal(discount[0] if discount else "0"),
+            )
+        return post_invoice(inv) if post else inv
+
+    def kpis(self, **kwargs):
+        return sales_kpis(self.org, date(2026, 3, 1), date(2026, 3, 31), **kwargs)
+
+    def metrics(self, data, keys=("invoices", "totals_base", "totals_tax", "total", "units", "revenue", "cogs", "margin", "margin_pct")):
+        return {key: data[key] for key in keys}
+
+    def test_category_filter_with_previous_period(self):
+        data = self.kpis(category_id=self.food.id, compare=True)
+
+        # 05/03: F1 3 x 10 (coste 4) + T1 1 x 50 -> cabecera entera, líneas solo F1
+        # 31/03: F2 4 x 5 con 10 % (coste 2,50)
+        self.assertEqual(self.metrics(data), {
+            "invoices": 2,
+            "totals_base": Decimal("98.00"), "totals_tax": Decimal("20.58"), "total": Decimal("118.58"),
+            "units": Decimal("7"), "revenue": Decimal("48.00"), "cogs": Decimal("22.00"),
+            "margin": Decimal("26.00"), "margin_pct": Decimal("0.5417"),
+        })
+        # 28/02: F1 2 x 10; 29/01: F2 1 x 6
+        self.assertEqual(self.metrics(data["previous_period"]), {
+            "invoices": 2,
+            "totals_base": Decimal("26.00"), "totals_tax": Decimal("5.46"), "total": Decimal("31.46"),
+            "units": Decimal("3"), "revenue": Decimal("26.00"), "cogs": Decimal("10.50"),
+            "margin": Decimal("15.50"), "margin_pct": Decimal("0.5962"),
+        })
+        self.assertEqual((data["previous_period"]["from"], data["previous_period"]["to"]), (date(2026, 1, 29), date(2026, 2, 28)))
+        self.assertEqual(data["change"], {
+            "invoices": Decimal("0.0000"),
+            "totals_base": Decimal("2.7692"), "totals_tax": Decimal("2.7692"), "total": Decimal("2.7692"),
+            "units": Decimal("1.3333"), "revenue": Decimal("0.8462"), "cogs": Decimal("1.0952"),
+            "margin": Decimal("0.6774"), "margin_pct": None,
+        })
+
+    def test_without_category_and_by_customer(self):
+        self.assertEqual(self.metrics(self.kpis()), {
+            "invoices": 3,
+            "totals_base": Decimal("178.00"), "totals_tax": Decimal("37.38"), "total": Decimal("215.38"),
+            "units": Decimal("10"), "revenue": Decimal("178.00"), "cogs": Decimal("52.00"),
+            "margin": Decimal("126.00"), "margin_pct": Decimal("0.7079"),
+        })
+        data = self.kpis(customer_id=self.c1.id, category_id=self.food.id)
+        self.assertEqual(
+            self.metrics(data, ("invoices", "total", "units", "revenue", "cogs")),
+            {"invoices": 1, "total": Decimal("96.80"), "units": Decimal("3"), "revenue": Decimal("30.00"), "cogs": Decimal("12.00")},
+        )
+        # los borradores solo con status="draft"
+        self.assertEqual(self.metrics(self.kpis(status="draft"), ("invoices", "units")), {"invoices": 1, "units": Decimal("9")})
+
+    def test_two_queries(self):
+        with self.assertNumQueries(2):
+            self.kpis(category_id=self.food.id, compare=True)
+
+
+# ------------------------------------------ conversión de presupuestos en lote
+
+class ConvertQuotesTests(TestCase):
+    LINE_FIELDS = ("product_id", "description", "qty", "uom", "unit_price", "tax_rate", "discount_pct")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.org = Organization.objects.create(name="Org", slug="org")
+        cls.customer = Contact.objects.create(org=cls.org, tipo="client", razon_social="Cliente")
+        category = Category.objects.create(org=cls.org, name="General")
+        cls.product = Product.objects.create(org=cls.org, category=category, sku="P1", name="P1", uom="kg")
+        cls.accepted = [
+            cls.quote(f"Q-{i}", date(2026, 2, 1 + i), "accepted", [
+                (cls.product, "2.5", "kg", "9.99", "21.00", "0.00"),
+                (None, "1", "unidad", "100.00", "10.00", "12.50"),
+                (cls.product, "3", "kg", "0.35", "4.00", "0.00"),
+            ][: 1 + i % 3])
+            for i in range(5)
+        ]
+        cls.others = [cls.quote(f"Q-{status}", date(2026, 2, 10), status) for status in ("draft", "sent", "rejected", "expired")]
+
+    @classmethod
+    def quote(cls, number, day, status, lines=()):
+        quote = Quote.objects.create(
+            org=cls.org, customer=cls.customer, number=number, date=day, status=status, billing_address="Calle 1",
+        )
+        for product, qty, uom, price, rate, discount in lines:
+            QuoteLine.objects.create(
+                quote=quote, product=product, description=f"Línea {qty}", qty=Decimal(qty), uom=uom,
+                unit_price=Decimal(price), tax_rate=Decimal(rate), discount_pct=Decimal(discount),
+            )
+        return recompute_totals(quote)
+
+    def lines(self, manager):
+        return list(manager.order_by("id").values_list(*self.LINE_FIELDS))
+
+    def test_batch_copies_lines_and_tax_bases(self):
+        result = convert_quotes(self.org, [q.id for q in self.accepted])
+
+        self.assertEqual((len(result["converted"]), result["already"], result["failed"]), (5, [], []))
+        for item in result["converted"]:
+            quote = Quote.objects.get(pk=item["quote"])
+            invoice = Invoice.objects.get(pk=item["invoice"])
+            with self.subTest(quote=quote.number):
+                self.assertEqual(quote.invoice_id, invoice.id)
+                self.assertEqual(
+                    (invoice.org_id, invoice.customer_id, invoice.date_issue, invoice.billing_address,
+                     invoice.status, invoice.number, invoice.currency),
+                    (self.org.id, quote.customer_id, quote.date, quote.billing_address, "draft", None, quote.currency),
+                )
+                self.assertEqual(self.lines(invoice.lines), self.lines(quote.lines))
+                self.assertEqual(invoice.tax_bases, quote.tax_bases)
+                self.assertEqual(
+                    (invoice.totals_base, invoice.totals_tax, invoice.total),
+                    (quote.totals_base, quote.totals_tax, quote.total),
+                )
+        # tres tipos de IVA en el presupuesto más completo
+        self.assertEqual(set(Quote.objects.get(number="Q-2").tax_bases), {"21.00", "10.00", "4.00"})
+
+    def test_tax_bases_are_copied_not_recomputed(self):
+        quote = self.accepted[0]
+        Quote.objects.filter(pk=quote.pk).update(tax_bases={"21.00": "1.00"}, totals_base=Decimal("1.00"))
+        invoice_id = convert_quotes(self.org, [quote.id])["converted"][0]["invoice"]
+        invoice = Invoice.objects.get(pk=invoice_id)
+        self.assertEqual((invoice.tax_bases, invoice.totals_base), ({"21.00": "1.00"}, Decimal("1.00")))
+
+    def test_rerun_returns_already(self):
+        ids = [q.id for q in self.accepted]
+        converted = convert_quotes(self.org, ids[:2])["converted"]
+        invoices = Invoice.objects.count()
+
+        result = convert_quotes(self.org, ids)
+
+        self.assertEqual(result["already"], converted)
+        self.assertEqual(len(result["converted"]), 3)
+        self.assertEqual(Invoice.objects.count(), invoices + 3)
+        self.assertEqual(InvoiceLine.objects.count(), QuoteLine.objects.filter(quote_id__in=ids).count())
+
+    def test_non_accepted_and_unknown_quotes_fail(self):
+        other_org = Organization.objects.create(name="Otra", slug="otra")
+        foreign = Quote.objects.create(org=other_org, customer=self.customer, number="Q-X", status="accepted")
+        ids = [q.id for q in self.others] + [foreign.id, 0, self.accepted[0].id]
+
+        result = convert_quotes(self.org, ids)
+
+        self.assertEqual([c["quote"] for c in result["converted"]], [self.accepted[0].id])
+        self.assertEqual(
+            sorted((f["id"], f["error"]) for f in result["failed"]),
+            sorted(
+                [(q.id, "Solo se pueden convertir presupuestos aceptados") for q in self.others]
+                + [(foreign.id, "Presupuesto no encontrado."), (0, "Presupuesto no encontrado.")]
+            ),
+        )
+        self.assertFalse(Quote.objects.filter(pk__in=[q.id for q in self.others], invoice__isnull=False).exists())
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_job_converts_in_chunks_and_can_be_relaunched(self):
+        ids = [q.id for q in self.accepted] + [self.others[0].id]
+
+        first = convert_quotes_job(self.org.id, ids, chunk_size=2)
+        second = convert_quotes_job(self.org.id, ids, chunk_size=2)
+
+        self.assertEqual(len(first["converted"]), 5)
+        self.assertEqual([f["id"] for f in first["failed"]], [self.others[0].id])
+        self.assertEqual(second["converted"], [])
+        self.assertEqual(second["already"], first["converted"])
+        self.assertEqual(second["failed"], first["failed"])
@@ -7,6 +7,7 @@ from .views import (
     InvoiceViewSet,
     PaymentViewSet,
     QuoteViewSet,
+    InvoicePdfView,
     InvoicePrintView,
     SalesKPIsViewSet,
 )
@@ -25,12 +26,17 @@ def health(_request):
 urlpatterns = [
     path("health/", health, name="sales-health"),
 
-    # Vista imprimible de factura (HTML)
+    # Vista imprimible de factura (HTML) y PDF
     path(
         "invoices/<int:pk>/print/",
         InvoicePrintView.as_view(),
         name="invoice-print",
     ),
+    path(
+        "invoices/<int:pk>/pdf/",
+        InvoicePdfView.as_view(),
+        name="invoice-pdf",
+    ),
 
     path("", include(router.urls)),
 ]
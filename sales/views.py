@@ -1,47 +1,96 @@
 # sales/views.py
+from datetime import timedelta
 from decimal import Decimal
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from rest_framework.exceptions import NotFound
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404, render
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from rest_framework.views import APIView
-from rest_framework.renderers import TemplateHTMLRenderer
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Sum, F
-from datetime import datetime, timedelta
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.functional import cached_property
+from django.utils.http import http_date
 
 from core.mixins import OrgScopedModelViewSet
-from .models import DeliveryNote, Invoice, Payment, Quote, InvoiceLine
+from core.models import Organization
+from inventory.services_reservations import DEFAULT_TTL as DEFAULT_RESERVATION_TTL
+from django_rq import get_queue
+from rq.job import Job
+from .models import DeliveryNote, Invoice, Payment, Quote, InvoiceLine, QuoteLine
 from .serializers import (
     DeliveryNoteSerializer,
     DeliveryNoteLineSerializer,
+    InvoiceListSerializer,
     InvoiceSerializer,
     InvoiceLineSerializer,
-    PaymentSerializer, QuoteSerializer, QuoteLineSerializer
+    PaymentSerializer, QuoteListSerializer, QuoteSerializer, QuoteLineSerializer
+)
+from inventory.models import Product, Warehouse
+from inventory.serializers import StockReservationSerializer
+from .services_delivery import (
+    add_line as dn_add_line,
+    confirm as dn_confirm,
+    release_reservations as dn_release_reservations,
+    reserve as dn_reserve,
 )
-from inventory.models import Product
-from .services_delivery import add_line as dn_add_line, confirm as dn_confirm
 from .services_invoice import (
     add_line as inv_add_line,
-    recompute_totals,
+    remove_line as inv_remove_line,
     post_invoice,
+    post_invoices,
     replace_lines as inv_replace_lines,   # 👈 nuevo
 )
 from .services_payment import register_payment
+from .jobs import convert_quotes_job
+from .services_kpis import STATUSES as KPI_STATUSES, sales_kpis
+from .services_print import (
+    CONTENT_TYPES,
+    MAX_ZIP_INVOICES,
+    ensure_pdfs,
+    get_document as get_printed_document,
+    iter_zip,
+)
+from .services_lines import parse_lines
 from .services_quote import (
     add_line as quote_add_line,
-    recompute_totals as quote_recompute,
+    remove_line as quote_remove_line,
     change_status as quote_change_status,
     convert_to_invoice as quote_convert_to_invoice,
     replace_lines as quote_replace_lines,
+    release_reservations as quote_release_reservations,
+    reserve as quote_reserve,
 )
 
 from contacts.models import Contact
-from core.models import Organization
+from analytics.hooks import (
+    register_invoice_payment_created,
+    register_invoice_payment_updated,
+    register_invoice_payment_deleted,
+)
+
+
+def reservation_ttl(data):
+    """ttl_hours del body -> timedelta (por defecto DEFAULT_TTL; 0 = sin caducidad)."""
+    value = data.get("ttl_hours")
+    if value in (None, ""):
+        return DEFAULT_RESERVATION_TTL
+    try:
+        hours = Decimal(str(value))
+    except ArithmeticError:
+        raise ValidationError({"ttl_hours": "Debe ser un número de horas."})
+    if not hours.is_finite() or hours < 0:
+        raise ValidationError({"ttl_hours": "Debe ser un número de horas no negativo."})
+    return timedelta(hours=float(hours)) if hours else None
 
 
 class DeliveryNoteViewSet(OrgScopedModelViewSet):
@@ -85,10 +134,103 @@ class DeliveryNoteViewSet(OrgScopedModelViewSet):
         dn = dn_confirm(dn, user=request.user)
         return Response(DeliveryNoteSerializer(dn).data, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=["post"])
+    def reserve(self, request, pk=None, *args, **kwargs):
+        """
+        Reserva el stock de las líneas en el almacén del albarán.
+        Body opcional: {"ttl_hours": 48} (0 = sin caducidad). Lo consume confirm.
+        """
+        dn = self.get_object()
+        reservations = dn_reserve(dn, user=request.user, ttl=reservation_ttl(request.data))
+        return Response(StockReservationSerializer(reservations, many=True).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["post"])
+    def release_reservations(self, request, pk=None, *args, **kwargs):
+        released = dn_release_reservations(self.get_object(), user=request.user)
+        return Response({"released": released}, status=status.HTTP_200_OK)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # las reservas no se borran con el documento (no hay FK): se liberan
+        dn_release_reservations(instance, user=self.request.user)
+        super().perform_destroy(instance)
 
-class InvoiceViewSet(OrgScopedModelViewSet):
+
+class SparseListMixin:
+    """
+    Listados ligeros para viewsets de documentos:
+    - list usa list_serializer_class (cabecera, sin anidados).
+    - ?fields=id,number,total limita los campos de salida.
+    - ?expand=lines,payments añade los anidados de Meta.expandable; solo se
+      hace prefetch (list_prefetch) de lo que se expande, y el JOIN con el
+      cliente solo si sale customer_detail.
+    """
+    list_serializer_class = None
+    list_prefetch = {}
+
+    def _csv_param(self, name, allowed):
+        raw = self.request.query_params.get(name)
+        if not raw:
+            return None
+        values = {v.strip() for v in raw.split(",") if v.strip()}
+        unknown = values - set(allowed)
+        if unknown:
+            raise ValidationError({name: f"No válidos: {', '.join(sorted(unknown))}. Permitidos: {', '.join(allowed)}."})
+        return values
+
+    @cached_property
+    def sparse(self):
+        """(fields o None, expand) del listado."""
+        meta = self.list_serializer_class.Meta
+        return self._csv_param("fields", meta.fields), self._csv_param("expand", meta.expandable) or set()
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return self.list_serializer_class
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        ctx = super().get_serializer_context()
+        if self.action == "list":
+            ctx["fields"], ctx["expand"] = self.sparse
+        return ctx
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action != "list":
+            return qs
+        fields, expand = self.sparse
+        qs = qs.select_related(None).prefetch_related(None)
+        if not fields or "customer_detail" in fields:
+            qs = qs.select_related("customer")
+        return qs.prefetch_related(*(self.list_prefetch[name] for name in sorted(expand)))
+
+
+class InvoiceViewSet(SparseListMixin, OrgScopedModelViewSet):
     serializer_class = InvoiceSerializer
-    queryset = Invoice.objects.select_related("customer").prefetch_related("lines", "payments")
+    list_serializer_class = InvoiceListSerializer
+    keyset_ordering = ("-date_issue", "-id")
+    queryset = Invoice.objects.select_related("customer").prefetch_related(
+        Prefetch("lines", queryset=InvoiceLine.objects.select_related("product"))
+    )
+    list_prefetch = {
+        "lines": Prefetch("lines", queryset=InvoiceLine.objects.select_related("product")),
+        "payments": Prefetch("payments", queryset=Payment.objects.order_by("date", "id")),
+    }
+
+    def perform_update(self, serializer):
+        # contabilizar solo con la acción post (numeración, stock y analítica);
+        # una factura contabilizada ya no cambia
+        if serializer.instance.status == "posted":
+            raise ValidationError("No se puede modificar una factura contabilizada.")
+        if serializer.validated_data.get("status") == "posted":
+            raise ValidationError({"status": "Usa la acción post para contabilizar la factura."})
+        super().perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        if instance.status == "posted":
+            raise ValidationError("No se puede borrar una factura contabilizada.")
+        super().perform_destroy(instance)
 
     @action(detail=True, methods=["post"])
     def add_line(self, request, pk=None, *args, **kwargs):
@@ -109,10 +251,19 @@ class InvoiceViewSet(OrgScopedModelViewSet):
             tax_rate=Decimal(str(data.get("tax_rate", "21.00"))),
             discount_pct=Decimal(str(data.get("discount_pct", "0.00"))),
         )
-        # recalculamos totales en cada línea
-        recompute_totals(inv)
+        # add_line ya actualiza bases y totales de la factura (incremental)
         return Response(InvoiceLineSerializer(line).data, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=["post"])
+    def remove_line(self, request, pk=None, *args, **kwargs):
+        """
+        Body: {"line": <id>}. Solo facturas en borrador.
+        """
+        inv = self.get_object()
+        inv = inv_remove_line(inv, request.data.get("line"))
+        getattr(inv, "_prefetched_objects_cache", {}).pop("lines", None)
+        return Response(InvoiceSerializer(inv).data, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=["post"])
     def replace_lines(self, request, pk=None, *args, **kwargs):
         """
@@ -120,36 +271,7 @@ class InvoiceViewSet(OrgScopedModelViewSet):
         Body igual que en Quote.replace_lines.
         """
         inv = self.get_object()
-        raw_lines = request.data.get("lines", [])
-
-        if not isinstance(raw_lines, list):
-            raise ValidationError("El campo 'lines' debe ser una lista.")
-
-        processed = []
-        for ln in raw_lines:
-            product_obj = None
-            product_id = ln.get("product")
-            if product_id:
-                product_obj = Product.objects.get(org=self.org, id=product_id)
-
-            qty = Decimal(str(ln.get("qty", 0)))
-            unit_price = Decimal(str(ln.get("unit_price", "0.00")))
-            tax_rate = Decimal(str(ln.get("tax_rate", "21.00")))
-            discount_pct = Decimal(str(ln.get("discount_pct", "0.00")))
-            uom = ln.get("uom") or (getattr(product_obj, "uom", "unidad") if product_obj else "unidad")
-
-            processed.append(
-                {
-                    "product": product_obj,
-                    "description": ln.get("description", ""),
-                    "qty": qty,
-                    "uom": uom,
-                    "unit_price": unit_price,
-                    "tax_rate": tax_rate,
-                    "discount_pct": discount_pct,
-                }
-            )
-
+        processed = parse_lines(self.org, request.data.get("lines", []))
         inv = inv_replace_lines(inv, lines=processed)
         return Response(InvoiceSerializer(inv).data, status=status.HTTP_200_OK)
 
@@ -160,6 +282,63 @@ class InvoiceViewSet(OrgScopedModelViewSet):
         inv = post_invoice(inv, series_default="A")
         return Response(InvoiceSerializer(inv).data, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=["post"])
+    def post_batch(self, request, *args, **kwargs):
+        """
+        Contabiliza varios borradores de una vez.
+        Body: {"ids": [1, 2, ...], "series": "A"}
+        Respuesta: {"posted": [...], "failed": [{"id", "error"}]}
+        """
+        ids = request.data.get("ids")
+        if not isinstance(ids, list) or not ids:
+            raise ValidationError({"ids": "Debe ser una lista no vacía de ids de factura."})
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            raise ValidationError({"ids": "Los ids deben ser enteros."})
+
+        result = post_invoices(self.org, ids, series_default=request.data.get("series") or "A")
+        return Response(result, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"], url_path="pdf-zip")
+    def pdf_zip(self, request, *args, **kwargs):
+        """
+        ZIP con los PDFs de varias facturas no borrador (envío de fin de mes).
+        Query: ?ids=1,2,3 o ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD
+        Los PDFs que faltan se generan en paralelo; el ZIP se envía en streaming.
+        """
+        params = request.query_params
+        invoices = Invoice.objects.filter(org=self.org)
+        if params.get("ids"):
+            try:
+                ids = [int(i) for i in params["ids"].split(",") if i.strip()]
+            except ValueError:
+                raise ValidationError({"ids": "Los ids deben ser enteros separados por comas."})
+            invoices = invoices.filter(id__in=ids)
+        try:
+            date_from, date_to = (parse_date(params[name]) if params.get(name) else None for name in ("date_from", "date_to"))
+        except ValueError:
+            date_from = date_to = None
+        if any(params.get(name) and value is None for name, value in (("date_from", date_from), ("date_to", date_to))):
+            raise ValidationError("Fechas con formato YYYY-MM-DD.")
+        if not params.get("ids") and not (date_from and date_to):
+            raise ValidationError("Indica ids o date_from y date_to.")
+        if date_from:
+            invoices = invoices.filter(date_issue__gte=date_from)
+        if date_to:
+            invoices = invoices.filter(date_issue__lte=date_to)
+        if invoices.exclude(status="draft").count() > MAX_ZIP_INVOICES:
+            raise ValidationError(f"Máximo {MAX_ZIP_INVOICES} facturas por ZIP.")
+
+        files = ensure_pdfs(self.org, invoices)
+        if not files:
+            raise NotFound("No hay facturas contabilizadas con esos filtros.")
+
+        response = StreamingHttpResponse(iter_zip(files.values()), content_type="application/zip")
+        suffix = f"{date_from}_{date_to}" if date_from and date_to else "seleccion"
+        response["Content-Disposition"] = f'attachment; filename="facturas_{suffix}.zip"'
+        return response
+
     @action(detail=True, methods=["post"])
     def register_payment(self, request, pk=None, *args, **kwargs):
         inv = self.get_object()
@@ -176,11 +355,36 @@ class InvoiceViewSet(OrgScopedModelViewSet):
 
 class PaymentViewSet(OrgScopedModelViewSet):
     serializer_class = PaymentSerializer
+    keyset_ordering = ("-date", "-id")
     queryset = Payment.objects.select_related("invoice")
 
-class QuoteViewSet(OrgScopedModelViewSet):
+    @transaction.atomic
+    def perform_create(self, serializer):
+        payment = serializer.save(org=self.org)
+        register_invoice_payment_created(payment)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_invoice = serializer.instance.invoice
+        previous_amount = serializer.instance.amount
+        payment = serializer.save(org=self.org)
+        register_invoice_payment_updated(payment, previous_invoice, previous_amount)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        register_invoice_payment_deleted(instance)
+
+class QuoteViewSet(SparseListMixin, OrgScopedModelViewSet):
     serializer_class = QuoteSerializer
-    queryset = Quote.objects.select_related("customer").prefetch_related("lines")
+    list_serializer_class = QuoteListSerializer
+    keyset_ordering = ("-date", "-id")
+    queryset = Quote.objects.select_related("customer").prefetch_related(
+        Prefetch("lines", queryset=QuoteLine.objects.select_related("product"))
+    )
+    list_prefetch = {
+        "lines": Prefetch("lines", queryset=QuoteLine.objects.select_related("product")),
+    }
 
     def perform_create(self, serializer):
         # Si el cliente no envía número, generamos uno automáticamente
@@ -212,9 +416,18 @@ class QuoteViewSet(OrgScopedModelViewSet):
             tax_rate=Decimal(str(data.get("tax_rate", "21.00"))),
             discount_pct=Decimal(str(data.get("discount_pct", "0.00"))),
         )
-        quote_recompute(quote)
         return Response(QuoteLineSerializer(line).data, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=["post"])
+    def remove_line(self, request, pk=None, *args, **kwargs):
+        """
+        Body: {"line": <id>}. Solo presupuestos en borrador o enviados.
+        """
+        quote = self.get_object()
+        quote = quote_remove_line(quote, request.data.get("line"))
+        getattr(quote, "_prefetched_objects_cache", {}).pop("lines", None)
+        return Response(QuoteSerializer(quote).data, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=["post"])
     def replace_lines(self, request, pk=None, *args, **kwargs):
         """
@@ -237,38 +450,35 @@ class QuoteViewSet(OrgScopedModelViewSet):
         }
         """
         quote = self.get_object()
-        raw_lines = request.data.get("lines", [])
-
-        if not isinstance(raw_lines, list):
-            raise ValidationError("El campo 'lines' debe ser una lista.")
-
-        processed = []
-        for ln in raw_lines:
-            product_obj = None
-            if ln.get("product"):
-                product_obj = Product.objects.get(org=self.org, id=ln["product"])
-
-            qty = Decimal(str(ln.get("qty", 0)))
-            unit_price = Decimal(str(ln.get("unit_price", "0.00")))
-            tax_rate = Decimal(str(ln.get("tax_rate", "21.00")))
-            discount_pct = Decimal(str(ln.get("discount_pct", "0.00")))
-
-            processed.append(
-                {
-                    "product": product_obj,
-                    "description": ln.get("description", ""),
-                    "qty": qty,
-                    "uom": ln.get("uom") or (getattr(product_obj, "uom", "unidad") if product_obj else "unidad"),
-                    "unit_price": unit_price,
-                    "tax_rate": tax_rate,
-                    "discount_pct": discount_pct,
-                }
-            )
-
+        processed = parse_lines(self.org, request.data.get("lines", []))
         quote = quote_replace_lines(quote, lines=processed)
         return Response(QuoteSerializer(quote).data, status=status.HTTP_200_OK)
 
 
+    @action(detail=True, methods=["post"])
+    def reserve(self, request, pk=None, *args, **kwargs):
+        """
+        Reserva el stock de las líneas con producto.
+        Body: {"warehouse": <id>, "ttl_hours": 48} (ttl_hours opcional; 0 = sin caducidad).
+        """
+        quote = self.get_object()
+        if not request.data.get("warehouse"):
+            raise ValidationError({"warehouse": "Obligatorio."})
+        warehouse = get_object_or_404(Warehouse.objects.only("id"), org=self.org, id=request.data["warehouse"])
+        reservations = quote_reserve(quote, user=request.user, warehouse_id=warehouse.id, ttl=reservation_ttl(request.data))
+        return Response(StockReservationSerializer(reservations, many=True).data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["post"])
+    def release_reservations(self, request, pk=None, *args, **kwargs):
+        released = quote_release_reservations(self.get_object(), user=request.user)
+        return Response({"released": released}, status=status.HTTP_200_OK)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # las reservas no se borran con el documento (no hay FK): se liberan
+        quote_release_reservations(instance, user=self.request.user)
+        super().perform_destroy(instance)
+
     @action(detail=True, methods=["post"])
     def mark_sent(self, request, pk=None, *args, **kwargs):
         quote = self.get_object()
@@ -287,61 +497,6 @@ class QuoteViewSet(OrgScopedModelViewSet):
         quote = quote_change_status(quote, "rejected")
         return Response(QuoteSerializer(quote).data, status=status.HTTP_200_OK)
 
-    @action(detail=True, methods=["post"])
-    def replace_lines(self, request, pk=None, *args, **kwargs):
-        """
-        Reemplaza todas las líneas del presupuesto.
-        Espera en body:
-        {
-          "lines": [
-            {
-              "product": 1 | null,
-              "description": "...",
-              "qty": 3,
-              "uom": "kg" | "unidad" | ...,
-              "unit_price": 10.5,
-              "tax_rate": 21,
-              "discount_pct": 0
-            },
-            ...
-          ]
-        }
-        """
-        quote = self.get_object()
-        raw_lines = request.data.get("lines", [])
-
-        if not isinstance(raw_lines, list):
-            raise ValidationError("El campo 'lines' debe ser una lista.")
-
-        processed = []
-        for ln in raw_lines:
-            product_obj = None
-            product_id = ln.get("product")
-            if product_id:
-                product_obj = Product.objects.get(org=self.org, id=product_id)
-
-            qty = Decimal(str(ln.get("qty", 0)))
-            unit_price = Decimal(str(ln.get("unit_price", "0.00")))
-            tax_rate = Decimal(str(ln.get("tax_rate", "21.00")))
-            discount_pct = Decimal(str(ln.get("discount_pct", "0.00")))
-            uom = ln.get("uom") or (getattr(product_obj, "uom", "unidad") if product_obj else "unidad")
-
-            processed.append(
-                {
-                    "product": product_obj,
-                    "description": ln.get("description", ""),
-                    "qty": qty,
-                    "uom": uom,
-                    "unit_price": unit_price,
-                    "tax_rate": tax_rate,
-                    "discount_pct": discount_pct,
-                }
-            )
-
-        quote = quote_replace_lines(quote, lines=processed)
-        return Response(QuoteSerializer(quote).data, status=status.HTTP_200_OK)
-
-
     @action(detail=True, methods=["post"])
     def to_invoice(self, request, pk=None, *args, **kwargs):
         quote = self.get_object()
@@ -349,122 +504,191 @@ class QuoteViewSet(OrgScopedModelViewSet):
         # devolvemos la factura generada
         return Response(InvoiceSerializer(inv).data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=["post"], url_path="to-invoice-batch")
+    def to_invoice_batch(self, request, *args, **kwargs):
+        """
+        Convierte a factura (borrador) los presupuestos aceptados y aún sin
+        factura que cumplan el filtro, en un job RQ (una transacción por bloque).
+        Body: {"ids": [1, 2, ...]} o {"date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD", "customer": id}
+        Respuesta 202: {"job_id", "quotes"}; estado en GET to-invoice-batch/<job_id>/.
+        """
+        data = request.data
+        quotes = Quote.objects.filter(org=self.org, status="accepted", invoice__isnull=True)
+        ids = data.get("ids")
+        if ids is not None:
+            if not isinstance(ids, list) or not ids:
+                raise ValidationError({"ids": "Debe ser una lista no vacía de ids de presupuesto."})
+            try:
+                quotes = quotes.filter(id__in=[int(i) for i in ids])
+            except (TypeError, ValueError):
+                raise ValidationError({"ids": "Los ids deben ser enteros."})
+
+        try:
+            date_from, date_to = (parse_date(str(data[name])) if data.get(name) else None for name in ("date_from", "date_to"))
+        except ValueError:
+            date_from = date_to = None
+        if any(data.get(name) and value is None for name, value in (("date_from", date_from), ("date_to", date_to))):
+            raise ValidationError("Fechas con formato YYYY-MM-DD.")
+        if ids is None and not (date_from and date_to):
+            raise ValidationError("Indica ids o date_from y date_to.")
+        if date_from:
+            quotes = quotes.filter(date__gte=date_from)
+        if date_to:
+            quotes = quotes.filter(date__lte=date_to)
+        if data.get("customer"):
+            quotes = quotes.filter(customer_id=data["customer"])
+
+        quote_ids = list(quotes.order_by("date", "id").values_list("id", flat=True))
+        if not quote_ids:
+            return Response({"job_id": None, "quotes": 0}, status=status.HTTP_200_OK)
+
+        job = get_queue("default").enqueue(
+            convert_quotes_job, self.org.pk, quote_ids, meta={"org_id": str(self.org.pk)}
+        )
+        return Response({"job_id": job.id, "quotes": len(quote_ids)}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=["get"], url_path=r"to-invoice-batch/(?P<job_id>[^/.]+)")
+    def to_invoice_batch_status(self, request, job_id=None, *args, **kwargs):
+        try:
+            job = Job.fetch(job_id, connection=get_queue("default").connection)
+        except Exception:
+            raise NotFound("Job no encontrado")
+        if job.meta.get("org_id") != str(self.org.pk):
+            raise NotFound("Job no encontrado")
+        job_status = job.get_status()
+        return Response({
+            "status": job_status,
+            "processed": job.meta.get("processed", 0),
+            "total": job.meta.get("total"),
+            "result": job.result if job_status == "finished" else None,
+        })
+
+class _IgnoreAcceptNegotiation(BaseContentNegotiation):
+    """Las vistas de impresión devuelven HTML/PDF sea cual sea el Accept."""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def _document_response(request, doc):
+    """Respuesta de un PrintedDocument con ETag/Last-Modified (304 si no cambió)."""
+    etag = f'"{doc.sha256}"'
+    last_modified = int(doc.last_modified.timestamp()) if doc.last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if doc.content is not None:
+            response = HttpResponse(doc.content, content_type=CONTENT_TYPES[doc.fmt])
+        else:
+            response = FileResponse(default_storage.open(doc.path, "rb"), content_type=CONTENT_TYPES[doc.fmt])
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    # el estado de cobro puede cambiar: el cliente revalida siempre
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 class InvoicePrintView(APIView):
     """
     Vista HTML imprimible de una factura concreta.
     Protegida con JWT como el resto del API.
     URL: /api/v1/t/<org_slug>/sales/invoices/<pk>/print/
+
+    Las facturas no borrador se sirven desde la impresión guardada
+    (services_print), con ETag / Last-Modified y 304 si no ha cambiado.
     """
-    renderer_classes = [TemplateHTMLRenderer]
     permission_classes = [IsAuthenticated]
-    template_name = "sales/invoice_print.html"
+    content_negotiation_class = _IgnoreAcceptNegotiation
+    fmt = "html"
 
     def get(self, request, org_slug, pk, *args, **kwargs):
-        org = get_object_or_404(Organization, slug=org_slug)
+        if request.org is None:
+            raise NotFound("Organización no encontrada.")
+        try:
+            doc = get_printed_document(request.org, pk, self.fmt)
+        except Invoice.DoesNotExist:
+            raise NotFound("Factura no encontrada.")
+        return _document_response(request, doc)
 
-        invoice = get_object_or_404(
-            Invoice.objects.select_related("customer").prefetch_related("lines"),
-            pk=pk,
-            org=org,
-        )
 
-        customer = invoice.customer
-
-        def display_contact_name(c):
-            if not c:
-                return ""
-            if c.razon_social:
-                return c.razon_social
-            full = f"{(c.nombre or '').strip()} {(c.apellidos or '').strip()}".strip()
-            if full:
-                return full
-            if c.nombre_comercial:
-                return c.nombre_comercial
-            return ""
-
-        customer_display_name = display_contact_name(customer)
-
-        # Preparamos líneas con base de línea (ya con descuento)
-        lines = []
-        for ln in invoice.lines.all():
-            qty = ln.qty or 0
-            unit = ln.unit_price or 0
-            disc = ln.discount_pct or 0
-            # base = qty * unit * (1 - disc/100)
-            base_line = qty * unit * (Decimal("1.00") - (disc / Decimal("100")))
-            lines.append(
-                {
-                    "description": ln.description,
-                    "uom": ln.uom,
-                    "qty": ln.qty,
-                    "unit_price": ln.unit_price,
-                    "tax_rate": ln.tax_rate,
-                    "discount_pct": ln.discount_pct,
-                    "base": base_line,
-                }
-            )
-
-        context = {
-            "invoice": invoice,
-            "org": org,
-            "customer": customer,
-            "customer_display_name": customer_display_name,
-            "lines": lines,
-        }
-
-        return Response(context, template_name=self.template_name)
+class InvoicePdfView(InvoicePrintView):
+    """
+    PDF de una factura (reportlab), mismo contenido que la vista HTML.
+    URL: /api/v1/t/<org_slug>/sales/invoices/<pk>/pdf/
+    """
+    fmt = "pdf"
 
 
 class SalesKPIsViewSet(viewsets.ViewSet):
-    @action(detail=False, methods=['get'])
-    def total_sales_by_period(self, request, org_slug=None):
+    def _org(self, request, org_slug):
+        org = getattr(request, "org", None)
+        if org:
+            return org
         if org_slug is None:
             raise NotFound("Organization slug is required")
+        return get_object_or_404(Organization.objects.only("id", "slug"), slug=org_slug)
+
+    @staticmethod
+    def _date(params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError({name: "Formato de fecha inválido. Usa YYYY-MM-DD."})
+        return parsed
+
+    @staticmethod
+    def _int(params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: "Debe ser un entero."})
 
-        start_date = request.query_params.get('start_date', None)
-        end_date = request.query_params.get('end_date', None)
-        customer_id = request.query_params.get('customer_id', None)
-        product_category = request.query_params.get('product_category', None)
-        status = request.query_params.get('status', None)
-        compare_with_previous_period = request.query_params.get('compare_with_previous_period', False)
-
-        sales_query = Invoice.objects.filter(org__slug=org_slug)
-
-        if start_date:
-            sales_query = sales_query.filter(date__gte=start_date)
-        if end_date:
-            sales_query = sales_query.filter(date__lte=end_date)
-        if customer_id:
-            sales_query = sales_query.filter(customer_id=customer_id)
-        if product_category:
-            sales_query = sales_query.filter(lines__product__category=product_category)  # Filter by product category in lines
-        if status:
-            sales_query = sales_query.filter(status=status)
-
-        # Calculate total sales
-        total_sales = sales_query.aggregate(total_sales=Sum('total'))['total_sales']
-
-        # Calculate margin (using invoice lines for product prices)
-        total_margin = 0
-        for invoice in sales_query:
-            total_margin += sum(line.product.price for line in invoice.lines.all())  # Using price instead of cost
-
-        if compare_with_previous_period:
-            # Calculate previous period's sales (e.g., last month)
-            previous_period_start = datetime.strptime(start_date, "%Y-%m-%d") - timedelta(days=30)
-            previous_period_end = datetime.strptime(end_date, "%Y-%m-%d") - timedelta(days=30)
-
-            sales_query_previous = Invoice.objects.filter(org__slug=org_slug, date__gte=previous_period_start, date__lte=previous_period_end)
-            total_sales_previous = sales_query_previous.aggregate(total_sales=Sum('total'))['total_sales']
-            total_margin_previous = 0
-            for invoice in sales_query_previous:
-                total_margin_previous += sum(line.product.price for line in invoice.lines.all())  # Using price for comparison
-
-            return Response({
-                'total_sales': total_sales,
-                'total_margin': total_margin,
-                'previous_period_sales': total_sales_previous,
-                'previous_period_margin': total_margin_previous
-            })
-
-        return Response({'total_sales': total_sales, 'total_margin': total_margin})
\ No newline at end of file
+    @action(detail=False, methods=['get'])
+    def total_sales_by_period(self, request, org_slug=None):
+        """
+        Ventas, ingreso con descuento y margen (sobre coste) de un periodo.
+        Query: start_date, end_date, customer_id, product_category, status
+        (por defecto posted; "all" = todos) y compare_with_previous_period,
+        que añade el periodo anterior de la misma duración y la variación.
+        Dos agregaciones en total (ver services_kpis).
+        """
+        params = request.query_params
+        org = self._org(request, org_slug)
+        start_date = self._date(params, "start_date")
+        end_date = self._date(params, "end_date")
+        if start_date and end_date and start_date > end_date:
+            raise ValidationError("start_date no puede ser posterior a end_date.")
+
+        status_param = params.get("status") or "posted"
+        if status_param != "all" and status_param not in KPI_STATUSES:
+            raise ValidationError({"status": f"Valores: {', '.join(KPI_STATUSES)} o all."})
+
+        compare = params.get("compare_with_previous_period", "").lower() in ("1", "true", "yes")
+        if compare and not (start_date and end_date):
+            raise ValidationError("Para comparar con el periodo anterior indica start_date y end_date.")
+
+        data = sales_kpis(
+            org, start_date, end_date,
+            status=None if status_param == "all" else status_param,
+            customer_id=self._int(params, "customer_id"),
+            category_id=self._int(params, "product_category"),
+            compare=compare,
+        )
+        # claves de siempre
+        data["total_sales"] = data["total"]
+        data["total_margin"] = data["margin"]
+        if compare:
+            data["previous_period_sales"] = data["previous_period"]["total"]
+            data["previous_period_margin"] = data["previous_period"]["margin"]
+        return Response(data)